@@ -0,0 +1,60 @@
+"""Compares the serial, thread and process executors of scripts.data_ingestion.combine_dir_data.
+
+Usage:
+    python benchmarks/bench_ingestion.py [num_files] [rows_per_file]
+
+A directory of synthetic CSV files shaped like the raw market data is generated in
+a temporary directory, then combined once with every executor.
+"""
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+root_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(root_path)
+sys.path.append(os.path.join(root_path, 'scripts'))
+import logging
+from scripts import data_ingestion
+
+executors = ['serial', 'thread', 'process']
+
+
+def write_synthetic_csvs(directory, num_files, rows_per_file):
+    rng = np.random.default_rng(0)
+    dates = pd.date_range('1990-01-01', periods=rows_per_file, freq='D').strftime('%Y-%m-%d')
+    for i in range(num_files):
+        close = rng.lognormal(3, 1, rows_per_file)
+        pd.DataFrame({
+            'Date': dates,
+            'Open': close * rng.uniform(0.98, 1.02, rows_per_file),
+            'High': close * 1.02,
+            'Low': close * 0.98,
+            'Close': close,
+            'Adj Close': close * 0.9,
+            'Volume': rng.integers(0, 10 ** 7, rows_per_file),
+        }).to_csv(os.path.join(directory, f'SYM{i}.csv'), index=False)
+
+def main():
+    num_files = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    rows_per_file = int(sys.argv[2]) if len(sys.argv) > 2 else 2500
+    # keep the per-file log lines out of the timings
+    data_ingestion.logger.setLevel(logging.WARNING)
+    with tempfile.TemporaryDirectory() as directory:
+        write_synthetic_csvs(directory, num_files, rows_per_file)
+        print(f"{num_files} files of {rows_per_file} rows, {os.cpu_count()} CPUs")
+        print(f"{'executor':>10} {'time (s)':>10} {'rows':>10}")
+        reference = None
+        for executor in executors:
+            start = time.perf_counter()
+            df = data_ingestion.combine_dir_data(directory, executor=executor)
+            elapsed = time.perf_counter() - start
+            if reference is None:
+                reference = df
+            else:
+                pd.testing.assert_frame_equal(df, reference)
+            print(f"{executor:>10} {elapsed:>10.2f} {len(df):>10}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""Compares Parquet writer settings of scripts.util.data_handling.write_parquet.
+
+Usage:
+    python benchmarks/bench_parquet_writer.py [num_symbols] [rows_per_symbol]
+
+A synthetic table shaped like the processed market data, in date order like the files
+written by the ingestion, is written once per combination of codec, row-group size,
+dictionary encoding and sort order. Every file is then read back in full, and with the
+projection and symbol filter of a single-symbol lookup, to time the downstream reads.
+"""
+import itertools
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from pyarrow import parquet
+root_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(root_path)
+from scripts.util.data_handling import label_type, write_parquet
+
+# (codec, level) pairs, None keeps the default level of the codec
+codecs = [('none', None), ('snappy', None), ('zstd', 1), ('zstd', 9), ('gzip', 6)]
+row_group_sizes = [64 * 1024, 1024 ** 2]
+dictionary_options = [True, False]
+sort_orders = [[], ['Symbol', 'Date']]
+
+
+def synthetic_table(num_symbols, rows_per_symbol):
+    rng = np.random.default_rng(0)
+    dates = pd.date_range('1990-01-01', periods=rows_per_symbol, freq='D')
+    symbols = np.array([f'SYM{i}' for i in range(num_symbols)])
+    close = rng.lognormal(3, 1, num_symbols * rows_per_symbol).astype(np.float32)
+    table = pa.table({
+        'Date': np.tile(dates.values, num_symbols),
+        'Open': close * 1.01,
+        'High': close * 1.02,
+        'Low': close * 0.98,
+        'Close': close,
+        'Adj Close': close * 0.9,
+        'Volume': rng.integers(0, 10 ** 7, len(close)).astype(np.float64),
+        'Symbol': pa.array(np.repeat(symbols, rows_per_symbol)).cast(label_type),
+        'asset_class': pa.array(np.repeat('stocks', len(close))).cast(label_type),
+    })
+    # the processed data is in date order, every symbol interleaved
+    return table.take(np.argsort(table.column('Date').to_numpy(), kind='stable'))
+
+def timed(function):
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+def main():
+    num_symbols = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    rows_per_symbol = int(sys.argv[2]) if len(sys.argv) > 2 else 2500
+    table = synthetic_table(num_symbols, rows_per_symbol)
+    lookup = dict(columns=['Date', 'Volume', 'Adj Close'], filters=[('Symbol', '=', 'SYM7')])
+    print(f"{num_symbols} symbols of {rows_per_symbol} rows, {table.nbytes / 1024 ** 2:.0f} MB in memory")
+    print(f"{'codec':>8} {'level':>5} {'row group':>9} {'dict':>5} {'sort':>11} "
+          f"{'write (s)':>9} {'size (MB)':>9} {'read (s)':>8} {'lookup (s)':>10}")
+    with tempfile.TemporaryDirectory() as directory:
+        file_path = os.path.join(directory, 'data.parquet')
+        for (codec, level), row_group_size, use_dictionary, sort_by in itertools.product(
+                codecs, row_group_sizes, dictionary_options, sort_orders):
+            write_time = timed(lambda: write_parquet(
+                table, file_path, sort_by=sort_by, sorted_by='Date', row_group_size=row_group_size,
+                compression=codec, compression_level=level, use_dictionary=use_dictionary))
+            size = os.path.getsize(file_path) / 1024 ** 2
+            read_time = timed(lambda: parquet.read_table(file_path).to_pandas())
+            lookup_time = timed(lambda: parquet.read_table(file_path, **lookup).to_pandas())
+            print(f"{codec:>8} {str(level or '-'):>5} {row_group_size:>9} {str(use_dictionary):>5} "
+                  f"{','.join(sort_by) or '-':>11} {write_time:>9.2f} {size:>9.1f} {read_time:>8.2f} {lookup_time:>10.3f}")
+
+if __name__ == '__main__':
+    main()
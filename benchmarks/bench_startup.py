@@ -0,0 +1,90 @@
+"""Measures how long a gunicorn deployment of the web API takes to answer its first /predict.
+
+Usage:
+    python benchmarks/bench_startup.py
+
+For 1, 4 and 16 workers, with and without preloading the app in the master, gunicorn
+is started from web_api/ and /predict is polled until it succeeds. The time to the
+first success, the time until every worker has booted and the summed unique memory
+(USS) of the workers are reported.
+"""
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+web_api_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'web_api')
+worker_counts = [1, 4, 16]
+query = '/predict?vol_moving_avg=12345&adj_close_rolling_med=25'
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def children(pid):
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            return [int(child) for child in f.read().split()]
+    except OSError:
+        return []
+
+def unique_memory(pid):
+    """Returns the private memory of a process in MB, 0 where /proc is unavailable."""
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            fields = dict(line.split(':', 1) for line in f if ':' in line)
+        private = sum(int(fields[key].split()[0]) for key in ('Private_Clean', 'Private_Dirty'))
+        return private / 1024
+    except (OSError, KeyError):
+        return 0.0
+
+def measure(workers, preload, timeout=120):
+    port = free_port()
+    env = dict(os.environ, GUNICORN_PRELOAD='1' if preload else '0')
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-w', str(workers), '-b', f'127.0.0.1:{port}', 'app:app'],
+        cwd=web_api_path, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    first_prediction = all_booted = None
+    try:
+        while time.perf_counter() - start < timeout:
+            if first_prediction is None:
+                try:
+                    with urllib.request.urlopen(f'http://127.0.0.1:{port}{query}', timeout=1) as response:
+                        if response.status == 200:
+                            first_prediction = time.perf_counter() - start
+                except OSError:
+                    pass
+            if all_booted is None and len(children(server.pid)) == workers:
+                all_booted = time.perf_counter() - start
+            if first_prediction is not None and all_booted is not None:
+                break
+            time.sleep(0.01)
+        # give lazily loading workers a chance to serve before reading their memory
+        for _ in range(workers * 2):
+            try:
+                urllib.request.urlopen(f'http://127.0.0.1:{port}{query}', timeout=1).read()
+            except OSError:
+                pass
+        memory = sum(unique_memory(pid) for pid in children(server.pid))
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait()
+    return first_prediction, all_booted, memory
+
+def main():
+    print(f"{'workers':>8} {'preload':>8} {'first /predict (s)':>19} {'all booted (s)':>15} {'workers USS (MB)':>17}")
+    for workers in worker_counts:
+        for preload in (False, True):
+            first_prediction, all_booted, memory = measure(workers, preload)
+            print(f"{workers:>8} {str(preload):>8} {first_prediction or float('nan'):>19.2f} "
+                  f"{all_booted or float('nan'):>15.2f} {memory:>17.1f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""Benchmarks the numpy tree predictor of the web API against LightGBM's native predictor.
+
+Usage:
+    python benchmarks/bench_tree_predictor.py [path/to/lightgbm_predictor.joblib]
+
+Without a model path, a model is trained on synthetic data with the parameters
+used by scripts/train_model.train_model.
+"""
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+import joblib
+import lightgbm as lgb
+root_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(root_path)
+sys.path.append(os.path.join(root_path, 'web_api'))
+from scripts.train_model import export_tree_arrays
+from tree_predictor import TreePredictor
+
+batch_sizes = [1, 10, 100, 1000, 10000, 100000]
+
+
+def synthetic_model(rows=200000):
+    rng = np.random.default_rng(0)
+    X = pd.DataFrame({
+        'vol_moving_avg': rng.lognormal(12, 3, rows),
+        'adj_close_rolling_med': rng.lognormal(2, 2, rows),
+    })
+    y = X['vol_moving_avg'] * rng.lognormal(0, 0.5, rows)
+    model = lgb.LGBMRegressor(boosting_type='gbdt', num_leaves=31, max_depth=-1,
+                              learning_rate=0.1, n_estimators=500, verbose=-1)
+    model.fit(X, y)
+    return model
+
+def best_time(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+def main():
+    model = joblib.load(sys.argv[1]) if len(sys.argv) > 1 else synthetic_model()
+    booster = getattr(model, 'booster_', model)
+    start = time.perf_counter()
+    predictor = TreePredictor(export_tree_arrays(booster))
+    print(f"export + compile: {time.perf_counter() - start:.3f}s "
+          f"({'table' if predictor.table is not None else 'traversal'} mode)")
+
+    rng = np.random.default_rng(1)
+    print(f"{'batch':>8} {'native (s)':>12} {'numpy (s)':>12} {'speedup':>8} {'max rel err':>12}")
+    for batch_size in batch_sizes:
+        X = np.column_stack([rng.lognormal(12, 3, batch_size), rng.lognormal(2, 2, batch_size)])
+        repeat = max(3, min(200, 100000 // batch_size))
+        native = best_time(lambda: booster.predict(X), repeat)
+        compiled = best_time(lambda: predictor.predict(X), repeat)
+        expected = booster.predict(X)
+        error = np.max(np.abs(predictor.predict(X) - expected) / np.maximum(1.0, np.abs(expected)))
+        print(f"{batch_size:>8} {native:>12.6f} {compiled:>12.6f} {native / compiled:>8.1f} {error:>12.2e}")
+
+if __name__ == '__main__':
+    main()
@@ -15,7 +15,8 @@ sys.path.append(scripts_dir)
 
 from scripts.data_ingestion import ingest_data
 from scripts.data_augmentation import transform_data
-from scripts.train_model import deploy_model
+from scripts.train_model import deploy_model, export_feature_store
+from util.data_handling import check_persisted
 
 default_args = {
     'owner': 'my_name',
@@ -27,9 +28,72 @@ default_args = {
 
 dag = DAG('data_pipeline', default_args=default_args, schedule_interval=None, is_paused_upon_creation=True)
 
+# PIPELINE_HANDOFF=1 passes data between the tasks through Arrow IPC files in shared memory, which needs
+# every task to run on the same host; the parquet files are still written, in the background
+handoff = os.environ.get('PIPELINE_HANDOFF', '0') == '1'
+
 # Define the tasks
-task_ingest = PythonOperator(task_id='ingest_data', python_callable=ingest_data, dag=dag)
-task_transform = PythonOperator(task_id='transform_data', python_callable=transform_data, dag=dag)
-taks_model_deployment = PythonOperator(task_id='deploy_model', python_callable=deploy_model, dag=dag)
+# INGESTION_MODE and INGESTION_EXECUTOR select how raw CSVs are combined, see scripts.data_ingestion.ingest_data
+task_ingest = PythonOperator(
+    task_id='ingest_data',
+    python_callable=ingest_data,
+    op_kwargs={
+        'mode': os.environ.get('INGESTION_MODE', 'pandas'),
+        'executor': os.environ.get('INGESTION_EXECUTOR', 'thread'),
+        'handoff': handoff,
+    },
+    dag=dag,
+)
+# AUGMENTATION_ENGINE, AUGMENTATION_EXECUTOR and AUGMENTATION_MODE select how rolling features are computed,
+# and AUGMENTATION_FEATURES which ones as a comma separated list, see scripts.data_augmentation.transform_data
+task_transform = PythonOperator(
+    task_id='transform_data',
+    python_callable=transform_data,
+    op_kwargs={
+        'engine': os.environ.get('AUGMENTATION_ENGINE', 'pandas'),
+        'executor': os.environ.get('AUGMENTATION_EXECUTOR', 'thread'),
+        'mode': os.environ.get('AUGMENTATION_MODE', 'full'),
+        'features': [_ for _ in os.environ.get('AUGMENTATION_FEATURES', '').split(',') if _] or None,
+        'handoff': handoff,
+    },
+    dag=dag,
+)
+# TRAINING_LOADER selects how the training data is loaded, and TRAINING_MODE, TRAINING_SPLIT and TRAINING_TRIALS
+# whether and how hyperparameters are searched, TRAINING_DATASET_CACHE=1 reuses the binned datasets of earlier runs
+# on the same data; TRAINING_MODE=incremental updates the deployed model with the rows added since its last training,
+# as TRAINING_UPDATE selects, and retrains it from scratch every TRAINING_FULL_RETRAIN_DAYS days;
+# TRAINING_MODE=sharded trains one model per TRAINING_SHARD_BY (asset_class or cluster) for the web API to route to,
+# see scripts.train_model.deploy_model
+taks_model_deployment = PythonOperator(
+    task_id='deploy_model',
+    python_callable=deploy_model,
+    op_kwargs={
+        'handoff': handoff,
+        'loader': os.environ.get('TRAINING_LOADER', 'pandas'),
+        'mode': os.environ.get('TRAINING_MODE', 'fixed'),
+        'split': os.environ.get('TRAINING_SPLIT', 'time'),
+        'num_trials': int(os.environ.get('TRAINING_TRIALS', 16)),
+        'cache': os.environ.get('TRAINING_DATASET_CACHE', '0') == '1',
+        'update': os.environ.get('TRAINING_UPDATE', 'boost'),
+        'full_retrain_days': float(os.environ.get('TRAINING_FULL_RETRAIN_DAYS', 7)),
+        'shard_by': os.environ.get('TRAINING_SHARD_BY', 'asset_class'),
+        'num_clusters': int(os.environ.get('TRAINING_SHARD_CLUSTERS', 8)),
+    },
+    dag=dag,
+)
+# writes the latest window of every symbol for the features the web API looks up by symbol
+task_export_features = PythonOperator(
+    task_id='export_feature_store',
+    python_callable=export_feature_store,
+    op_kwargs={'handoff': handoff},
+    dag=dag,
+)
+
+# waits for the parquet files written in the background by the handoff and fails on any that could not be written
+task_check_persisted = PythonOperator(
+    task_id='check_persisted',
+    python_callable=check_persisted,
+    dag=dag,
+)
 
-task_ingest >> task_transform >> taks_model_deployment
\ No newline at end of file
+task_ingest >> task_transform >> [taks_model_deployment, task_export_features] >> task_check_persisted
\ No newline at end of file
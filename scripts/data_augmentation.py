@@ -4,13 +4,38 @@ import sys
 root_path = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(root_path)
 import logging
+import hashlib
+import shutil
 import time
 import concurrent.futures
-from util.data_handling import import_parquet_as_df, export_df_as_parquet
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from pyarrow import parquet
+from util.data_handling import (
+    CopyTracker,
+    check_persisted,
+    compact_market_data,
+    discard_handoff,
+    drop_index_columns,
+    import_parquet_as_df,
+    import_parquet_table,
+    export_df_as_parquet,
+    export_table_as_parquet,
+    memory_report,
+    parquet_source,
+    path,
+    sort_table,
+    validate_table,
+    write_parquet,
+)
+from util.feature_engine import RollingFeatureEngine
+from util.feature_registry import FeatureRegistry
 
 # data paths for persistence
 current_dir = os.path.dirname(os.path.abspath(__file__))
-from data_ingestion import data_ingestion_output_path
+from data_ingestion import data_ingestion_output_path, load_manifest, save_manifest
 data_directory = os.path.join(current_dir, '..', 'data')
 data_augmentation_output_path = os.path.join(data_directory, 'training')
 
@@ -69,7 +94,7 @@ def calculate_volume_moving_average(dataframe, window='30D'):
     # dataframe['vol_moving_avg'] = (
     column = (
         dataframe[['Symbol', 'Date', 'Volume']]
-        .groupby('Symbol', as_index=False)
+        .groupby('Symbol', as_index=False, observed=True)
         .rolling(window, on='Date')
         .mean()['Volume']
     )
@@ -91,14 +116,82 @@ def calculate_adj_rolling_median(dataframe, window='30D'):
     # dataframe['adj_close_rolling_med'] = (
     column = (
         dataframe[['Symbol', 'Date', 'Adj Close']]
-        .groupby('Symbol', as_index=False)
+        .groupby('Symbol', as_index=False, observed=True)
         .rolling(window, on='Date')
         .median()['Adj Close']
     )
     return ['adj_close_rolling_med', column]
 
 
-def read_data(file_name):
+def calculate_rolling_features(dataframe, window='30D'):
+    """Calculates the volume moving average and the adjusted rolling median in a single pass.
+
+    Uses the numpy RollingFeatureEngine, which sorts the data and finds the symbol groups
+    once for both features, and gives the same results as calculate_volume_moving_average
+    and calculate_adj_rolling_median.
+
+    Args:
+        dataframe: The pandas DataFrame to calculate the features for.
+        window: The size of the rolling window used for both features.
+
+    Returns:
+        A list of [column name, pd.Series] pairs, aligned on the index of the DataFrame.
+    """
+    engine = RollingFeatureEngine(dataframe)
+    return [
+        ['vol_moving_avg', engine.mean('Volume', window)],
+        ['adj_close_rolling_med', engine.median('Adj Close', window)],
+    ]
+
+
+# features computed by the numpy engine, each declaring the columns it reads, its window and
+# the features it depends on
+registry = FeatureRegistry()
+# features added to the augmented data when none are requested, the inputs of the model
+default_features = ['vol_moving_avg', 'adj_close_rolling_med']
+
+
+@registry.register('vol_moving_avg', inputs=['Volume'], window='30D')
+def vol_moving_avg(engine, window, dependencies):
+    return engine.mean('Volume', window)
+
+
+@registry.register('adj_close_rolling_med', inputs=['Adj Close'], window='30D')
+def adj_close_rolling_med(engine, window, dependencies):
+    return engine.median('Adj Close', window)
+
+
+@registry.register('vol_moving_avg_7d', inputs=['Volume'], window='7D')
+def vol_moving_avg_7d(engine, window, dependencies):
+    return engine.mean('Volume', window)
+
+
+@registry.register('vol_moving_avg_90d', inputs=['Volume'], window='90D')
+def vol_moving_avg_90d(engine, window, dependencies):
+    return engine.mean('Volume', window)
+
+
+@registry.register('daily_return', inputs=['Adj Close'])
+def daily_return(engine, window, dependencies):
+    return engine.dataframe['Adj Close'] / engine.shift('Adj Close') - 1
+
+
+@registry.register('volatility_30d', window='30D', dependencies=['daily_return'])
+def volatility_30d(engine, window, dependencies):
+    return engine.std(dependencies['daily_return'], window)
+
+
+@registry.register('dollar_volume', inputs=['Close', 'Volume'])
+def dollar_volume(engine, window, dependencies):
+    return engine.dataframe['Close'] * engine.dataframe['Volume']
+
+
+@registry.register('vwap_30d', inputs=['Volume'], window='30D', dependencies=['dollar_volume'])
+def vwap_30d(engine, window, dependencies):
+    return engine.sum(dependencies['dollar_volume'], window) / engine.sum('Volume', window)
+
+
+def read_data(file_name, tracker=None, handoff=False):
     """Reads a parquet file with the given name and returns a pandas DataFrame.
     
     If an exception is raised, logs an error message.
@@ -106,6 +199,8 @@ def read_data(file_name):
     
     Args:
         file_name: The name of the parquet file to read.
+        tracker: Optionally records the bytes copied to read the data.
+        handoff: Reads the data handed off by ingest_data instead, when there is one.
     
     Returns:
         The pandas DataFrame read from the parquet file.
@@ -113,8 +208,9 @@ def read_data(file_name):
     try:
         logger.info(f"Attempting to retrieve {file_name}.parquet")
         logger.info(f"Path {os.path.exists(os.path.join(data_directory, 'processed'))}")
-        df = import_parquet_as_df('processed', file_name)
+        df = compact_market_data(import_parquet_as_df('processed', file_name, tracker=tracker, handoff=handoff), tracker)
         logger.info(f"Successfully retrieved {file_name}.parquet")
+        logger.info(f"{file_name}.parquet memory usage: {memory_report(df)}")
         logger.info(f"{file_name}.parquet statistics: ")
         logger.info(df.describe().to_string())
         return df
@@ -122,12 +218,14 @@ def read_data(file_name):
         logger.error(f"Failed to open {file_name}.parquet. Error message: {str(e)}")
 
 
-def save_data(dataframe, file_name):
+def save_data(dataframe, file_name, tracker=None, handoff=False):
     """Saves a given dataframe as a parquet file with the specified file name.
 
     Args:
         dataframe (pandas.DataFrame): The dataframe to be saved.
         file_name (str): The name of the parquet file to be saved.
+        tracker (CopyTracker): Optionally records the bytes copied to convert the dataframe.
+        handoff (bool): Hands the data off to deploy_model and writes the parquet file asynchronously.
 
     Raises:
         Exception: If the dataframe cannot be saved as a parquet file.
@@ -138,48 +236,531 @@ def save_data(dataframe, file_name):
     try:
 
         logger.info(f"Attempting to save data as {file_name}.parquet")
-        export_df_as_parquet(dataframe, 'training', file_name)
-        logger.info(f"Data successfully saved to {file_name}.parquet")
+        export_df_as_parquet(dataframe, 'training', file_name, tracker, handoff)
+        if handoff:
+            logger.info(f"Data handed off as {file_name}, writing {file_name}.parquet in the background")
+        else:
+            logger.info(f"Data successfully saved to {file_name}.parquet")
     except Exception as e:
         logger.error(f"Failed to save {file_name}.parquet. Error message: {str(e)}")
         raise e
 
-def transform_data():
+def symbol_row_counts(file_name):
+    """Returns the number of rows of every symbol of a processed dataset, reading only its Symbol column.
+
+    Args:
+        file_name: The name of the parquet file, or dataset directory, in data/processed.
+
+    Returns:
+        A list of (symbol, number of rows) pairs sorted by symbol.
+    """
+    symbols = parquet.read_table(parquet_source('processed', file_name), columns=['Symbol'], partitioning='hive')
+    counts = pc.value_counts(symbols.column('Symbol').cast(pa.string())).to_pylist()
+    return sorted((count['values'], count['counts']) for count in counts)
+
+
+def plan_symbol_shards(symbol_counts, num_shards):
+    """Splits sorted symbols into contiguous ranges holding roughly the same number of rows.
+
+    A symbol is never split across shards, since its rolling windows need all of its rows.
+
+    Args:
+        symbol_counts: The (symbol, number of rows) pairs, sorted by symbol.
+        num_shards: The largest number of shards to plan.
+
+    Returns:
+        A list of (first symbol, last symbol) pairs, both inclusive.
+    """
+    total_rows = sum(count for _, count in symbol_counts)
+    shard_rows = max(1, -(-total_rows // max(1, num_shards)))
+    shards = []
+    first, rows = None, 0
+    for symbol, count in symbol_counts:
+        if first is None:
+            first = symbol
+        rows += count
+        if rows >= shard_rows:
+            shards.append((first, symbol))
+            first, rows = None, 0
+    if first is not None:
+        shards.append((first, symbol_counts[-1][0]))
+    return shards
+
+
+def check_features(engine, features):
+    """Returns the names of the requested features, the default ones when features is None.
+
+    Raises:
+        ValueError: If a feature is unknown, or the pandas engine is asked for other features than the default ones.
+    """
+    names = list(features) if features else list(default_features)
+    registry.resolve(names)
+    if engine == 'pandas' and names != default_features:
+        raise ValueError(f"The pandas engine only computes {default_features}")
+    return names
+
+
+def add_features(dataframe, engine='numpy', window=None, features=None):
+    """Adds the columns of the requested features to a DataFrame in place.
+
+    Args:
+        dataframe: The pandas DataFrame to add the features to.
+        engine: 'numpy' computes the features with the feature registry,
+                'pandas' with the pandas groupby rolling functions.
+        window: Overrides the rolling window of every feature, None keeps the window of each feature.
+        features: The names of the features to add, the default features when None.
+    """
+    names = check_features(engine, features)
+    if engine == 'numpy':
+        values = registry.compute(dataframe, names, window)
+        features = [[name, values[name]] for name in names]
+    else:
+        features = [
+            calculate_volume_moving_average(dataframe, window or '30D'),
+            calculate_adj_rolling_median(dataframe, window or '30D'),
+        ]
+    for column_name, column_value in features:
+        dataframe[column_name] = column_value
+
+
+def augment_table(table, engine='numpy', window=None, features=None, tracker=None):
+    """Returns a pyarrow Table of market data with the columns of the requested features appended.
+
+    Only the columns the features read are converted to pandas, and the feature values are
+    appended to the table as they are, so the other columns are never copied.
+
+    Args:
+        table: The pyarrow Table of market data.
+        engine: The engine computing the features, see add_features.
+        window: Overrides the rolling window of every feature, None keeps the window of each feature.
+        features: The names of the features to add, the default features when None.
+        tracker: Optionally records the bytes copied to convert the input columns to pandas.
+    """
+    names = check_features(engine, features)
+    columns = registry.input_columns(names) if engine == 'numpy' else ['Symbol', 'Date', 'Volume', 'Adj Close']
+    df = table.select(columns).to_pandas(ignore_metadata=True)
+    if tracker is not None:
+        tracker.record('to_pandas', df.memory_usage(deep=True).sum())
+    if engine == 'pandas':
+        # pandas needs the rows of every symbol in date order, the index restores the table order
+        df = df.sort_values('Date', kind='stable')
+        add_features(df, engine, window, names)
+        df = df.sort_index()
+    else:
+        add_features(df, engine, window, names)
+    for name in names:
+        table = table.append_column(name, pa.array(df[name].to_numpy(dtype=np.float64)))
+    return table
+
+
+def publish_dataset(tmp_path, output_name):
+    """Replaces the dataset directory output_name in data/training with a completely written temporary directory.
+
+    A parquet file of the same name is removed since it would take precedence over the dataset when reading,
+    and so is the state of incremental_transform_data, which described the previous dataset.
+    """
+    dataset_path = path('training', output_name, '')
+    shutil.rmtree(dataset_path, ignore_errors=True)
+    os.replace(tmp_path, dataset_path)
+    for stale_path in (path('training', output_name, '.parquet'), path('training', output_name + '_state', '.json')):
+        if os.path.exists(stale_path):
+            os.remove(stale_path)
+
+
+def augment_shard(file_name, shard_path, symbol_range, engine='numpy', window=None, features=None):
+    """Computes the features of the symbols in a range and writes them to their own parquet file.
+
+    Runs in a worker process: the shard is read from disk with a predicate on Symbol and
+    written straight back, so no DataFrame is sent between processes.
+
+    Args:
+        file_name: The name of the processed parquet file, or dataset directory, to read.
+        shard_path: The path of the parquet file written for the shard.
+        symbol_range: The (first symbol, last symbol) pair of the shard, both inclusive, None reads every symbol.
+        engine: The engine computing the features, see add_features.
+        window: Overrides the rolling window of every feature, None keeps the window of each feature.
+        features: The names of the features to add, the default features when None.
+
+    Returns:
+        The number of rows written.
+    """
+    filters = None
+    if symbol_range is not None:
+        first, last = symbol_range
+        filters = [('Symbol', '>=', first), ('Symbol', '<=', last)]
+    # the index a DataFrame was saved with means nothing once rows are filtered and sharded
+    table = drop_index_columns(import_parquet_table('processed', file_name, filters=filters))
+    table = augment_table(table, engine, window, features)
+    write_parquet(table.replace_schema_metadata(None), shard_path)
+    return len(table)
+
+
+def transform_data_in_processes(input_name, output_name, engine='numpy', num_workers=None, window=None, features=None):
+    """Computes the features of a processed dataset on a process pool, one symbol range per task.
+
+    The shards are written as parquet files of a dataset directory in data/training, built
+    in a temporary directory that replaces the previous one once complete. A parquet file
+    of the same name is removed since it would take precedence over the dataset when reading.
+
+    Args:
+        input_name: The name of the processed parquet file, or dataset directory, to read.
+        output_name: The name of the dataset directory written in data/training.
+        engine: The engine computing the features of each shard, see augment_shard.
+        num_workers: The number of worker processes, defaults to the number of CPUs.
+        window: Overrides the rolling window of every feature, None keeps the window of each feature.
+        features: The names of the features to add, the default features when None.
+
+    Returns:
+        The number of rows written.
+    """
+    num_workers = num_workers or os.cpu_count() or 1
+    # a few shards per worker keeps every worker busy when symbols differ in size
+    shards = plan_symbol_shards(symbol_row_counts(input_name), num_workers * 4)
+    dataset_path = path('training', output_name, '')
+    tmp_path = dataset_path.rstrip(os.sep) + '.tmp'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = [
+            executor.submit(
+                augment_shard,
+                input_name,
+                os.path.join(tmp_path, f'part-{index:05d}.parquet'),
+                symbol_range,
+                engine,
+                window,
+                features,
+            )
+            for index, symbol_range in enumerate(shards)
+        ]
+        num_rows = sum(future.result() for future in futures)
+    publish_dataset(tmp_path, output_name)
+    return num_rows
+
+
+def transform_data_in_arrow(input_name, output_name, engine='numpy', window=None, features=None, tracker=None,
+                            handoff=False):
+    """Computes the features of a processed dataset and writes them as a parquet file sorted by date, in Arrow.
+
+    The data stays in a pyarrow Table: the columns are cast to market_data_schema where they
+    differ from it, only the input columns of the features are converted to pandas, the feature
+    values are appended to the table, which is sorted by Date and written as it is. The file
+    records that it is sorted, so training does not sort it again.
+
+    Args:
+        input_name: The name of the processed parquet file, or dataset directory, to read.
+        output_name: The name of the parquet file written in data/training.
+        engine: The engine computing the features, see add_features.
+        window: Overrides the rolling window of every feature, None keeps the window of each feature.
+        features: The names of the features to add, the default features when None.
+        tracker: Optionally records the bytes copied by every step.
+        handoff: Reads the data handed off by ingest_data, when there is one, and hands the augmented
+                 data off to deploy_model, writing the parquet file asynchronously.
+
+    Returns:
+        The number of rows written.
+    """
+    table = drop_index_columns(import_parquet_table('processed', input_name, handoff=handoff))
+    table = validate_table(table, tracker=tracker)
+    table = augment_table(table, engine, window, features, tracker)
+    table = sort_table(table, 'Date', tracker)
+    export_table_as_parquet(table.replace_schema_metadata(None), 'training', output_name, sorted_by='Date',
+                            handoff=handoff)
+    return len(table)
+
+
+def transform_data_to_dataset(input_name, output_name, engine='numpy', window=None, features=None):
+    """Computes the features of a whole processed dataset in this process and writes them as a dataset directory.
+
+    Args:
+        input_name: The name of the processed parquet file, or dataset directory, to read.
+        output_name: The name of the dataset directory written in data/training.
+        engine: The engine computing the features, see add_features.
+        window: Overrides the rolling window of every feature, None keeps the window of each feature.
+        features: The names of the features to add, the default features when None.
+
+    Returns:
+        The number of rows written.
+    """
+    tmp_path = path('training', output_name, '').rstrip(os.sep) + '.tmp'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    num_rows = augment_shard(input_name, os.path.join(tmp_path, 'part-00000.parquet'), None, engine, window, features)
+    publish_dataset(tmp_path, output_name)
+    return num_rows
+
+
+def read_symbol_dates(file_name):
+    """Returns the Symbol and Date columns of a processed dataset, reading no other column."""
+    table = parquet.read_table(parquet_source('processed', file_name), columns=['Symbol', 'Date'], partitioning='hive')
+    return pd.DataFrame({
+        'Symbol': table.column('Symbol').cast(pa.string()).to_numpy(zero_copy_only=False),
+        'Date': table.column('Date').to_numpy(),
+    })
+
+
+def history_digest(dataframe):
+    """Returns a SHA-256 digest of the Date, Volume and Adj Close values of rows, in date order."""
+    rows = dataframe.sort_values('Date', kind='stable')
+    digest = hashlib.sha256()
+    digest.update(rows['Date'].to_numpy(dtype='datetime64[ns]').view(np.int64).tobytes())
+    for column in ('Volume', 'Adj Close'):
+        digest.update(rows[column].to_numpy(dtype=np.float64).tobytes())
+    return digest.hexdigest()
+
+
+def symbol_states(symbol_dates, tail, window):
+    """Returns the state recorded for every symbol after augmenting all of its rows.
+
+    Args:
+        symbol_dates: The Symbol and Date columns of every processed row.
+        tail: The processed rows of every symbol dated within the window of its last date.
+        window: The pandas offset of the rolling window, e.g. '30D'.
+
+    Returns:
+        A dict keyed by symbol holding the date of its last row, its number of rows and the
+        history_digest of the rows within the window of its last date.
+    """
+    offset = pd.Timedelta(window)
+    states = {}
+    last_dates = symbol_dates.groupby('Symbol')['Date'].agg(['max', 'size'])
+    for symbol, rows in tail.groupby('Symbol', observed=True):
+        last_date, num_rows = last_dates.loc[symbol]
+        states[symbol] = {
+            'last_date': pd.Timestamp(last_date).isoformat(),
+            'rows': int(num_rows),
+            'history_digest': history_digest(rows[rows['Date'] > last_date - offset]),
+        }
+    return states
+
+
+def read_tail(input_name, symbol_dates, window):
+    """Reads the processed rows of every symbol dated within the window of its last date."""
+    last_dates = symbol_dates.groupby('Symbol')['Date'].max()
+    if last_dates.empty:
+        return symbol_dates.iloc[:0]
+    tail = import_parquet_as_df('processed', input_name, filters=[('Date', '>', last_dates.min() - pd.Timedelta(window))])
+    return tail[tail['Date'] > tail['Symbol'].astype(str).map(last_dates) - pd.Timedelta(window)]
+
+
+def incremental_transform_data(input_name, output_name, engine='numpy', window='30D', executor='thread', num_workers=None):
+    """Computes the features of only the rows added to a processed dataset since the last run.
+
+    A state file next to the augmented dataset records, for every symbol, the date of its last
+    augmented row, its number of rows and a digest of the rows within the window of that date.
+    Only the Symbol and Date columns of the processed data are read to find the new rows. Then
+    the rows of every symbol with new rows dated within the window of its own last date, plus
+    every row of new symbols, are read, which is all the history the rolling windows of the new
+    rows need. Their features are
+    appended to the augmented dataset as a new parquet file.
+
+    Everything is recomputed instead when there is no state, the window changed, the augmented
+    dataset was rewritten, a symbol was removed, or rows were inserted, modified or removed at or
+    before the last augmented date of their symbol. Changes older than the window before that
+    date, and changes to the rows of symbols without new rows, are only noticed when they change
+    the number of rows.
+
+    Args:
+        input_name: The name of the processed parquet file, or dataset directory, to read.
+        output_name: The name of the dataset directory in data/training.
+        engine: The engine computing the features, see add_features.
+        window: The pandas offset of the rolling window, e.g. '30D'.
+        executor: How a full recompute is run, 'thread' in this process or 'process' on a process pool.
+        num_workers: The number of worker processes of the 'process' executor, defaults to the number of CPUs.
+
+    Returns:
+        dict: Whether a 'full' or 'incremental' update was made as 'mode', the number of 'rows'
+              written, and the 'reason' of a full recompute.
+    """
+    dataset_path = path('training', output_name, '')
+    state_path = path('training', output_name + '_state', '.json')
+    state = load_manifest(state_path)
+    symbol_dates = read_symbol_dates(input_name)
+    offset = pd.Timedelta(window)
+    reason = None
+    if not state:
+        reason = 'no previous state'
+    elif state['window'] != window:
+        reason = f"window changed from {state['window']}"
+    elif os.path.exists(path('training', output_name, '.parquet')) or not os.path.isdir(dataset_path) \
+            or sorted(os.listdir(dataset_path)) != state['parts']:
+        reason = 'augmented dataset was rewritten'
+    else:
+        last_dates = pd.Series({symbol: pd.Timestamp(entry['last_date']) for symbol, entry in state['symbols'].items()})
+        known = symbol_dates[symbol_dates['Symbol'].isin(last_dates.index)]
+        past_rows = (known['Date'] <= known['Symbol'].map(last_dates)).groupby(known['Symbol']).sum()
+        expected_rows = pd.Series({symbol: entry['rows'] for symbol, entry in state['symbols'].items()})
+        if not past_rows.reindex(expected_rows.index, fill_value=0).equals(expected_rows):
+            reason = 'past rows were inserted or removed'
+
+    if reason is None:
+        new_symbols = sorted(set(symbol_dates['Symbol']) - set(last_dates.index))
+        # only the symbols with new rows need their history, each from the window of its own last date,
+        # and symbols sharing a last date share a filter
+        updated = known[known['Date'] > known['Symbol'].map(last_dates)]['Symbol'].unique()
+        filters = [[('Symbol', 'in', sorted(symbols.index)), ('Date', '>', last_date - offset)]
+                   for last_date, symbols in last_dates[sorted(updated)].groupby(last_dates[sorted(updated)])]
+        if new_symbols:
+            filters.append([('Symbol', 'in', new_symbols)])
+        if not filters:
+            return {'mode': 'incremental', 'rows': 0, 'reason': None}
+        df = import_parquet_as_df('processed', input_name, filters=filters)
+        symbol_last_dates = df['Symbol'].astype(str).map(last_dates)
+        df = df[symbol_last_dates.isna() | (df['Date'] > symbol_last_dates - offset)]
+        symbol_last_dates = symbol_last_dates[df.index]
+        history = df[df['Date'] <= symbol_last_dates]
+        for symbol, rows in history.groupby('Symbol', observed=True):
+            if history_digest(rows) != state['symbols'][symbol]['history_digest']:
+                reason = 'past rows were modified'
+                break
+
+    if reason is not None:
+        logger.info(f"Recomputing every feature: {reason}")
+        if executor == 'process':
+            num_rows = transform_data_in_processes(input_name, output_name, engine, num_workers, window)
+        else:
+            num_rows = transform_data_to_dataset(input_name, output_name, engine, window)
+        state = {'window': window, 'symbols': symbol_states(symbol_dates, read_tail(input_name, symbol_dates, window), window)}
+        state['parts'] = sorted(os.listdir(dataset_path))
+        save_manifest(state, state_path)
+        return {'mode': 'full', 'rows': num_rows, 'reason': reason}
+
+    df = df.copy()
+    add_features(df, engine, window)
+    new_rows = df[symbol_last_dates.isna() | (df['Date'] > symbol_last_dates)]
+    if len(new_rows):
+        part_name = f'part-{len(state["parts"]):05d}.parquet'
+        write_parquet(pa.Table.from_pandas(new_rows, preserve_index=False), os.path.join(dataset_path, part_name))
+        state['parts'] = sorted(state['parts'] + [part_name])
+        updated = symbol_dates[symbol_dates['Symbol'].isin(new_rows['Symbol'].unique())]
+        state['symbols'].update(symbol_states(updated, df[df['Symbol'].isin(updated['Symbol'].unique())], window))
+        save_manifest(state, state_path)
+    return {'mode': 'incremental', 'rows': len(new_rows), 'reason': None}
+
+
+def transform_data(engine='pandas', executor='thread', num_workers=None, mode='full', features=None, handoff=False):
     """Airflow callable function to initiate data transformation workflow.
     The workflow consists of reading data >> transform data >> save data as a parquet.
 
+    Args:
+        engine (str): 'pandas' computes each feature with a pandas groupby rolling window,
+                      'numpy' computes the features of the registry over one shared RollingFeatureEngine.
+        executor (str): 'thread' computes the features of the whole data in this process,
+                        'process' shards the data by symbol range across a process pool and
+                        writes the augmented data as a dataset directory of one file per shard,
+                        'arrow' keeps the data in Arrow in this process, see transform_data_in_arrow.
+        num_workers (int): The number of worker processes of the 'process' executor,
+                           defaults to the number of CPUs.
+        mode (str): 'full' recomputes the features of every row, 'incremental' only computes
+                    those of rows added since the last run and appends them to the augmented
+                    dataset directory, see incremental_transform_data.
+        features (list of str): The names of the registered features to add, the default features
+                                when None. Other features need the 'numpy' engine and the 'full' mode.
+        handoff (bool): Reads the data handed off by ingest_data, when there is one, and hands the augmented
+                        data off to deploy_model through an Arrow IPC file in shared memory, writing the
+                        parquet file in the background. Needs the 'thread' or 'arrow' executor in 'full' mode.
+
     Raises:
         Exception: If a data transform has failed.
+        ValueError: If the engine, the executor, the mode or a feature is unknown, or if the handoff
+                    is not supported by the executor and the mode.
+        RuntimeError: If, with handoff, ingest_data failed to write its parquet file, see check_persisted.
 
     Returns:
         None
     """
-    logger.info("Initializing data augmentation process")
+    logger.info(f"Initializing {mode} data augmentation process with the {engine} engine and the {executor} executor")
     start_time = time.time()
-    df = read_data('preprocessed_data')
-    
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        futures = []
-        futures.append(
-            executor.submit(
-                manipulate_data,
-                calculate_volume_moving_average,
-                df
-            ))
-        futures.append(
-            executor.submit(
-                manipulate_data, 
-                calculate_adj_rolling_median, 
-                df
-            ))
-        # Wait for all futures to complete
-        for future in concurrent.futures.as_completed(futures):
-            try:
-                column_name, column_value = future.result()
-                df[column_name] = column_value
-            except Exception as e:
-                logger.error(f"Error executing manipulate_data: {e}")
-                continue
-    save_data(df, 'augmented_data')
+    if engine not in ('pandas', 'numpy'):
+        raise ValueError(f"Unknown augmentation engine: {engine}")
+    if executor not in ('thread', 'process', 'arrow'):
+        raise ValueError(f"Unknown augmentation executor: {executor}")
+    if mode not in ('full', 'incremental'):
+        raise ValueError(f"Unknown augmentation mode: {mode}")
+    features = check_features(engine, features)
+    if mode == 'incremental' and features != default_features:
+        raise ValueError(f"The incremental mode only computes {default_features}")
+    # the other executors and the incremental mode read the processed data from disk while it may
+    # still be written in the background, and write the augmented data as a dataset directory
+    if handoff and (executor == 'process' or mode == 'incremental'):
+        raise ValueError("The handoff needs the thread or arrow executor in full mode")
+    if handoff:
+        # the handed off data is only durable once ingest_data wrote it
+        check_persisted(timeout=0)
+    if executor == 'process' or mode == 'incremental':
+        discard_handoff('training', 'augmented_data')
+    if mode == 'incremental':
+        try:
+            logger.info("Attempting to augment new rows")
+            result = incremental_transform_data('preprocessed_data', 'augmented_data', engine,
+                                                executor=executor, num_workers=num_workers)
+            logger.info(f"Augmented data successfully updated: {result}")
+        except Exception as e:
+            logger.error(f"Failed to augment new rows. Error message: {str(e)}")
+            raise e
+        elapsed_time = time.time() - start_time
+        logger.info(f"Data Augmentation complete. Elapsed time: {elapsed_time:.2f} seconds")
+        return
+    if executor == 'process':
+        try:
+            logger.info("Attempting to augment data in symbol shards")
+            num_rows = transform_data_in_processes('preprocessed_data', 'augmented_data', engine, num_workers,
+                                                   features=features)
+            logger.info(f"Data successfully saved to the augmented_data dataset, {num_rows} rows")
+        except Exception as e:
+            logger.error(f"Failed to augment data in symbol shards. Error message: {str(e)}")
+            raise e
+        elapsed_time = time.time() - start_time
+        logger.info(f"Data Augmentation complete. Elapsed time: {elapsed_time:.2f} seconds")
+        return
+    tracker = CopyTracker()
+    if executor == 'arrow':
+        try:
+            logger.info("Attempting to augment data in Arrow")
+            num_rows = transform_data_in_arrow('preprocessed_data', 'augmented_data', engine, features=features,
+                                               tracker=tracker, handoff=handoff)
+            logger.info(f"Data successfully saved to augmented_data.parquet, {num_rows} rows")
+        except Exception as e:
+            logger.error(f"Failed to augment data in Arrow. Error message: {str(e)}")
+            raise e
+        logger.info(f"Bytes copied by the arrow executor: {tracker.report()}")
+        elapsed_time = time.time() - start_time
+        logger.info(f"Data Augmentation complete. Elapsed time: {elapsed_time:.2f} seconds")
+        return
+    df = read_data('preprocessed_data', tracker, handoff)
+
+    if engine == 'numpy':
+        try:
+            logger.info(f"Attempting to compute {features}")
+            add_features(df, engine, features=features)
+            logger.info(f"Computing {features} successful")
+        except Exception as e:
+            logger.error(f"Computing {features} failed with error: {e}")
+            raise e
+    else:
+        with concurrent.futures.ThreadPoolExecutor() as executor:
+            futures = []
+            futures.append(
+                executor.submit(
+                    manipulate_data,
+                    calculate_volume_moving_average,
+                    df
+                ))
+            futures.append(
+                executor.submit(
+                    manipulate_data, 
+                    calculate_adj_rolling_median, 
+                    df
+                ))
+            # Wait for all futures to complete
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    column_name, column_value = future.result()
+                    df[column_name] = column_value
+                except Exception as e:
+                    logger.error(f"Error executing manipulate_data: {e}")
+                    continue
+    save_data(df, 'augmented_data', tracker, handoff)
+    logger.info(f"Bytes copied by the thread executor: {tracker.report()}")
     elapsed_time = time.time() - start_time
     logger.info(f"Data Augmentation complete. Elapsed time: {elapsed_time:.2f} seconds")
\ No newline at end of file
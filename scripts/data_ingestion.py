@@ -3,9 +3,34 @@ import sys
 # Add the root directory to sys.path
 root_path = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(root_path)
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+from pyarrow import parquet
+from pyarrow import ipc
 import concurrent.futures
-from util.data_handling import import_csv_as_df, export_df_as_parquet
+import hashlib
+import json
+import shutil
+import tempfile
+from util.data_handling import (
+    CopyTracker,
+    compact_market_data,
+    discard_handoff,
+    export_table_as_parquet,
+    import_csv_as_df,
+    import_csv_as_table,
+    export_df_as_parquet,
+    market_data_schema,
+    memory_report,
+    parquet_row_group_size,
+    parquet_writer_options,
+    partition_path,
+    path,
+    sort_table,
+    validate_table,
+    write_parquet,
+)
 import logging
 import time
 
@@ -52,11 +77,70 @@ def import_data(directory, file_name):
     df['Symbol'] = file_name.replace('.csv', '')
     return df
 
-def combine_dir_data(path, num_threads = 4):
+def import_chunk_as_ipc(directory, file_names, ipc_path):
+    """Import a chunk of CSV files and write their combined data to an Arrow IPC file.
+
+    Runs in a worker process of combine_dir_data, which reads the file back
+    memory-mapped instead of receiving a pickled DataFrame.
+
+    Args:
+        directory (str): The directory where the CSV files are located.
+        file_names (list of str): The names of the CSV files to import.
+        ipc_path (str): The path of the Arrow IPC file to write.
+
+    Returns:
+        str: The path of the written Arrow IPC file.
+    """
+    df = pd.concat([import_data(directory, file_name) for file_name in file_names], ignore_index=True)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    with pa.OSFile(ipc_path, 'wb') as sink, ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    return ipc_path
+
+def combine_chunks_in_processes(path, csv_files, num_workers=None):
+    """Import CSV files in a process pool and combine them into a single DataFrame.
+
+    Files are split into contiguous chunks, a few per worker to balance the load. Each
+    worker parses its chunk and writes it to an Arrow IPC file, in shared memory when
+    /dev/shm is available, which the parent memory-maps and converts back in file order.
+
+    Args:
+        path (str): The directory containing the CSV files.
+        csv_files (list of str): The names of the CSV files to import.
+        num_workers (int): The number of worker processes, defaults to the number of CPUs.
+
+    Returns:
+        pandas.DataFrame: The DataFrame containing the combined data.
+    """
+    num_workers = num_workers or os.cpu_count() or 1
+    num_chunks = min(len(csv_files), num_workers * 4)
+    chunks = [csv_files[i * len(csv_files) // num_chunks:(i + 1) * len(csv_files) // num_chunks]
+              for i in range(num_chunks)]
+    shm_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+    with tempfile.TemporaryDirectory(dir=shm_dir) as tmp_dir:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers) as pool:
+            futures = [
+                pool.submit(import_chunk_as_ipc, path, chunk, os.path.join(tmp_dir, f'chunk-{i}.arrow'))
+                for i, chunk in enumerate(chunks)
+            ]
+        dataframes = []
+        for future in futures:
+            with pa.memory_map(future.result()) as source:
+                dataframes.append(ipc.open_file(source).read_all().to_pandas())
+    return pd.concat(dataframes, ignore_index=True)
+
+def combine_dir_data(path, num_threads = 4, executor='thread', num_workers=None):
     """Combine data from all CSV files in a directory into a single DataFrame.
 
     Args:
         path (str): The directory containing the CSV files.
+        num_threads (int): The number of threads of the 'thread' executor.
+        executor (str): 'thread' parses files in a thread pool, 'process' in a process pool
+                        that sidesteps the GIL, 'serial' one after the other.
+        num_workers (int): The number of processes of the 'process' executor, defaults to the number of CPUs.
+
+    Raises:
+        ValueError: If the executor is unknown.
 
     Returns:
         pandas.DataFrame: The DataFrame containing the combined data.
@@ -69,18 +153,27 @@ def combine_dir_data(path, num_threads = 4):
     else:
         logger.error(f"This path is not valid {abs_path}")
     csv_files = [_ for _ in os.listdir(abs_path) if _.endswith('csv')]
-    with concurrent.futures.ThreadPoolExecutor(max_workers=num_threads) as executor:
-        futures = [executor.submit(import_data, path, file_name) for file_name in csv_files]
-    dataframes = [future.result() for future in futures]
+    if executor == 'process' and csv_files:
+        return combine_chunks_in_processes(path, csv_files, num_workers)
+    if executor == 'thread':
+        with concurrent.futures.ThreadPoolExecutor(max_workers=num_threads) as pool:
+            futures = [pool.submit(import_data, path, file_name) for file_name in csv_files]
+        dataframes = [future.result() for future in futures]
+    elif executor in ('serial', 'process'):
+        dataframes = [import_data(path, file_name) for file_name in csv_files]
+    else:
+        raise ValueError(f"Unknown executor: {executor}")
     result = pd.concat(dataframes, ignore_index=True)
     return result
 
-def save_data(dataframe, file_name):
+def save_data(dataframe, file_name, tracker=None, handoff=False):
     """Saves a given dataframe as a parquet file with the specified file name.
 
     Args:
         dataframe (pandas.DataFrame): The dataframe to be saved.
         file_name (str): The name of the parquet file to be saved.
+        tracker (CopyTracker): Optionally records the bytes copied to convert the dataframe.
+        handoff (bool): Hands the data off to the next stage and writes the parquet file asynchronously.
 
     Raises:
         Exception: If the dataframe cannot be saved as a parquet file.
@@ -91,26 +184,333 @@ def save_data(dataframe, file_name):
     try:
 
         logger.info(f"Attempting to save data as {file_name}.parquet")
-        export_df_as_parquet(dataframe, 'processed', file_name)
-        logger.info(f"Data successfully saved to {file_name}.parquet")
+        export_df_as_parquet(dataframe, 'processed', file_name, tracker, handoff)
+        if handoff:
+            logger.info(f"Data handed off as {file_name}, writing {file_name}.parquet in the background")
+        else:
+            logger.info(f"Data successfully saved to {file_name}.parquet")
     except Exception as e:
         logger.error(f"Failed to save {file_name}.parquet. Error message: {str(e)}")
         raise e
 
-def ingest_data():
+def import_table(directory, file_name, asset_class):
+    """Import data from a CSV file as an Arrow table matching market_data_schema.
+
+    Args:
+        directory (str): The directory where the CSV file is located.
+        file_name (str): The name of the CSV file to import.
+        asset_class (str): The asset class of the file, e.g. 'etfs' or 'stocks'.
+
+    Returns:
+        pyarrow.Table: The table containing the imported data.
+    """
+    logger.info(f"Importing data from {file_name}")
+    table = import_csv_as_table(directory, file_name)
+    indices = pa.array(np.zeros(len(table), dtype=np.int32))
+    table = table.append_column('Symbol', pa.DictionaryArray.from_arrays(indices, [file_name.replace('.csv', '')]))
+    table = table.append_column('asset_class', pa.DictionaryArray.from_arrays(indices, [asset_class]))
+    return table
+
+def iter_tables(files, num_threads=4):
+    """Yields the data of the given CSV files, one Arrow table per file, in order.
+
+    Files are read by a thread pool, but at most twice as many files as threads are
+    read ahead of the consumer, so memory stays bounded however many files there are.
+
+    Args:
+        files (list of tuple): The (directory, file name, asset class) of every CSV file.
+        num_threads (int): The number of threads reading files.
+
+    Yields:
+        pyarrow.Table: The data of one CSV file.
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers=num_threads) as executor:
+        pending = []
+        for directory, file_name, asset_class in files:
+            pending.append(executor.submit(import_table, directory, file_name, asset_class))
+            if len(pending) >= num_threads * 2:
+                yield pending.pop(0).result()
+        for future in pending:
+            yield future.result()
+
+def iter_dir_tables(path, asset_class, num_threads=4):
+    """Yields the data of every CSV file in a directory, one Arrow table per file.
+
+    Args:
+        path (str): The directory containing the CSV files.
+        asset_class (str): The asset class of the files in the directory.
+        num_threads (int): The number of threads reading files.
+
+    Yields:
+        pyarrow.Table: The data of one CSV file.
+    """
+    logger.info(f"Streaming data from {path}")
+    abs_path = os.path.join(data_directory, path)
+    csv_files = [_ for _ in os.listdir(abs_path) if _.endswith('csv')]
+    yield from iter_tables([(path, file_name, asset_class) for file_name in csv_files], num_threads)
+
+def stream_data(sources, file_name, buffer_bytes=64 * 1024 ** 2, num_threads=4):
+    """Streams the data of several directories of CSV files into a single parquet file.
+
+    Tables are buffered until they hold buffer_bytes, then written as one row group,
+    so peak memory is bounded by the buffer rather than by the size of the data.
+    The file is written under a temporary name and renamed once complete.
+
+    Args:
+        sources (list of tuple): The (directory, asset class) pairs to ingest.
+        file_name (str): The name of the parquet file to be saved.
+        buffer_bytes (int): The amount of data buffered before a row group is written.
+        num_threads (int): The number of threads reading files.
+
+    Returns:
+        int: The number of rows written.
+    """
+    file_path = path('processed', file_name, '.parquet')
+    num_rows = 0
+    buffered, buffered_bytes = [], 0
+    with parquet.ParquetWriter(file_path + '.tmp', market_data_schema, **parquet_writer_options) as writer:
+        for directory, asset_class in sources:
+            for table in iter_dir_tables(directory, asset_class, num_threads):
+                buffered.append(table)
+                buffered_bytes += table.nbytes
+                if buffered_bytes >= buffer_bytes:
+                    writer.write_table(pa.concat_tables(buffered), row_group_size=parquet_row_group_size)
+                    buffered, buffered_bytes = [], 0
+                num_rows += len(table)
+        if buffered:
+            writer.write_table(pa.concat_tables(buffered), row_group_size=parquet_row_group_size)
+    os.replace(file_path + '.tmp', file_path)
+    return num_rows
+
+def arrow_data(sources, file_name, num_threads=4, tracker=None, handoff=False):
+    """Combines the data of several directories of CSV files into a single parquet file sorted by date, without pandas.
+
+    The tables parsed by Arrow are concatenated without copying their columns, cast to
+    market_data_schema where they differ from it, sorted by Date and written as they are.
+    The file records that it is sorted, so readers do not sort it again.
+
+    Args:
+        sources (list of tuple): The (directory, asset class) pairs to ingest.
+        file_name (str): The name of the parquet file to be saved.
+        num_threads (int): The number of threads reading files.
+        tracker (CopyTracker): Optionally records the bytes copied by every step.
+        handoff (bool): Hands the data off to the next stage and writes the parquet file asynchronously.
+
+    Returns:
+        int: The number of rows written.
+    """
+    tables = [table for directory, asset_class in sources
+              for table in iter_dir_tables(directory, asset_class, num_threads)]
+    table = pa.concat_tables(tables) if tables else market_data_schema.empty_table()
+    table = validate_table(table, tracker=tracker)
+    table = sort_table(table, 'Date', tracker)
+    export_table_as_parquet(table, 'processed', file_name, sorted_by='Date', handoff=handoff)
+    return len(table)
+
+def symbol_partition_path(dataset_path, asset_class, symbol):
+    """Returns the directory of the partition holding one symbol in a dataset written by partition_data."""
+    return partition_path(dataset_path, [('asset_class', asset_class), ('Symbol', symbol)])
+
+def write_partition(dataset_path, table):
+    """Writes the data of one symbol to its partition of a hive-partitioned dataset.
+
+    The partition file is written atomically by write_parquet, so readers never see a
+    partial partition.
+
+    Args:
+        dataset_path (str): The path of the dataset directory.
+        table (pyarrow.Table): The data of a single symbol, as returned by import_table.
+
+    Returns:
+        str: The path of the written partition file.
+    """
+    asset_class, symbol = (table.column(column)[0].as_py() for column in ('asset_class', 'Symbol'))
+    partition_dir = symbol_partition_path(dataset_path, asset_class, symbol)
+    os.makedirs(partition_dir, exist_ok=True)
+    return write_parquet(table.drop(['asset_class', 'Symbol']), os.path.join(partition_dir, 'part-0.parquet'))
+
+def partition_data(sources, dataset_name, num_threads=4):
+    """Streams the data of several directories of CSV files into a dataset partitioned by asset class and symbol.
+
+    Each file is written to its own partition as soon as it is read, so only the files
+    being read are held in memory. The dataset is built in a temporary directory that
+    replaces the previous one once complete, and a parquet file of the same name is
+    removed since it would take precedence over the dataset when reading.
+
+    Args:
+        sources (list of tuple): The (directory, asset class) pairs to ingest.
+        dataset_name (str): The name of the dataset directory.
+        num_threads (int): The number of threads reading files.
+
+    Returns:
+        int: The number of rows written.
+    """
+    dataset_path = path('processed', dataset_name, '')
+    tmp_path = dataset_path.rstrip(os.sep) + '.tmp'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    num_rows = 0
+    for directory, asset_class in sources:
+        for table in iter_dir_tables(directory, asset_class, num_threads):
+            if len(table):
+                write_partition(tmp_path, table)
+            num_rows += len(table)
+    shutil.rmtree(dataset_path, ignore_errors=True)
+    os.replace(tmp_path, dataset_path)
+    if os.path.exists(path('processed', dataset_name, '.parquet')):
+        os.remove(path('processed', dataset_name, '.parquet'))
+    return num_rows
+
+def file_hash(file_path):
+    """Returns the SHA-256 digest of a file's content, read in 1 MB blocks."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 ** 2), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def load_manifest(manifest_path):
+    """Loads the ingestion manifest, or returns an empty one when it does not exist.
+
+    Args:
+        manifest_path (str): The path of the manifest JSON file.
+
+    Returns:
+        dict: The size, mtime and content hash of every ingested file, keyed by '<asset class>/<file name>'.
+    """
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path) as f:
+        return json.load(f)
+
+def save_manifest(manifest, manifest_path):
+    """Saves the ingestion manifest under a temporary name, then renames it."""
+    with open(manifest_path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+def incremental_partition_data(sources, dataset_name, num_threads=4):
+    """Updates a dataset written by partition_data with only the CSV files that changed.
+
+    A manifest of the size, mtime and content hash of every ingested file is kept next to
+    the dataset. Files whose size and mtime are unchanged are skipped without being read,
+    files whose content is unchanged are skipped after hashing, and only new or modified
+    files are parsed and rewritten to their partition. Partitions of deleted files are removed.
+    Without a dataset, every file is ingested.
+
+    Args:
+        sources (list of tuple): The (directory, asset class) pairs to ingest.
+        dataset_name (str): The name of the dataset directory.
+        num_threads (int): The number of threads reading files.
+
+    Returns:
+        dict: The number of 'added', 'modified', 'deleted' and 'unchanged' files.
+    """
+    dataset_path = path('processed', dataset_name, '')
+    manifest_path = path('processed', dataset_name + '_manifest', '.json')
+    manifest = load_manifest(manifest_path) if os.path.isdir(dataset_path) else {}
+    counts = {'added': 0, 'modified': 0, 'deleted': 0, 'unchanged': 0}
+    entries = {}
+    changed = []
+    for directory, asset_class in sources:
+        abs_path = os.path.join(data_directory, directory)
+        for file_name in (_ for _ in os.listdir(abs_path) if _.endswith('csv')):
+            key = f'{asset_class}/{file_name}'
+            stat = os.stat(os.path.join(abs_path, file_name))
+            entry = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+            previous = manifest.get(key)
+            if previous is not None and previous['size'] == entry['size'] and previous['mtime_ns'] == entry['mtime_ns']:
+                entries[key] = previous
+                counts['unchanged'] += 1
+                continue
+            entry['sha256'] = file_hash(os.path.join(abs_path, file_name))
+            entries[key] = entry
+            if previous is not None and previous['sha256'] == entry['sha256']:
+                counts['unchanged'] += 1
+                continue
+            counts['modified' if previous is not None else 'added'] += 1
+            changed.append((directory, file_name, asset_class))
+
+    os.makedirs(dataset_path, exist_ok=True)
+    for (directory, file_name, asset_class), table in zip(changed, iter_tables(changed, num_threads)):
+        if len(table):
+            write_partition(dataset_path, table)
+        else:
+            # a file emptied of its rows leaves no data behind
+            shutil.rmtree(symbol_partition_path(dataset_path, asset_class, file_name.replace('.csv', '')),
+                          ignore_errors=True)
+    for key in set(manifest) - set(entries):
+        asset_class, file_name = key.split('/', 1)
+        shutil.rmtree(symbol_partition_path(dataset_path, asset_class, file_name.replace('.csv', '')),
+                      ignore_errors=True)
+        counts['deleted'] += 1
+
+    save_manifest(entries, manifest_path)
+    if os.path.exists(path('processed', dataset_name, '.parquet')):
+        os.remove(path('processed', dataset_name, '.parquet'))
+    return counts
+
+def ingest_data(mode='pandas', buffer_bytes=64 * 1024 ** 2, executor='thread', num_workers=None, handoff=False):
     """Airflow callable function to initiate ingesting data worflow.
     The workflow consists of reading various raw data >> 
     combine all sources of data >> 
     save data as a parquet.
+
+    Args:
+        mode (str): 'pandas' combines every file in memory before saving,
+                    'stream' appends files to a single parquet file through a bounded buffer,
+                    'partitioned' writes every file to a dataset partitioned by asset class and symbol,
+                    'incremental' only rewrites the partitions of files that changed since the last run,
+                    'arrow' combines, sorts and saves every file with Arrow, without converting to pandas.
+        buffer_bytes (int): The amount of data buffered before a row group is written in 'stream' mode.
+        executor (str): How files are parsed in 'pandas' mode, see combine_dir_data.
+        num_workers (int): The number of worker processes of the 'process' executor, defaults to the number of CPUs.
+        handoff (bool): In 'pandas' and 'arrow' modes, hands the data off to transform_data through an Arrow
+                        IPC file in shared memory and writes the parquet file in the background, see
+                        scripts.util.data_handling.export_table_as_parquet. The other modes write to disk.
+
+    Raises:
+        ValueError: If the mode is unknown.
+
     Returns:
         None
     """
-    logger.info("Starting data preprocessing.")
+    logger.info(f"Starting data preprocessing in {mode} mode.")
     start_time = time.time()
-    etfs_df = combine_dir_data(etfs_data_path)
-    stocks_df = combine_dir_data(stocks_data_path)
-    result = pd.concat([etfs_df, stocks_df], ignore_index=True)
-    save_data(result, 'preprocessed_data')
+    sources = [(etfs_data_path, 'etfs'), (stocks_data_path, 'stocks')]
+    tracker = CopyTracker()
+    if mode not in ('pandas', 'arrow'):
+        if handoff:
+            logger.info(f"The {mode} mode writes its data to disk, nothing is handed off")
+        discard_handoff('processed', 'preprocessed_data')
+    if mode == 'pandas':
+        etfs_df = combine_dir_data(etfs_data_path, executor=executor, num_workers=num_workers)
+        stocks_df = combine_dir_data(stocks_data_path, executor=executor, num_workers=num_workers)
+        # every file was copied out of Arrow into its own DataFrame, then into the DataFrame of its directory
+        parsed_bytes = etfs_df.memory_usage(index=False).sum() + stocks_df.memory_usage(index=False).sum()
+        tracker.record('to_pandas', parsed_bytes)
+        tracker.record('concat', parsed_bytes)
+        result = pd.concat([etfs_df, stocks_df], ignore_index=True)
+        tracker.record('concat', result.memory_usage(index=False).sum())
+        result = compact_market_data(result, tracker)
+        logger.info(f"Combined data memory usage: {memory_report(result)}")
+        save_data(result, 'preprocessed_data', tracker, handoff)
+    elif mode == 'arrow':
+        num_rows = arrow_data(sources, 'preprocessed_data', tracker=tracker, handoff=handoff)
+        logger.info(f"Combined {num_rows} rows into preprocessed_data.parquet")
+    elif mode == 'stream':
+        num_rows = stream_data(sources, 'preprocessed_data', buffer_bytes)
+        logger.info(f"Streamed {num_rows} rows to preprocessed_data.parquet")
+    elif mode == 'partitioned':
+        num_rows = partition_data(sources, 'preprocessed_data')
+        logger.info(f"Partitioned {num_rows} rows into preprocessed_data/")
+    elif mode == 'incremental':
+        counts = incremental_partition_data(sources, 'preprocessed_data')
+        logger.info(f"Incrementally updated preprocessed_data/: {counts}")
+    else:
+        raise ValueError(f"Unknown ingestion mode: {mode}")
+    if mode in ('pandas', 'arrow'):
+        logger.info(f"Bytes copied in {mode} mode: {tracker.report()}")
     elapsed_time = time.time() - start_time
     logger.info(f"Data preprocessing complete. Elapsed time: {elapsed_time:.2f} seconds")
 
@@ -5,16 +5,95 @@ root_path = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(root_path)
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import mean_absolute_error, mean_squared_error
-from util.data_handling import import_parquet_as_df
+from util.data_handling import (
+    check_persisted,
+    handoff_path,
+    import_handoff_table,
+    import_parquet_as_df,
+    import_parquet_table,
+    memory_report,
+    parquet_source,
+)
 import lightgbm as lgb
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset
+import concurrent.futures
+import hashlib
 import joblib
+import json
 import logging
+import shutil
+import tempfile
 import time
 
 from data_augmentation import data_augmentation_output_path
+from data_ingestion import file_hash
 dir_path = os.path.dirname(os.path.realpath(__file__))
 data_directory = os.path.join(dir_path, '..', 'data')
 model_destination_path = os.path.join(dir_path, '..', 'web_api', 'ml-model')
+# the only columns of the augmented data used for training
+training_columns = ['Date', 'vol_moving_avg', 'adj_close_rolling_med', 'Volume']
+# the features are read as float32, which LightGBM bins without converting them to float64;
+# the target keeps float64 since volumes exceed the integers float32 represents exactly
+compact_training_types = {'vol_moving_avg': 'float32', 'adj_close_rolling_med': 'float32'}
+training_features = ['vol_moving_avg', 'adj_close_rolling_med']
+training_target = 'Volume'
+# rows of the augmented data read at a time by the out-of-core loader, see train_model_out_of_core
+training_batch_rows = 2 ** 20
+model_params = {
+    'boosting_type':'gbdt',
+    'num_leaves':31,
+    "max_depth":-1,
+    "learning_rate":0.1,
+    "n_estimators":500,
+}
+# values tried by the hyperparameter search, see search_model; parameters changing how features are
+# binned are left out, so every trial trains on the same pre-binned Dataset
+search_space = {
+    'num_leaves': [15, 31, 63, 127, 255],
+    'learning_rate': [0.02, 0.05, 0.1, 0.2],
+    'min_data_in_leaf': [20, 50, 100, 500],
+    'lambda_l2': [0.0, 1.0, 10.0],
+    'bagging_fraction': [0.7, 0.85, 1.0],
+}
+# binned LightGBM datasets kept between training runs, see dataset_cache_key
+dataset_cache_directory = os.path.join(data_augmentation_output_path, 'dataset_cache')
+# the number of cached datasets kept, the least recently used are removed first
+dataset_cache_size = 4
+# parameters of the Dataset shared by the trials: features unsplittable under the default
+# min_data_in_leaf are kept, since trials change it
+search_dataset_params = {'feature_pre_filter': False, 'verbose': -1}
+# the latest date trained on and the metrics of the last full training, see deploy_model's 'incremental' mode
+training_state_path = os.path.join(model_destination_path, 'training_state.json')
+# boosting rounds added to the previous model per incremental update
+incremental_rounds = 50
+# new rows are left for a later update until there are at least this many
+incremental_min_rows = 100
+# an update whose test MAE exceeds the MAE of the last full training on the same new rows by more
+# than this factor is replaced by a full retrain
+incremental_metric_tolerance = 1.25
+# the file of the last fully trained model, kept next to the deployed one to test the updates against
+full_model_file = 'full_lightgbm_predictor.joblib'
+# the models of the symbol clusters or asset classes and the routing.json index the web API routes requests with,
+# see train_sharded
+shard_directory = os.path.join(model_destination_path, 'shards')
+# shards with fewer rows are not trained; the API scores requests for their symbols with the single model,
+# and rejects requests naming their asset class with a 404
+min_shard_rows = 100
+# the latest rows of every symbol the web API looks features up in, and the journal of the daily bars it
+# was sent since, see export_feature_store
+feature_store_path = os.path.join(model_destination_path, 'feature_store.arrow')
+feature_store_journal_path = os.path.join(model_destination_path, 'feature_store.journal')
+feature_store_schema = pa.schema([
+    ('Symbol', pa.string()),
+    ('Date', pa.timestamp('ns')),
+    ('Volume', pa.float64()),
+    ('Adj Close', pa.float64()),
+    ('vol_moving_avg', pa.float64()),
+    ('adj_close_rolling_med', pa.float64()),
+])
 
 # Setup logger
 logger = logging.getLogger(__name__)
@@ -70,24 +149,14 @@ def train_model(data):
     data.dropna(inplace=True)
     logger.info("Separating data for training.")
     # Select features and target
-    features = ['vol_moving_avg', 'adj_close_rolling_med']
-    target = 'Volume'
-
-    X = data[features]
-    y = data[target]
+    X = data[training_features]
+    y = data[training_target]
 
     # Split data into train and test sets
     X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
 
     logger.info("Instantiating a Gradient Boosting Regressor.")
     # Train the LightGBM model
-    model_params = {
-        'boosting_type':'gbdt',
-        'num_leaves':31,
-        "max_depth":-1,
-        "learning_rate":0.1,
-        "n_estimators":500,
-    }
     model = lgb.LGBMRegressor(**model_params)
 
     # Convert probabilities to binary predictions
@@ -106,14 +175,507 @@ def train_model(data):
     return [model, mae, mse]
 
 
-def read_data(file_name):
-    """Reads a parquet file with the given name and returns a pandas DataFrame.
+def booster_params():
+    """Returns the parameters of lgb.train training the model of train_model, without its number of rounds."""
+    params = {key: value for key, value in model_params.items() if key != 'n_estimators'}
+    params.update(objective='regression', verbose=-1)
+    return params
+
+def iter_training_batches(file_name, batch_rows=training_batch_rows, handoff=False):
+    """Yields the features and the target of the augmented data one batch of rows at a time.
+
+    Only the feature and target columns are read, from the Parquet file, the dataset directory
+    or, with handoff, the Arrow IPC file handed off by transform_data. Rows holding a NaN are
+    dropped from every batch, so no batch is ever held with the full dataset.
+
+    Args:
+        file_name (str): The name of the augmented parquet file, or dataset directory.
+        batch_rows (int): The largest number of rows of a batch.
+        handoff (bool): Reads the data handed off by transform_data instead, when there is one.
+
+    Returns:
+        generator: (features, target) pairs, an (n, k) float32 array and an n float64 array.
+    """
+    columns = training_features + [training_target]
+    if handoff and os.path.exists(handoff_path(data_augmentation_output_path, file_name)):
+        batches = import_handoff_table(data_augmentation_output_path, file_name).select(columns).to_batches(batch_rows)
+    else:
+        source = pyarrow.dataset.dataset(parquet_source(data_augmentation_output_path, file_name), format='parquet',
+                                         partitioning='hive')
+        batches = source.to_batches(columns=columns, batch_size=batch_rows)
+    for batch in batches:
+        features = np.column_stack([batch.column(column).to_numpy(zero_copy_only=False).astype(np.float32)
+                                    for column in training_features])
+        target = batch.column(training_target).to_numpy(zero_copy_only=False).astype(np.float64)
+        valid = ~(np.isnan(features).any(axis=1) | np.isnan(target))
+        if valid.any():
+            yield features[valid], target[valid]
+
+class SpilledRows(lgb.Sequence):
+    """The rows of a memory-mapped array, which LightGBM samples and then reads in batches of batch_size rows.
+
+    The rows are kept as float32 on disk and handed to LightGBM, which bins float64 rows, a batch at a time.
+    """
+
+    def __init__(self, rows, batch_size):
+        self.rows = rows
+        self.batch_size = batch_size
+
+    def __getitem__(self, index):
+        return np.asarray(self.rows[index], dtype=np.float64)
+
+    def __len__(self):
+        return len(self.rows)
+
+def spill_training_data(batches, directory, test_size=0.2, random_state=42):
+    """Splits batches of training rows into a train and a test set written to raw files, and memory-maps them back.
+
+    Args:
+        batches (iterable): (features, target) pairs, as yielded by iter_training_batches.
+        directory (str): The directory the files are written to.
+        test_size (float): The fraction of the rows drawn into the test set.
+        random_state (int): The seed of the draw.
+
+    Raises:
+        ValueError: If there are no training rows.
+
+    Returns:
+        dict: The 'train' and 'test' (features, target) pairs, memory-mapped.
+    """
+    rng = np.random.default_rng(random_state)
+    files = {split: [open(os.path.join(directory, f'{split}_{kind}.bin'), 'wb') for kind in ('features', 'target')]
+             for split in ('train', 'test')}
+    num_rows = {'train': 0, 'test': 0}
+    try:
+        for features, target in batches:
+            in_test = rng.random(len(target)) < test_size
+            for split, rows in (('train', ~in_test), ('test', in_test)):
+                features[rows].tofile(files[split][0])
+                target[rows].tofile(files[split][1])
+                num_rows[split] += int(rows.sum())
+    finally:
+        for split_files in files.values():
+            for split_file in split_files:
+                split_file.close()
+    if num_rows['train'] == 0:
+        raise ValueError("No training rows without NaN values")
+    return {split: load_spilled(directory, split, num_rows[split]) for split in ('train', 'test')}
+
+def load_spilled(directory, split, num_rows):
+    """Memory-maps the features and the target of the rows of a split written by spill_training_data."""
+    if num_rows == 0:
+        return np.empty((0, len(training_features)), np.float32), np.empty(0, np.float64)
+    return (np.memmap(os.path.join(directory, f'{split}_features.bin'), np.float32, 'r',
+                      shape=(num_rows, len(training_features))),
+            np.memmap(os.path.join(directory, f'{split}_target.bin'), np.float64, 'r', shape=(num_rows,)))
+
+def dataset_cache_key(file_name, handoff=False):
+    """Returns the key of the binned datasets built from the augmented data.
+
+    The key hashes the content of the files the data is read from, the training columns and the
+    version of LightGBM, so a cached dataset is only reused for the same data and features.
+
+    Args:
+        file_name (str): The name of the augmented parquet file, or dataset directory.
+        handoff (bool): Whether the data is read from the handoff of transform_data, when there is one.
+
+    Returns:
+        str: The SHA-256 digest of the inputs of the datasets.
+    """
+    source = handoff_path(data_augmentation_output_path, file_name)
+    if not (handoff and os.path.exists(source)):
+        source = parquet_source(data_augmentation_output_path, file_name)
+    if os.path.isdir(source):
+        files = sorted(os.path.join(root, name) for root, _, names in os.walk(source) for name in names
+                       if not name.startswith(('.', '_')))
+    else:
+        files = [source]
+    digest = hashlib.sha256(json.dumps([training_features, training_target, lgb.__version__]).encode())
+    for source_file in files:
+        digest.update(os.path.relpath(source_file, source).encode())
+        digest.update(file_hash(source_file).encode())
+    return digest.hexdigest()
+
+def dataset_cache_path(cache_key, **settings):
+    """Returns the directory caching the datasets of a key built with the given settings, e.g. the split."""
+    entry = hashlib.sha256(json.dumps([cache_key, settings], sort_keys=True).encode()).hexdigest()
+    return os.path.join(dataset_cache_directory, entry[:32])
+
+def store_datasets(build_directory, cache_path):
+    """Moves a directory of built datasets into the cache, then evicts the least recently used cached datasets.
+
+    Args:
+        build_directory (str): The directory the datasets were built in, inside dataset_cache_directory.
+        cache_path (str): The directory of the cached datasets, see dataset_cache_path.
+    """
+    shutil.rmtree(cache_path, ignore_errors=True)
+    os.replace(build_directory, cache_path)
+    entries = [os.path.join(dataset_cache_directory, name) for name in os.listdir(dataset_cache_directory)
+               if not name.startswith('.')]
+    for entry in sorted(entries, key=os.path.getmtime, reverse=True)[dataset_cache_size:]:
+        shutil.rmtree(entry, ignore_errors=True)
+
+def build_directory(cache_path):
+    """Returns a new directory to build datasets in, hidden in the cache when they are cached."""
+    if cache_path is None:
+        return tempfile.mkdtemp(dir=data_augmentation_output_path)
+    os.makedirs(dataset_cache_directory, exist_ok=True)
+    return tempfile.mkdtemp(dir=dataset_cache_directory, prefix='.')
+
+def train_model_out_of_core(file_name, batch_rows=training_batch_rows, handoff=False, test_size=0.2, random_state=42,
+                            cache_key=None):
+    """Trains the model of train_model without ever holding the augmented data in memory.
+
+    The data is streamed in batches by iter_training_batches, and every batch is split into
+    the train and the test set and appended to files memory-mapped next to the data. LightGBM
+    samples the train rows to find its bins, then reads them in batches to build its Dataset,
+    which holds one byte per feature and row. The test set is predicted in batches.
+
+    With a cache key, the binned Dataset is saved as a LightGBM binary file along with the test
+    rows, and later runs on the same data load them instead of reading and binning the data.
+
+    Args:
+        file_name (str): The name of the augmented parquet file, or dataset directory.
+        batch_rows (int): The largest number of rows read, or predicted, at a time.
+        handoff (bool): Reads the data handed off by transform_data instead, when there is one.
+        test_size (float): The fraction of the rows drawn into the test set.
+        random_state (int): The seed of the draw.
+        cache_key (str): The key of the cached datasets, see dataset_cache_key, None builds them without caching.
+
+    Raises:
+        ValueError: If there are no training rows.
+
+    Returns:
+        list: A list containing the trained lgb.Booster, its MAE, and its MSE.
+    """
+    logger.info(f"Initializing out-of-core model training on batches of {batch_rows} rows.")
+    params = booster_params()
+    cache_path = None
+    if cache_key is not None:
+        cache_path = dataset_cache_path(cache_key, mode='fixed', test_size=test_size, random_state=random_state)
+    if cache_path is not None and os.path.isdir(cache_path):
+        logger.info(f"Loading the binned training data from {cache_path}")
+        os.utime(cache_path)
+        directory = None
+        with open(os.path.join(cache_path, 'metadata.json')) as f:
+            num_test_rows = json.load(f)['test_rows']
+        train_set = lgb.Dataset(os.path.join(cache_path, 'train.bin'), params={'verbose': -1})
+        test_features, test_target = load_spilled(cache_path, 'test', num_test_rows)
+    else:
+        directory = build_directory(cache_path)
+    try:
+        if directory is not None:
+            spilled = spill_training_data(iter_training_batches(file_name, batch_rows, handoff), directory,
+                                          test_size, random_state)
+            (train_features, train_target), (test_features, test_target) = spilled['train'], spilled['test']
+            train_set = lgb.Dataset(SpilledRows(train_features, batch_rows), label=train_target,
+                                    feature_name=training_features, params={'verbose': -1})
+            if cache_path is not None:
+                train_set.construct().save_binary(os.path.join(directory, 'train.bin'))
+                for name in ('train_features.bin', 'train_target.bin'):
+                    os.remove(os.path.join(directory, name))
+                with open(os.path.join(directory, 'metadata.json'), 'w') as f:
+                    json.dump({'train_rows': len(train_target), 'test_rows': len(test_target)}, f)
+                store_datasets(directory, cache_path)
+                directory = None
+        logger.info(f"Training on {train_set.construct().num_data()} rows, testing on {len(test_target)} rows.")
+        booster = lgb.train(params, train_set, num_boost_round=model_params['n_estimators'])
+        absolute_error = squared_error = 0.0
+        for start in range(0, len(test_target), batch_rows):
+            errors = test_target[start:start + batch_rows] - booster.predict(test_features[start:start + batch_rows])
+            absolute_error += np.abs(errors).sum()
+            squared_error += (errors * errors).sum()
+        num_test_rows = len(test_target)
+        # the booster keeps no reference to the spilled files once they are removed
+        booster.free_dataset()
+    finally:
+        if directory is not None:
+            shutil.rmtree(directory, ignore_errors=True)
+    mae = absolute_error / num_test_rows if num_test_rows else float('nan')
+    mse = squared_error / num_test_rows if num_test_rows else float('nan')
+    logger.info(f"Finished model training.")
+    return [booster, mae, mse]
+
+
+def time_split(data, validation_size=0.2, by=None):
+    """Returns which rows of the data hold out for validation, the most recent rows rather than random ones.
+
+    Args:
+        data (pandas.DataFrame): The data, holding a 'Date' column.
+        validation_size (float): The fraction of the rows held out.
+        by (str): None holds out the rows dated after a cutoff common to every row, a column such as
+                  'Symbol' holds out the most recent rows of every group, walking every group forward.
+
+    Returns:
+        numpy.ndarray: True for the rows held out for validation. Rows sharing a date and a group
+                       are held out together.
+    """
+    dates = data['Date'] if by is None else data.groupby(by, observed=True)['Date']
+    return (dates.rank(method='max', pct=True) > 1 - validation_size).to_numpy()
+
+def run_trial(train_path, valid_path, params, num_boost_round, early_stopping_rounds):
+    """Trains one trial of search_model on the pre-binned datasets saved by it, in a worker process.
+
+    Args:
+        train_path (str): The path of the LightGBM binary file of the training rows.
+        valid_path (str): The path of the LightGBM binary file of the validation rows.
+        params (dict): The parameters of the trial.
+        num_boost_round (int): The largest number of boosting rounds.
+        early_stopping_rounds (int): Training stops once the validation MAE has not improved for that many rounds.
+
+    Returns:
+        dict: The 'params', the 'best_iteration', the validation 'mae' and 'mse' at that iteration,
+              the 'seconds' the trial took and the 'model' as a string, truncated to the best iteration.
+    """
+    start_time = time.perf_counter()
+    train_set = lgb.Dataset(train_path, params=search_dataset_params)
+    valid_set = lgb.Dataset(valid_path, reference=train_set, params=search_dataset_params)
+    booster = lgb.train(params, train_set, num_boost_round=num_boost_round, valid_sets=[valid_set],
+                        callbacks=[lgb.early_stopping(early_stopping_rounds, first_metric_only=True, verbose=False)])
+    scores = booster.best_score['valid_0']
+    return {
+        'params': params,
+        'best_iteration': booster.best_iteration,
+        'mae': scores['l1'],
+        'mse': scores['l2'],
+        'seconds': time.perf_counter() - start_time,
+        'model': booster.model_to_string(num_iteration=booster.best_iteration),
+    }
+
+def search_model(data, num_trials=16, num_workers=None, validation_size=0.2, by=None, num_boost_round=2000,
+                 early_stopping_rounds=50, random_state=42, cache_key=None, test_size=0.1):
+    """Searches the hyperparameters of the model on a process pool, validating on the most recent rows.
+
+    The data is split with time_split, twice: the most recent rows are first held out as a test
+    slice that no trial sees, then the most recent of the other rows are held out for validation.
+    The training rows are binned once into a LightGBM Dataset, saved with the validation rows as
+    binary files that every trial loads without binning the features again. Each trial draws
+    parameters from search_space, trains single-threaded in a worker process and stops early once
+    the validation MAE stops improving. The trial with the lowest validation MAE is then tested on
+    the test slice, so its reported metrics are not biased by its selection.
+
+    Args:
+        data (pandas.DataFrame): The dataset, holding 'Date', the training features and the target,
+                                 and the `by` column when there is one.
+        num_trials (int): The number of parameter sets tried.
+        num_workers (int): The number of worker processes, defaults to the number of CPUs.
+        validation_size (float): The fraction of the rows left after the test slice held out for validation.
+        by (str): Holds out the most recent rows of every group of that column rather than of the whole data.
+        num_boost_round (int): The largest number of boosting rounds of a trial.
+        early_stopping_rounds (int): A trial stops once the validation MAE has not improved for that many rounds.
+        random_state (int): The seed of the parameter draws.
+        cache_key (str): The key of the cached datasets, see dataset_cache_key. The binary files and the
+                         test rows are then kept in the cache, and data may be None when they are cached.
+        test_size (float): The fraction of the rows held out as the final test slice.
+
+    Raises:
+        ValueError: If no rows are left for training, for validation or for testing.
+
+    Returns:
+        list: A list containing the lgb.Booster of the trial with the lowest validation MAE, its MAE
+              and its MSE on the test slice, and the results of every trial, without their models, best first.
+    """
+    logger.info(f"Initializing a search of {num_trials} trials.")
+    rng = np.random.default_rng(random_state)
+    base_params = {key: value for key, value in model_params.items() if key != 'n_estimators'}
+    base_params.update(objective='regression', metric=['l1', 'l2'], num_threads=1, verbose=-1, seed=random_state)
+    trials = []
+    for _ in range(num_trials):
+        params = {**base_params, **{name: values[rng.integers(len(values))] for name, values in search_space.items()}}
+        params = {name: value.item() if isinstance(value, np.generic) else value for name, value in params.items()}
+        params['bagging_freq'] = 1 if params['bagging_fraction'] < 1 else 0
+        trials.append(params)
+
+    cache_path = None
+    if cache_key is not None:
+        cache_path = dataset_cache_path(cache_key, mode='search', validation_size=validation_size, test_size=test_size,
+                                        by=by)
+    if cache_path is not None and os.path.isdir(cache_path):
+        logger.info(f"Loading the binned training data from {cache_path}")
+        os.utime(cache_path)
+        directory = cache_path
+    else:
+        directory = build_directory(cache_path)
+    try:
+        if directory != cache_path:
+            data = data.dropna(subset=training_features + [training_target])
+            test = time_split(data, test_size, by)
+            validation = np.zeros(len(data), dtype=bool)
+            validation[~test] = time_split(data[~test], validation_size, by)
+            train = ~(test | validation)
+            if not (train.any() and validation.any() and test.any()):
+                raise ValueError("The time split leaves no rows for training, for validation or for testing")
+            X, y = data[training_features].to_numpy(np.float32), data[training_target].to_numpy(np.float64)
+            train_set = lgb.Dataset(X[train], label=y[train], feature_name=training_features,
+                                    params=search_dataset_params)
+            train_set.save_binary(os.path.join(directory, 'train.bin'))
+            train_set.create_valid(X[validation], label=y[validation], params=search_dataset_params).save_binary(
+                os.path.join(directory, 'valid.bin'))
+            X[test].tofile(os.path.join(directory, 'test_features.bin'))
+            y[test].tofile(os.path.join(directory, 'test_target.bin'))
+            with open(os.path.join(directory, 'metadata.json'), 'w') as f:
+                json.dump({'train_rows': int(train.sum()), 'valid_rows': int(validation.sum()),
+                           'test_rows': int(test.sum())}, f)
+            del train_set, X, y
+            if cache_path is not None:
+                store_datasets(directory, cache_path)
+                directory = cache_path
+        with open(os.path.join(directory, 'metadata.json')) as f:
+            num_rows = json.load(f)
+        logger.info(f"Training on {num_rows['train_rows']} rows, validating on {num_rows['valid_rows']} rows and "
+                    f"testing the best trial on {num_rows['test_rows']} rows.")
+        train_path, valid_path = os.path.join(directory, 'train.bin'), os.path.join(directory, 'valid.bin')
+        results = []
+        with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers or os.cpu_count() or 1) as executor:
+            futures = [executor.submit(run_trial, train_path, valid_path, params, num_boost_round, early_stopping_rounds)
+                       for params in trials]
+            for index, future in enumerate(futures):
+                result = future.result()
+                logger.info(f"Trial {index}: MAE {result['mae']:.1f} after {result['best_iteration']} rounds "
+                            f"in {result['seconds']:.2f} seconds, {result['params']}")
+                results.append(result)
+
+        results.sort(key=lambda result: result['mae'])
+        booster = lgb.Booster(model_str=results[0]['model'])
+        test_features, test_target = load_spilled(directory, 'test', num_rows['test_rows'])
+        y_pred = booster.predict(test_features)
+        mae = mean_absolute_error(test_target, y_pred)
+        mse = mean_squared_error(test_target, y_pred)
+        del test_features, test_target
+    finally:
+        if directory != cache_path:
+            shutil.rmtree(directory, ignore_errors=True)
+    logger.info(f"Finished the search, best trial: {results[0]['params']}")
+    return [booster, mae, mse, [{key: value for key, value in result.items() if key != 'model'} for result in results]]
+
+
+def symbol_clusters(data, num_clusters=8):
+    """Groups the symbols into clusters of similar volume scale.
+
+    The symbols are ranked by their median volume and cut into num_clusters clusters
+    of as many symbols, so every cluster spans a narrow range of volumes.
+
+    Args:
+        data (pandas.DataFrame): The data, holding the 'Symbol' column and the target.
+        num_clusters (int): The number of clusters.
+
+    Returns:
+        pandas.Series: The cluster of every symbol, from 0 for the lowest volumes, indexed by symbol.
+    """
+    median_volumes = data.groupby('Symbol', observed=True)[training_target].median()
+    ranks = median_volumes.rank(method='first', pct=True)
+    return np.ceil(ranks * num_clusters).astype(int).clip(1, num_clusters) - 1
+
+def train_shard(shard, data):
+    """Trains the model of train_model on the rows of one shard, in a worker process of train_sharded.
+
+    Returns:
+        list: A list containing the name of the shard, its trained model, its MAE, its MSE and its number of rows.
+    """
+    num_rows = len(data)
+    model, mae, mse = train_model(data)
+    return [shard, model, mae, mse, num_rows]
+
+def train_sharded(data, by='asset_class', num_clusters=8, num_workers=None):
+    """Trains one model per asset class or per symbol cluster, in parallel on a process pool.
+
+    Smaller models fitted to data of similar volume scale replace the single model of
+    train_model, and train in parallel rather than as one large single-process job.
+
+    Args:
+        data (pandas.DataFrame): The training columns along with the 'Symbol' and 'asset_class' columns.
+        by (str): 'asset_class' trains one model per asset class, 'cluster' one model per cluster
+                  of symbols of similar volume, see symbol_clusters.
+        num_clusters (int): The number of clusters of the 'cluster' sharding.
+        num_workers (int): The number of worker processes, defaults to the number of CPUs.
+
+    Raises:
+        ValueError: If the sharding is unknown, or if no shard holds min_shard_rows rows.
+
+    Returns:
+        list: A list containing the trained model of every shard, the routing index mapping the
+              'symbols' and the 'asset_classes' to their shard, and the 'rows', 'mae' and 'mse'
+              of every shard.
+    """
+    logger.info(f"Initializing sharded model training by {by}.")
+    if by == 'asset_class':
+        shards = 'asset_class_' + data['asset_class'].astype(str)
+    elif by == 'cluster':
+        shards = 'cluster_' + data['Symbol'].map(symbol_clusters(data, num_clusters)).astype(str)
+    else:
+        raise ValueError(f"Unknown sharding: {by}")
+    data = data.assign(shard=shards.to_numpy())
+    sizes = data['shard'].value_counts()
+    skipped = sizes[sizes < min_shard_rows]
+    if len(skipped):
+        logger.warning(f"Not training shards with fewer than {min_shard_rows} rows: {skipped.to_dict()}")
+    if len(skipped) == len(sizes):
+        raise ValueError(f"No shard holds {min_shard_rows} rows")
+
+    models, metrics = {}, {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers or os.cpu_count() or 1) as executor:
+        futures = [executor.submit(train_shard, shard, group[training_columns])
+                   for shard, group in data.groupby('shard') if shard not in skipped.index]
+        for future in concurrent.futures.as_completed(futures):
+            shard, model, mae, mse, num_rows = future.result()
+            logger.info(f"Shard {shard}: MAE {mae:.1f} on {num_rows} rows.")
+            models[shard] = model
+            metrics[shard] = {'rows': num_rows, 'mae': float(mae), 'mse': float(mse)}
+
+    trained = data[data['shard'].isin(list(models))]
+    routes = {'symbols': trained.groupby('Symbol', observed=True)['shard'].first().to_dict(), 'asset_classes': {}}
+    if by == 'asset_class':
+        routes['asset_classes'] = trained.groupby('asset_class', observed=True)['shard'].first().to_dict()
+    logger.info(f"Finished training {len(models)} shards.")
+    return [models, routes, metrics]
+
+def save_shards(models, routes, metrics):
+    """Saves the flattened trees of every shard and the routing index of the web API into shard_directory.
+
+    The trees are written first and the index last, each to a temporary file renamed into place,
+    so the API never routes to a partially written shard. Shards left out of the index are removed.
+
+    Args:
+        models (dict): The trained model of every shard.
+        routes (dict): The routing index returned by train_sharded.
+        metrics (dict): The 'rows', 'mae' and 'mse' of every shard.
+
+    Raises:
+        Exception: If a shard or the index cannot be saved, in which case the previous index stays in place.
+
+    Returns:
+        None
+    """
+    try:
+        os.makedirs(shard_directory, exist_ok=True)
+        logger.info(f"Attempting to save {len(models)} shards to {shard_directory}")
+        for shard, model in models.items():
+            path = os.path.join(shard_directory, f'{shard}.npz')
+            with open(path + '.tmp', 'wb') as f:
+                np.savez(f, **export_tree_arrays(model))
+            os.replace(path + '.tmp', path)
+        index = dict(routes, shards={shard: dict(metrics[shard], file=f'{shard}.npz') for shard in models})
+        path = os.path.join(shard_directory, 'routing.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(index, f)
+        os.replace(path + '.tmp', path)
+        for name in os.listdir(shard_directory):
+            if name.endswith('.npz') and name[:-len('.npz')] not in models:
+                os.remove(os.path.join(shard_directory, name))
+    except Exception as e:
+        logger.error(f"Failed to save the shards to {shard_directory}. Error - {e}")
+
+def read_data(file_name, handoff=False, columns=None, filters=None):
+    """Reads the training columns of a parquet file with the given name and returns a pandas DataFrame.
     
     If an exception is raised, logs an error message.
     Otherwise, logs a success message with the name of the parquet file.
     
     Args:
         file_name: The name of the parquet file to read.
+        handoff: Reads the training columns of the data handed off by transform_data instead, when there is one.
+        columns: The columns to read, training_columns when None.
+        filters: Optional row filters in pyarrow.parquet.read_table format, e.g. [('Date', '>', watermark)].
 
     Raises:
         Exception: If the given parquet cannot be retrieved.
@@ -123,20 +685,141 @@ def read_data(file_name):
     """
     try:
         logger.info(f"Attempting to access {file_name}.parquet")
-        df = import_parquet_as_df(data_augmentation_output_path, file_name)
+        df = import_parquet_as_df(data_augmentation_output_path, file_name, columns=columns or training_columns,
+                                  filters=filters, handoff=handoff)
+        df = df.astype(compact_training_types)
         logger.info(f"Successfully retrieved {file_name}.parquet")
+        logger.info(f"{file_name}.parquet memory usage: {memory_report(df)}")
         logger.info(f"{file_name}.parquet statistics: ")
         logger.info(df.describe().to_string())
         return df
     except Exception as e:
         logger.error(f"Failed to open {file_name}.parquet. Error message: {str(e)}")
 
-def save_model(model):
+def latest_date(file_name, handoff=False):
+    """Returns the latest date of the augmented data, reading only its 'Date' column a batch at a time.
+
+    Args:
+        file_name (str): The name of the augmented parquet file, or dataset directory.
+        handoff (bool): Reads the data handed off by transform_data instead, when there is one.
+
+    Returns:
+        pandas.Timestamp: The latest date, NaT when there are no rows.
+    """
+    if handoff and os.path.exists(handoff_path(data_augmentation_output_path, file_name)):
+        batches = import_handoff_table(data_augmentation_output_path, file_name).select(['Date']).to_batches()
+    else:
+        source = pyarrow.dataset.dataset(parquet_source(data_augmentation_output_path, file_name), format='parquet',
+                                         partitioning='hive')
+        batches = source.to_batches(columns=['Date'])
+    latest = pd.NaT
+    for batch in batches:
+        batch_latest = pd.Series(batch.column(0).to_pandas()).max()
+        if pd.notna(batch_latest) and (pd.isna(latest) or batch_latest > latest):
+            latest = pd.Timestamp(batch_latest)
+    return latest
+
+def augmented_columns(file_name, handoff=False):
+    """Returns the names of the columns of the augmented data, reading only its schema.
+
+    Args:
+        file_name (str): The name of the augmented parquet file, or dataset directory.
+        handoff (bool): Reads the data handed off by transform_data instead, when there is one.
+
+    Returns:
+        list of str: The names of the columns, including the hive partition columns of a dataset directory.
+    """
+    if handoff and os.path.exists(handoff_path(data_augmentation_output_path, file_name)):
+        return import_handoff_table(data_augmentation_output_path, file_name).schema.names
+    return pyarrow.dataset.dataset(parquet_source(data_augmentation_output_path, file_name), format='parquet',
+                                   partitioning='hive').schema.names
+
+def update_model(model, data, update='boost', num_boost_round=incremental_rounds, test_size=0.2, random_state=42,
+                 reference=None):
+    """Updates a trained model with new rows, without training on the rows it was trained on again.
+
+    The new rows are split at random into train and test sets like in train_model. 'boost' continues
+    boosting from the trees of the model on the train rows, adding num_boost_round trees, 'refit'
+    keeps the trees and refits their leaf values. Both only bin and scan the new rows.
+
+    Args:
+        model: The trained lgb.LGBMRegressor or lgb.Booster.
+        data (pandas.DataFrame): The new rows, holding the training features and target.
+        update (str): 'boost' or 'refit'.
+        num_boost_round (int): The number of trees added by 'boost'.
+        test_size (float): The fraction of the new rows held out to test the models.
+        random_state (int): The seed of the split.
+        reference: Another trained model, e.g. the last fully trained one, to test on the same test rows.
+
+    Raises:
+        ValueError: If the update is unknown.
+
+    Returns:
+        list: A list containing the updated lgb.Booster, its MAE and its MSE, and the MAE and the MSE of
+              the model before the update, on the same test rows, followed by the MAE and the MSE of the
+              reference model on them when one is given.
+    """
+    if update not in ('boost', 'refit'):
+        raise ValueError(f"Unknown model update: {update}")
+    logger.info(f"Initializing a '{update}' model update on {len(data)} new rows.")
+    booster = getattr(model, 'booster_', model)
+    data = data.dropna(subset=training_features + [training_target])
+    X = data[training_features].to_numpy(np.float32)
+    y = data[training_target].to_numpy(np.float64)
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=test_size, random_state=random_state)
+    if update == 'boost':
+        train_set = lgb.Dataset(X_train, label=y_train, feature_name=training_features, params={'verbose': -1})
+        updated = lgb.train(booster_params(), train_set, num_boost_round=num_boost_round, init_model=booster,
+                            keep_training_booster=False)
+    else:
+        updated = booster.refit(X_train, y_train)
+    y_pred, y_previous = updated.predict(X_test), booster.predict(X_test)
+    logger.info(f"Finished the model update, {updated.num_trees()} trees.")
+    metrics = [updated, mean_absolute_error(y_test, y_pred), mean_squared_error(y_test, y_pred),
+               mean_absolute_error(y_test, y_previous), mean_squared_error(y_test, y_previous)]
+    if reference is not None:
+        y_reference = getattr(reference, 'booster_', reference).predict(X_test)
+        metrics += [mean_absolute_error(y_test, y_reference), mean_squared_error(y_test, y_reference)]
+    return metrics
+
+def load_training_state():
+    """Returns the training state saved with the deployed model, None when there is no model, full model or state."""
+    model_paths = [os.path.join(model_destination_path, name) for name in ('lightgbm_predictor.joblib', full_model_file)]
+    if not (os.path.exists(training_state_path) and all(os.path.exists(path) for path in model_paths)):
+        return None
+    with open(training_state_path) as f:
+        return json.load(f)
+
+def save_training_state(state):
+    """Saves the training state of the deployed model, see deploy_model.
+
+    Args:
+        state (dict): The latest date trained on as 'watermark', and the time 'full_trained_at', the
+                      'full_mae' and the 'full_mse' of the last full training, along with the number
+                      of 'updates' since.
+
+    Raises:
+        Exception: If the state cannot be saved, in which case the next incremental run trains from scratch.
+
+    Returns:
+        None
+    """
+    try:
+        with open(training_state_path + '.tmp', 'w') as f:
+            json.dump(state, f)
+        os.replace(training_state_path + '.tmp', training_state_path)
+    except Exception as e:
+        logger.error(f"Failed to save the training state to {training_state_path}. Error - {e}")
+        if os.path.exists(training_state_path):
+            os.remove(training_state_path)
+
+def save_model(model, file_name='lightgbm_predictor.joblib'):
     """
     Save a trained model using joblib.dump.
 
     Args:
         model: A trained machine learning model.
+        file_name (str): The name of the file in model_destination_path.
     
     Raises:
         Exception: If the model cannot be saved as a joblib file.
@@ -146,12 +829,110 @@ def save_model(model):
     """
     try:
         logger.info(f"Attempting to save model to {model_destination_path}") 
-        path = os.path.join(model_destination_path, 'lightgbm_predictor.joblib')
-        with open(path, 'wb') as f:
+        path = os.path.join(model_destination_path, file_name)
+        # write next to the destination then rename, so a serving API never reads a partial model
+        with open(path + '.tmp', 'wb') as f:
             joblib.dump(model, f)
+        os.replace(path + '.tmp', path)
     except Exception as e:
         logger.error(f"Failed to save ml model to {path}. Error - {e}")
 
+# encoding of LightGBM's missing value handling in the exported tree arrays
+missing_types = {'None': 0, 'Zero': 1, 'NaN': 2}
+
+def export_tree_arrays(model):
+    """Flattens the trees of a trained LightGBM model into flat numpy arrays.
+
+    Every node of every tree is stored at one position of the node arrays. Leaves
+    point back to themselves as both children so they can be traversed any number
+    of times without changing position, which lets a predictor walk all trees in lockstep.
+
+    Args:
+        model: A trained lgb.LGBMRegressor or lgb.Booster.
+
+    Raises:
+        ValueError: If the model uses categorical splits, several trees per iteration
+                    or an objective whose output is not the raw sum of the trees.
+
+    Returns:
+        dict: A dictionary of numpy arrays holding, for every node, its split 'feature',
+              'threshold', 'left' and 'right' child, 'default_left' direction,
+              'missing_type' and leaf 'value', along with the 'roots' of every tree,
+              the 'max_depth' of the forest and the expected 'num_features'.
+    """
+    booster = getattr(model, 'booster_', model)
+    dump = booster.dump_model()
+    objective = dump.get('objective', '').split(' ')[0]
+    if dump['num_tree_per_iteration'] != 1 or objective not in (
+            'regression', 'regression_l1', 'huber', 'fair', 'quantile', 'mape'):
+        raise ValueError(f"Unsupported model for tree export: objective '{objective}'")
+
+    nodes = {
+        'feature': [], 'threshold': [], 'left': [], 'right': [],
+        'default_left': [], 'missing_type': [], 'value': [],
+    }
+    roots = []
+    max_depth = 0
+
+    def add_node(node, depth):
+        nonlocal max_depth
+        index = len(nodes['feature'])
+        for values in nodes.values():
+            values.append(0)
+        if 'leaf_value' in node:
+            max_depth = max(max_depth, depth)
+            nodes['left'][index] = nodes['right'][index] = index
+            nodes['value'][index] = node['leaf_value']
+            return index
+        if node['decision_type'] != '<=':
+            raise ValueError(f"Unsupported split type for tree export: {node['decision_type']}")
+        nodes['feature'][index] = node['split_feature']
+        nodes['threshold'][index] = node['threshold']
+        nodes['default_left'][index] = node['default_left']
+        nodes['missing_type'][index] = missing_types[node['missing_type']]
+        nodes['left'][index] = add_node(node['left_child'], depth + 1)
+        nodes['right'][index] = add_node(node['right_child'], depth + 1)
+        return index
+
+    for tree in dump['tree_info']:
+        roots.append(add_node(tree['tree_structure'], 0))
+
+    return {
+        'feature': np.array(nodes['feature'], dtype=np.int32),
+        'threshold': np.array(nodes['threshold'], dtype=np.float64),
+        'left': np.array(nodes['left'], dtype=np.int32),
+        'right': np.array(nodes['right'], dtype=np.int32),
+        'default_left': np.array(nodes['default_left'], dtype=bool),
+        'missing_type': np.array(nodes['missing_type'], dtype=np.int8),
+        'value': np.array(nodes['value'], dtype=np.float64),
+        'roots': np.array(roots, dtype=np.int32),
+        'max_depth': np.array(max_depth, dtype=np.int32),
+        'num_features': np.array(dump['max_feature_idx'] + 1, dtype=np.int32),
+    }
+
+def save_tree_arrays(model):
+    """
+    Save the flattened trees of a trained model next to the joblib model for the web API.
+
+    Args:
+        model: A trained LightGBM model.
+
+    Raises:
+        Exception: If the tree arrays cannot be exported or saved.
+
+    Returns:
+        None
+    """
+    try:
+        path = os.path.join(model_destination_path, 'lightgbm_predictor.npz')
+        logger.info(f"Attempting to save tree arrays to {path}")
+        # savez keeps the arrays uncompressed so the web API can memory-map them
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(f, **export_tree_arrays(model))
+        os.replace(path + '.tmp', path)
+    except Exception as e:
+        logger.error(f"Failed to save tree arrays to {path}. Error - {e}")
+
 def log_model_metrics(mae, mse):
     """ Log the mean absolute error and mean squared error of a trained model.
 
@@ -167,17 +948,246 @@ def log_model_metrics(mae, mse):
     logger.info(f"Random Forest Model's Mean Absolute Error: {mae}")
     logger.info(f"Random Forest Model's Mean Squared Error: {mse}")
 
-def deploy_model():
+def read_window_tails(last_dates, offset, handoff=False, batch_rows=training_batch_rows):
+    """Reads the feature store columns of the rows of every symbol dated within the window of its last date.
+
+    The data is streamed a batch of rows at a time and every row is compared with the cutoff of
+    its own symbol, so a symbol whose last date is long past only adds its own window rather
+    than the history of every other symbol since. Row groups dated before the earliest cutoff
+    are still skipped from their statistics.
+
+    Args:
+        last_dates (pandas.Series): The last date of every symbol, indexed by symbol.
+        offset (pandas.Timedelta): The length of the window.
+        handoff (bool): Reads the data handed off by transform_data instead, when there is one.
+        batch_rows (int): The largest number of rows of a batch.
+
+    Returns:
+        pyarrow.Table: the rows within the window of their symbol, in the order of the data.
+    """
+    columns = feature_store_schema.names
+    cutoffs = (last_dates - offset).rename(index=str)
+    expression = pyarrow.dataset.field('Date') > pa.scalar(cutoffs.min().to_datetime64(), pa.timestamp('ns'))
+    if handoff and os.path.exists(handoff_path(data_augmentation_output_path, 'augmented_data')):
+        batches = import_handoff_table(data_augmentation_output_path, 'augmented_data').select(columns) \
+            .filter(expression).to_batches(batch_rows)
+    else:
+        source = pyarrow.dataset.dataset(parquet_source(data_augmentation_output_path, 'augmented_data'),
+                                         format='parquet', partitioning='hive')
+        batches = source.to_batches(columns=columns, filter=expression, batch_size=batch_rows)
+    kept = []
+    for batch in batches:
+        symbols = batch.column('Symbol')
+        if not pa.types.is_dictionary(symbols.type):
+            symbols = symbols.dictionary_encode()
+        # the cutoff of every symbol of the batch, NaT for symbols without a last date
+        batch_cutoffs = cutoffs.reindex(symbols.dictionary.cast(pa.string()).to_pylist()).to_numpy(dtype='datetime64[ns]')
+        codes = symbols.indices.fill_null(0).to_numpy(zero_copy_only=False)
+        dates = batch.column('Date').cast(pa.timestamp('ns')).to_numpy(zero_copy_only=False)
+        keep = (dates > batch_cutoffs[codes]) & symbols.is_valid().to_numpy(zero_copy_only=False)
+        if keep.any():
+            kept.append(batch.filter(pa.array(keep)))
+    if not kept:
+        return pa.Table.from_batches([], feature_store_schema)
+    return pa.Table.from_batches(kept)
+
+def export_feature_store(handoff=False, window='30D'):
+    """Airflow callable function to write the feature store of the web API.
+
+    The store holds the augmented rows of every symbol dated within the window of its last
+    date, which are all the rows the web API needs to serve the latest features of a symbol
+    and to compute those of the daily bars it is sent next. Only the Symbol and Date columns
+    are read in full, the other columns are streamed and kept only within the window of every
+    symbol, see read_window_tails.
+
+    The rows are written, sorted by symbol and date, as a single record batch of an uncompressed
+    Arrow IPC file that the web API memory-maps, through a temporary file renamed into place. The journal of the bars
+    sent to the web API is removed, since the augmented data supersedes it.
+
+    Args:
+        handoff (bool): Reads the data handed off by transform_data instead, when there is one.
+        window (str): The pandas offset of the rolling window of the features.
+
+    Raises:
+        Exception: If the feature store cannot be written.
+        RuntimeError: If, with handoff, an earlier stage failed to write its parquet file, see check_persisted.
+
+    Returns:
+        None
+    """
+    logger.info(f"Initializing the export of the feature store to {feature_store_path}")
+    start_time = time.time()
+    offset = pd.Timedelta(window)
+    if handoff:
+        check_persisted(timeout=0)
+    try:
+        symbol_dates = import_parquet_table(data_augmentation_output_path, 'augmented_data', ['Symbol', 'Date'],
+                                            handoff=handoff).to_pandas()
+        last_dates = symbol_dates.groupby('Symbol', observed=True)['Date'].max()
+        del symbol_dates
+        if last_dates.empty:
+            tail = feature_store_schema.empty_table().to_pandas()
+        else:
+            tail = read_window_tails(last_dates, offset, handoff).to_pandas()
+            tail['Symbol'] = tail['Symbol'].astype(str)
+            tail = tail.sort_values(['Symbol', 'Date'], kind='stable')
+        # a single batch holding NaN rather than nulls, which the web API maps without copying any column
+        schema = feature_store_schema.with_metadata({'window': window, 'window_ns': str(offset.value)})
+        batch = pa.record_batch([
+            pa.array(tail['Symbol'].astype(str).to_numpy(), pa.string()),
+            pa.array(tail['Date'].to_numpy(dtype='datetime64[ns]'), pa.timestamp('ns')),
+        ] + [pa.array(tail[name].to_numpy(dtype=np.float64), pa.float64()) for name in feature_store_schema.names[2:]],
+            schema=schema)
+        with pa.OSFile(feature_store_path + '.tmp', 'wb') as sink:
+            with pa.ipc.new_file(sink, schema) as writer:
+                writer.write_batch(batch)
+        os.replace(feature_store_path + '.tmp', feature_store_path)
+        if os.path.exists(feature_store_journal_path):
+            os.remove(feature_store_journal_path)
+    except Exception as e:
+        logger.error(f"Failed to export the feature store to {feature_store_path}. Error - {e}")
+        raise e
+    logger.info(f"Exported {batch.num_rows} rows of {len(last_dates)} symbols. "
+                f"Elapsed time: {time.time() - start_time:.2f}")
+
+def train_full(loader='pandas', handoff=False, cache_key=None):
+    """Trains the model of train_model on the whole augmented data with the given loader, see deploy_model.
+
+    Returns:
+        list: A list containing the trained model, its MAE and its MSE, and the latest date trained on.
+    """
+    if loader == 'stream':
+        model, mae, mse = train_model_out_of_core('augmented_data', handoff=handoff, cache_key=cache_key)
+        return [model, mae, mse, latest_date('augmented_data', handoff)]
+    dataframe = read_data('augmented_data', handoff)
+    watermark = dataframe['Date'].max()
+    model, mae, mse = train_model(dataframe)
+    return [model, mae, mse, watermark]
+
+def deploy_model(handoff=False, loader='pandas', mode='fixed', split='time', num_trials=16, num_workers=None,
+                 cache=False, update='boost', full_retrain_days=7, shard_by='asset_class', num_clusters=8):
     """Airflow callable function to train then deploy model.
 
+    Every training saves the latest date trained on, its watermark, next to the model. The 'incremental'
+    mode then reads only the rows dated after the watermark and updates the deployed model with them,
+    see update_model, so its cost grows with the new data rather than with the whole history. It falls
+    back to a full training when there is no deployed model or watermark, when the last full training
+    is full_retrain_days old, or when the test MAE of the update exceeds the MAE of the last fully trained
+    model, kept as full_model_file, on the same new rows by more than incremental_metric_tolerance.
+
+    Args:
+        handoff (bool): Trains on the data handed off by transform_data, when there is one, rather than
+                        waiting for augmented_data.parquet to be written.
+        loader (str): 'pandas' reads the training columns into one DataFrame, see train_model,
+                      'stream' streams them in batches so memory does not grow with the size of the data,
+                      see train_model_out_of_core.
+        mode (str): 'fixed' trains the model of train_model on a random split, 'search' searches its
+                    hyperparameters on a process pool with a time-aware split, see search_model,
+                    'incremental' updates the deployed model with the rows added since its watermark,
+                    'sharded' trains one model per asset class or symbol cluster, see train_sharded, which
+                    the web API routes requests naming a symbol or an asset class to; the single model
+                    serving the other requests is left as it is.
+        split (str): How the 'search' mode holds out validation rows, 'time' the most recent rows of the
+                     whole data, 'symbol' the most recent rows of every symbol.
+        num_trials (int): The number of parameter sets tried in 'search' mode.
+        num_workers (int): The number of worker processes of the 'search' and 'sharded' modes, defaults to
+                           the number of CPUs.
+        cache (bool): Reuses the binned datasets of an earlier run on the same data, see dataset_cache_key.
+                      Needs the 'search' mode or the 'stream' loader, which build LightGBM datasets.
+        update (str): How the 'incremental' mode updates the model, 'boost' adds trees and 'refit' refits
+                      the leaf values of the existing trees.
+        full_retrain_days (float): The age, in days, of the last full training from which the
+                                   'incremental' mode trains from scratch again.
+        shard_by (str): How the 'sharded' mode shards the data, 'asset_class' or 'cluster'.
+        num_clusters (int): The number of symbol clusters of the 'sharded' mode.
+
+    Raises:
+        ValueError: If the loader, the mode, the split, the update or the sharding is unknown, if the
+                    'search' or the 'sharded' mode is not run with the 'pandas' loader, if the cache
+                    is used with the 'pandas' loader outside of the 'search' mode, or if the augmented
+                    data has no asset_class column to shard by.
+        RuntimeError: If, with handoff, an earlier stage failed to write its parquet file, see check_persisted.
+
     Returns:
         None
     """
     logger.info("Initializing ML model training process.")
     start_time = time.time()
-    dataframe = read_data('augmented_data')
-    model, mae, mse = train_model(dataframe)
+    if mode not in ('fixed', 'search', 'incremental', 'sharded'):
+        raise ValueError(f"Unknown training mode: {mode}")
+    if loader not in ('pandas', 'stream'):
+        raise ValueError(f"Unknown training loader: {loader}")
+    if split not in ('time', 'symbol'):
+        raise ValueError(f"Unknown training split: {split}")
+    if update not in ('boost', 'refit'):
+        raise ValueError(f"Unknown model update: {update}")
+    if cache and mode != 'search' and loader == 'pandas':
+        raise ValueError("The dataset cache needs the search mode or the stream loader")
+    if handoff:
+        # the handed off data is only durable once the earlier stages wrote it
+        check_persisted(timeout=0)
+    if mode == 'sharded':
+        if loader != 'pandas':
+            raise ValueError("The sharded mode needs the pandas loader")
+        columns = training_columns + ['Symbol'] + (['asset_class'] if shard_by == 'asset_class' else [])
+        missing = set(columns) - set(augmented_columns('augmented_data', handoff))
+        if missing:
+            raise ValueError(f"The augmented data has no {sorted(missing)} column to shard by {shard_by}, "
+                             f"the pandas ingestion mode writes no asset_class")
+        dataframe = read_data('augmented_data', handoff, columns)
+        models, routes, metrics = train_sharded(dataframe, shard_by, num_clusters, num_workers)
+        num_rows = sum(shard['rows'] for shard in metrics.values())
+        log_model_metrics(sum(shard['mae'] * shard['rows'] for shard in metrics.values()) / num_rows,
+                          sum(shard['mse'] * shard['rows'] for shard in metrics.values()) / num_rows)
+        save_shards(models, routes, metrics)
+        logger.info(f"Finished training model. Elapsed time: {time.time() - start_time:.2f}")
+        return
+    cache_key = dataset_cache_key('augmented_data', handoff) if cache else None
+    state = load_training_state() if mode == 'incremental' else None
+    if mode == 'incremental' and state is None:
+        logger.info("No deployed model or watermark, training from scratch.")
+    elif state is not None and time.time() - state['full_trained_at'] >= full_retrain_days * 24 * 3600:
+        logger.info(f"The last full training is over {full_retrain_days} days old, training from scratch.")
+        state = None
+    if state is not None:
+        watermark = pd.Timestamp(state['watermark'])
+        dataframe = read_data('augmented_data', handoff, filters=[('Date', '>', watermark)])
+        if len(dataframe) < incremental_min_rows:
+            logger.info(f"{len(dataframe)} rows added since {watermark}, keeping the deployed model.")
+            return
+        previous = joblib.load(os.path.join(model_destination_path, 'lightgbm_predictor.joblib'))
+        full = joblib.load(os.path.join(model_destination_path, full_model_file))
+        model, mae, mse, previous_mae, previous_mse, full_mae, full_mse = update_model(previous, dataframe, update,
+                                                                                       reference=full)
+        logger.info(f"Test MAE of the {len(dataframe)} rows added since {watermark}: {previous_mae} before the "
+                    f"update, {mae} after, {full_mae} for the last fully trained model.")
+        if mae > full_mae * incremental_metric_tolerance:
+            logger.warning(f"The updated model's MAE exceeds the last fully trained model's by more than "
+                           f"{incremental_metric_tolerance}x, training from scratch.")
+            state = None
+        else:
+            state.update(watermark=dataframe['Date'].max().isoformat(), updates=state['updates'] + 1)
+    if state is None and mode == 'search':
+        if loader != 'pandas':
+            raise ValueError("The search mode needs the pandas loader")
+        by = 'Symbol' if split == 'symbol' else None
+        dataframe = None
+        if cache_key is None or not os.path.isdir(dataset_cache_path(cache_key, mode='search', validation_size=0.2,
+                                                                     test_size=0.1, by=by)):
+            dataframe = read_data('augmented_data', handoff, training_columns + ([by] if by else []))
+        model, mae, mse, trials = search_model(dataframe, num_trials, num_workers, by=by, cache_key=cache_key)
+        logger.info(f"Seconds per trial: {[round(trial['seconds'], 2) for trial in trials]}")
+        watermark = latest_date('augmented_data', handoff)
+    elif state is None:
+        model, mae, mse, watermark = train_full(loader, handoff, cache_key)
+    if state is None:
+        state = {'watermark': watermark.isoformat(), 'full_trained_at': time.time(), 'full_mae': float(mae),
+                 'full_mse': float(mse), 'updates': 0}
+        # kept to test the next updates against, on their own new rows
+        save_model(model, full_model_file)
     log_model_metrics(mae, mse)
     save_model(model)
+    save_tree_arrays(model)
+    save_training_state(state)
     elapsed_time = time.time() - start_time
-    logger.info(f"Finished training model. Elapsed time: {elapsed_time:.2f}")
\ No newline at end of file
+    logger.info(f"Finished training model. Elapsed time: {elapsed_time:.2f}")
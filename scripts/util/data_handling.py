@@ -1,12 +1,90 @@
+import json
+import logging
 import os
+import subprocess
+import sys
+import time
 import pandas as pd
 import pyarrow as pa
-from pyarrow import csv, parquet
+import pyarrow.compute as pc
+from pyarrow import csv, ipc, parquet
 
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 data_directory = os.path.join(current_dir, '..', '..', 'data')
 
+# columns of a raw market data CSV and the types Arrow parses them into. The prices of the
+# raw files are float32 values printed in full (e.g. 40.29999923706055 for 40.3), so float32
+# holds them exactly; volumes exceed the 2**24 integers float32 represents exactly
+raw_csv_types = {
+    'Date': pa.timestamp('ns'),
+    'Open': pa.float32(),
+    'High': pa.float32(),
+    'Low': pa.float32(),
+    'Close': pa.float32(),
+    'Adj Close': pa.float32(),
+    'Volume': pa.float64(),
+}
+# type of the columns repeating a few strings over every row, read back by pandas as categoricals
+label_type = pa.dictionary(pa.int32(), pa.string())
+# schema of the market data written by the streaming ingestion
+market_data_schema = pa.schema(
+    list(raw_csv_types.items()) + [('Symbol', label_type), ('asset_class', label_type)]
+)
+
+# key of the Parquet schema metadata naming the columns a file is sorted by, comma separated
+sorted_by_key = b'sorted_by'
+
+# options of every Parquet file written by the pipeline, overridden by environment variables,
+# see benchmarks/bench_parquet_writer.py to compare settings on the data at hand
+parquet_writer_options = {
+    'compression': os.environ.get('PARQUET_COMPRESSION', 'snappy'),
+    'compression_level': int(os.environ['PARQUET_COMPRESSION_LEVEL']) if os.environ.get('PARQUET_COMPRESSION_LEVEL') else None,
+    'use_dictionary': os.environ.get('PARQUET_USE_DICTIONARY', '1') != '0',
+    'write_statistics': True,
+    # page level min/max statistics, letting readers skip pages and not only whole row groups
+    'write_page_index': os.environ.get('PARQUET_PAGE_INDEX', '1') != '0',
+}
+# the largest number of rows of a row group
+parquet_row_group_size = int(os.environ.get('PARQUET_ROW_GROUP_SIZE', 1024 ** 2))
+# the columns the written files are sorted by, e.g. 'Symbol,Date', files are written in the order they are produced when empty
+parquet_sort_by = [column for column in os.environ.get('PARQUET_SORT_BY', '').split(',') if column]
+
+# directory of the Arrow IPC files handing data over between the stages of the pipeline on one host,
+# in shared memory when the host has it, overridden by PIPELINE_HANDOFF_DIR
+handoff_directory = os.environ.get('PIPELINE_HANDOFF_DIR') or (
+    '/dev/shm/data_pipeline' if os.path.isdir('/dev/shm') else os.path.join(data_directory, 'handoff'))
+# the processes writing handed off data as durable Parquet files, see persist_handoff
+persist_processes = []
+# suffix of the file next to a handoff recording the state of the process persisting it, see check_persisted
+persist_status_suffix = '.persist.json'
+# log of the processes persisting handed off data, which outlive the stage that started them,
+# overridden by PIPELINE_PERSIST_LOG
+persist_log_path = os.environ.get('PIPELINE_PERSIST_LOG') or os.path.join(current_dir, '..', '..', 'logs', 'persist_handoff.log')
+
+class CopyTracker:
+    """
+    Tallies the bytes of data copied by the steps of a pipeline stage
+
+    Conversions between pandas and Arrow, concatenations, casts and sorts record the size of
+    the data they produce, so that the execution paths of a stage can be compared.
+    """
+
+    def __init__(self):
+        self.steps = {}
+
+    def record(self, step, nbytes):
+        """Adds nbytes to the bytes copied by the named step."""
+        self.steps[step] = self.steps.get(step, 0) + int(nbytes)
+
+    def total(self):
+        """Returns the bytes copied by every step."""
+        return sum(self.steps.values())
+
+    def report(self):
+        """Returns the bytes copied by each step, and their 'total'."""
+        return {**self.steps, 'total': self.total()}
+
 def path(parent_directory, file_name, extension):
     """
     Returns the full file path given a parent directory, file name and extension
@@ -39,34 +117,344 @@ def import_csv_as_df(parent_directory, file_name):
     if file_name.endswith('.csv'):
         file_name = file_name.replace('.csv', '')
     file_path = path(parent_directory, file_name, '.csv')
-    table = csv.read_csv(file_path)
+    table = csv.read_csv(file_path, convert_options=csv.ConvertOptions(column_types=raw_csv_types))
     df = table.to_pandas()
     df = validate_data_types(df)
     return df
 
+def import_csv_as_table(parent_directory, file_name):
+    """
+    Imports a CSV file as a pyarrow Table, parsing its columns natively into raw_csv_types
+
+    Columns missing from the file are filled with nulls, so every table shares the same schema.
+
+    Args:
+    parent_directory (str): the name of the parent directory holding the file
+    file_name (str): the name of the CSV file without extension
+
+    Returns:
+    pyarrow.Table: the table containing the data from the CSV file
+    """
+    if file_name.endswith('.csv'):
+        file_name = file_name.replace('.csv', '')
+    file_path = path(parent_directory, file_name, '.csv')
+    convert_options = csv.ConvertOptions(
+        column_types=raw_csv_types,
+        include_columns=list(raw_csv_types),
+        include_missing_columns=True,
+    )
+    return csv.read_csv(file_path, convert_options=convert_options)
+
 def validate_data_types(dataframe):
-    dataframe['Date'] = pd.to_datetime(dataframe['Date'])
+    if not pd.api.types.is_datetime64_any_dtype(dataframe['Date']):
+        dataframe['Date'] = pd.to_datetime(dataframe['Date'])
+    return dataframe
+
+def compact_market_data(dataframe, tracker=None):
+    """
+    Converts the columns of market data to the compact types of market_data_schema, in place
+
+    Prices become float32, and Symbol and asset_class categoricals holding every distinct
+    string once.
+
+    Args:
+    dataframe (pandas.DataFrame): the market data
+    tracker (CopyTracker): optionally records the converted columns as copied by 'cast'
+
+    Returns:
+    pandas.DataFrame: the same DataFrame
+    """
+    for column, column_type in zip(market_data_schema.names, market_data_schema.types):
+        if column not in dataframe.columns:
+            continue
+        if column_type == label_type:
+            if isinstance(dataframe[column].dtype, pd.CategoricalDtype):
+                continue
+            dataframe[column] = dataframe[column].astype('category')
+        elif column_type == pa.float32() and dataframe[column].dtype != 'float32':
+            dataframe[column] = dataframe[column].astype('float32')
+        else:
+            continue
+        if tracker is not None:
+            tracker.record('cast', dataframe[column].memory_usage(deep=True, index=False))
     return dataframe
 
-def import_parquet_as_df(parent_directory, file_name):
+def validate_table(table, schema=market_data_schema, tracker=None):
+    """
+    Casts the columns of a pyarrow Table to their types in a schema
+
+    The Arrow counterpart of validate_data_types and compact_market_data: columns already of
+    the right type, and columns missing from the schema, are kept as they are without a copy.
+
+    Args:
+    table (pyarrow.Table): the market data
+    schema (pyarrow.Schema): the types of the columns
+    tracker (CopyTracker): optionally records the converted columns as copied by 'cast'
+
+    Returns:
+    pyarrow.Table: the table with the columns of the schema cast to their types
+    """
+    for index, field in enumerate(table.schema):
+        if field.name not in schema.names or field.type == schema.field(field.name).type:
+            continue
+        column = table.column(index).cast(schema.field(field.name).type)
+        table = table.set_column(index, field.name, column)
+        if tracker is not None:
+            tracker.record('cast', column.nbytes)
+    return table
+
+def sort_table(table, column='Date', tracker=None):
+    """
+    Sorts a pyarrow Table by one or several columns, keeping the order of equal values
+
+    Args:
+    table (pyarrow.Table): the table to sort
+    column (str or list): the column to sort by, or the columns to sort by, outermost first
+    tracker (CopyTracker): optionally records the sorted table as copied by 'sort'
+
+    Returns:
+    pyarrow.Table: the sorted table, the same table when it is already sorted
+    """
+    columns = [column] if isinstance(column, str) else list(column)
+    # Arrow does not sort tables by dictionary columns, so their decoded values are sorted instead
+    keys = pa.table({name: table.column(name).cast(table.schema.field(name).type.value_type)
+                     if pa.types.is_dictionary(table.schema.field(name).type) else table.column(name)
+                     for name in columns})
+    if len(columns) == 1:
+        values = keys.column(0)
+        if len(values) < 2 or pc.all(pc.greater_equal(values[1:], values[:-1])).as_py():
+            return table
+    indices = pc.sort_indices(keys, [(name, 'ascending') for name in columns])
+    if len(columns) > 1 and pc.all(pc.equal(indices, pa.array(range(len(indices)), indices.type))).as_py() is not False:
+        return table
+    table = table.take(indices)
+    if tracker is not None:
+        tracker.record('sort', table.nbytes)
+    return table
+
+def drop_index_columns(table):
+    """Returns a pyarrow Table without the columns holding the index of the DataFrame it was saved from."""
+    index_columns = [column for column in (table.schema.pandas_metadata or {}).get('index_columns', [])
+                     if isinstance(column, str)]
+    return table.drop(index_columns)
+
+def memory_report(dataframe):
+    """
+    Returns the memory used by a DataFrame and the memory it would use without compact types
+
+    The latter counts float64 instead of float32 columns, and object columns holding one
+    shared string object per distinct value instead of categoricals.
+
+    Args:
+    dataframe (pandas.DataFrame): the data
+
+    Returns:
+    dict: the 'bytes' used, the 'uncompacted_bytes' and the 'saved_bytes'
+    """
+    used = int(dataframe.memory_usage(deep=True).sum())
+    uncompacted = int(dataframe.index.memory_usage(deep=True))
+    for column in dataframe.columns:
+        values = dataframe[column]
+        if values.dtype == 'float32':
+            uncompacted += values.nbytes * 2
+        elif isinstance(values.dtype, pd.CategoricalDtype):
+            uncompacted += 8 * len(values) + sum(sys.getsizeof(category) for category in values.cat.categories)
+        else:
+            uncompacted += int(values.memory_usage(deep=True, index=False))
+    return {'bytes': used, 'uncompacted_bytes': uncompacted, 'saved_bytes': uncompacted - used}
+
+def row_filters(filters=None, symbols=None, start_date=None, end_date=None):
+    """
+    Combines row filters with restrictions on the symbols and the dates read
+
+    Args:
+    filters (list): optional row filters in pyarrow.parquet.read_table format, either a list of
+                    (column, op, value) tuples that must all hold, or a list of such lists of which one must hold
+    symbols (list): optional symbols to read
+    start_date: optional first date to read, inclusive
+    end_date: optional last date to read, inclusive
+
+    Returns:
+    list: the filters in pyarrow.parquet.read_table format, None when rows are not filtered
+    """
+    restrictions = []
+    if symbols is not None:
+        restrictions.append(('Symbol', 'in', list(symbols)))
+    if start_date is not None:
+        restrictions.append(('Date', '>=', pd.Timestamp(start_date)))
+    if end_date is not None:
+        restrictions.append(('Date', '<=', pd.Timestamp(end_date)))
+    if not filters:
+        return restrictions or None
+    if isinstance(filters[0], tuple):
+        return list(filters) + restrictions
+    return [list(conjunction) + restrictions for conjunction in filters]
+
+def parquet_source(parent_directory, file_name):
+    """
+    Returns the path the data named file_name is read from
+
+    A Parquet file takes precedence over a dataset directory of the same name.
+
+    Args:
+    parent_directory (str): the name of the parent directory
+    file_name (str): the name of the Parquet file without extension, or of the dataset directory
+
+    Returns:
+    str: the path of the Parquet file, or of the dataset directory when only the directory exists
+    """
+    file_path = path(parent_directory, file_name, '.parquet')
+    if not os.path.exists(file_path) and os.path.isdir(path(parent_directory, file_name, '')):
+        return path(parent_directory, file_name, '')
+    return file_path
+
+def import_parquet_table(parent_directory, file_name, columns=None, filters=None, handoff=False):
+    """
+    Imports a Parquet file, or a dataset directory when there is no file, as a pyarrow Table
+
+    Args:
+    parent_directory (str): the name of the parent directory
+    file_name (str): the name of the Parquet file without extension
+    columns (list): optional names of the only columns to read
+    filters (list): optional row filters in pyarrow.parquet.read_table format, e.g.
+                    [('Symbol', 'in', ['SPY'])], evaluated while reading
+    handoff (bool): reads the handoff of the data instead, when there is one, see import_handoff_table
+
+    Returns:
+    pyarrow.Table: the table containing the data from the Parquet file
+    """
+    if handoff and os.path.exists(handoff_path(parent_directory, file_name)):
+        table = import_handoff_table(parent_directory, file_name)
+        if filters:
+            table = table.filter(parquet.filters_to_expression(filters))
+        return table.select(columns) if columns is not None else table
+    source = parquet_source(parent_directory, file_name)
+    if os.path.isdir(source):
+        return import_parquet_dataset(parent_directory, file_name, filters, columns)
+    return parquet.read_table(source, columns=columns, filters=filters)
+
+def import_parquet_as_df(parent_directory, file_name, filters=None, columns=None, symbols=None,
+                         start_date=None, end_date=None, tracker=None, handoff=False):
     """
     Imports a Parquet file as a Pandas DataFrame
 
+    Only the requested columns are read, and the filters are pushed down to pyarrow, which
+    skips the row groups and partitions whose statistics rule them out before decoding them.
+    The frame is not sorted again when the file records that it is sorted by 'Date', or when
+    its dates are already in order.
+
     Args:
     parent_directory (str): the name of the parent directory
     file_name (str): the name of the Parquet file without extension
+    filters (list): optional row filters in pyarrow.parquet.read_table format, e.g.
+                    [('Symbol', 'in', ['SPY'])], evaluated while reading
+    columns (list): optional names of the only columns to read, the frame is only sorted when they include 'Date'
+    symbols (list): optional symbols to read
+    start_date: optional first date to read, inclusive
+    end_date: optional last date to read, inclusive
+    tracker (CopyTracker): optionally records the copies made by 'to_pandas' and 'sort'
+    handoff (bool): reads the handoff of the data instead, when there is one, see import_handoff_table
 
     Returns:
     pandas.DataFrame: the DataFrame containing the data from the Parquet file, sorted by 'Date'
     """
-    file_path = path(parent_directory, file_name, '.parquet')
-    table = parquet.read_table(file_path)
+    filters = row_filters(filters, symbols, start_date, end_date)
+    handoff = handoff and os.path.exists(handoff_path(parent_directory, file_name))
+    table = import_parquet_table(parent_directory, file_name, columns, filters, handoff)
+    # a dataset directory is made of several files, which are only sorted one by one
+    known_sorted = ((handoff or not os.path.isdir(parquet_source(parent_directory, file_name)))
+                    and (table.schema.metadata or {}).get(sorted_by_key) == b'Date')
     df = table.to_pandas()
+    if tracker is not None:
+        tracker.record('to_pandas', df.memory_usage(deep=True).sum())
+    if 'Date' not in df.columns:
+        return df
     df = validate_data_types(df)
-    df = df.sort_values(by='Date')
+    if not known_sorted and not df['Date'].is_monotonic_increasing:
+        df = df.sort_values(by='Date')
+        if tracker is not None:
+            tracker.record('sort', df.memory_usage(deep=True).sum())
     return df
 
-def export_df_as_parquet(dataframe, parent_directory, file_name):
+def import_parquet_dataset(parent_directory, dataset_name, filters=None, columns=None):
+    """
+    Imports a hive-partitioned Parquet dataset directory as a pyarrow Table
+
+    Partition columns are read back as label_type dictionaries, like the columns of the files
+    written by the streaming ingestion.
+
+    Args:
+    parent_directory (str): the name of the parent directory
+    dataset_name (str): the name of the dataset directory
+    filters (list): optional row filters in pyarrow.parquet.read_table format,
+                    partitions not matching them are skipped without being read
+    columns (list): optional names of the only columns to read, partition columns included
+
+    Returns:
+    pyarrow.Table: the table containing the data of every partition
+    """
+    table = parquet.read_table(path(parent_directory, dataset_name, ''), columns=columns, partitioning='hive',
+                               filters=filters)
+    for index, field in enumerate(table.schema):
+        if pa.types.is_dictionary(field.type) and field.type != label_type:
+            table = table.set_column(index, field.name, table.column(index).cast(label_type))
+    return table
+
+def partition_path(dataset_path, partition):
+    """
+    Returns the directory of a partition inside a hive-partitioned dataset
+
+    Args:
+    dataset_path (str): the path of the dataset directory
+    partition (list of tuple): the (column, value) pairs identifying the partition, outermost first
+
+    Returns:
+    str: the path of the partition directory, e.g. dataset/asset_class=etfs/Symbol=SPY
+    """
+    return os.path.join(dataset_path, *[f'{column}={value}' for column, value in partition])
+
+def write_parquet(table, file_path, sort_by=None, sorted_by=None, row_group_size=None, **options):
+    """
+    Writes a pyarrow Table to a Parquet file atomically, with the options of parquet_writer_options
+
+    The file is written under a hidden temporary name, which dataset readers skip, then renamed
+    over the previous file, so readers never see a partial file. The columns the data is sorted
+    by are recorded both in the schema metadata and as the sorting columns of the row groups.
+
+    Args:
+    table (pyarrow.Table): the table to write
+    file_path (str): the path of the Parquet file
+    sort_by (list): the columns to sort the table by before writing it, parquet_sort_by when None,
+                    the columns missing from the table are left out
+    sorted_by (str or list): the columns the table is already sorted by, outermost first
+    row_group_size (int): the largest number of rows of a row group, parquet_row_group_size when None
+    options: override parquet_writer_options, e.g. compression='zstd'
+
+    Returns:
+    str: the path of the written file
+    """
+    sort_by = [column for column in (parquet_sort_by if sort_by is None else sort_by) if column in table.column_names]
+    sorted_by = [sorted_by] if isinstance(sorted_by, str) else list(sorted_by or [])
+    if sort_by and sort_by != sorted_by[:len(sort_by)]:
+        table = sort_table(table, sort_by)
+        sorted_by = sort_by
+    sorting_columns = None
+    if sorted_by:
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), sorted_by_key: ','.join(sorted_by).encode()})
+        sorting_columns = [parquet.SortingColumn(table.schema.get_field_index(column)) for column in sorted_by]
+    directory, file_name = os.path.split(file_path)
+    tmp_path = os.path.join(directory, f'.{file_name}.tmp')
+    try:
+        parquet.write_table(table, tmp_path, row_group_size=row_group_size or parquet_row_group_size,
+                            sorting_columns=sorting_columns, **{**parquet_writer_options, **options})
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, file_path)
+    return file_path
+
+def export_df_as_parquet(dataframe, parent_directory, file_name, tracker=None, handoff=False):
     """
     Exports a Pandas DataFrame as a Parquet file
 
@@ -74,7 +462,270 @@ def export_df_as_parquet(dataframe, parent_directory, file_name):
     dataframe (pandas.DataFrame): the DataFrame to export
     parent_directory (str): the name of the parent directory
     file_name (str): the name of the Parquet file without extension
+    tracker (CopyTracker): optionally records the conversion to Arrow as copied by 'from_pandas'
+    handoff (bool): hands the data off to the next stage and writes the Parquet file asynchronously,
+                    see export_table_as_parquet
     """
-    file_path = path(parent_directory, file_name, '.parquet')
     table = pa.Table.from_pandas(dataframe)
-    parquet.write_table(table, file_path)
+    if tracker is not None:
+        tracker.record('from_pandas', table.nbytes)
+    sorted_by = None
+    if 'Date' in dataframe.columns and pd.api.types.is_datetime64_any_dtype(dataframe['Date']) \
+            and dataframe['Date'].is_monotonic_increasing:
+        sorted_by = 'Date'
+    export_table_as_parquet(table, parent_directory, file_name, sorted_by, handoff)
+
+def export_table_as_parquet(table, parent_directory, file_name, sorted_by=None, handoff=False):
+    """
+    Exports a pyarrow Table as a Parquet file
+
+    With handoff, the table is also written to an Arrow IPC file, which the next stage reads
+    without decoding Parquet, and the Parquet file is written by a separate process. Otherwise a
+    previous handoff of the data is removed, so that readers never prefer outdated data.
+
+    Args:
+    table (pyarrow.Table): the table to export
+    parent_directory (str): the name of the parent directory
+    file_name (str): the name of the Parquet file without extension
+    sorted_by (str): the column the table is sorted by, recorded so that import_parquet_as_df skips sorting it
+    handoff (bool): hands the table off and writes the Parquet file asynchronously
+
+    Returns:
+    subprocess.Popen: the process writing the Parquet file with handoff, None otherwise
+    """
+    file_path = path(parent_directory, file_name, '.parquet')
+    if not handoff:
+        discard_handoff(parent_directory, file_name)
+        write_parquet(table, file_path, sorted_by=sorted_by)
+        return None
+    if sorted_by is not None:
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), sorted_by_key: sorted_by.encode()})
+    export_table_as_handoff(table, parent_directory, file_name)
+    return persist_handoff(parent_directory, file_name, sorted_by)
+
+def handoff_path(parent_directory, file_name):
+    """Returns the path of the Arrow IPC file handing the data of a Parquet file over to the next stage."""
+    return os.path.join(handoff_directory, os.path.basename(os.path.normpath(parent_directory)), file_name + '.arrow')
+
+def export_table_as_handoff(table, parent_directory, file_name):
+    """
+    Writes a pyarrow Table to an uncompressed Arrow IPC file in handoff_directory
+
+    The file, also known as Feather V2, holds the buffers of the table as they are in memory,
+    so a reader memory-maps it without decoding nor copying anything. It is written under a
+    hidden temporary name then renamed, so a reader never sees a partial file, and a reader
+    still mapping the previous file keeps its data.
+
+    Args:
+    table (pyarrow.Table): the table to hand off
+    parent_directory (str): the name of the parent directory of the Parquet file holding the data
+    file_name (str): the name of the Parquet file without extension
+
+    Returns:
+    str: the path of the written file
+    """
+    file_path = handoff_path(parent_directory, file_name)
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    tmp_path = os.path.join(os.path.dirname(file_path), f'.{file_name}.arrow.tmp')
+    with pa.OSFile(tmp_path, 'wb') as sink, ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    os.replace(tmp_path, file_path)
+    return file_path
+
+def import_handoff_table(parent_directory, file_name):
+    """
+    Memory-maps the Arrow IPC file handing the data of a Parquet file over, see export_table_as_handoff
+
+    The columns of the returned table point into the mapped file, which stays mapped as long as
+    they are referenced; only the pages of the columns used are ever read.
+
+    Args:
+    parent_directory (str): the name of the parent directory of the Parquet file holding the data
+    file_name (str): the name of the Parquet file without extension
+
+    Raises:
+    FileNotFoundError: If the data was not handed off
+
+    Returns:
+    pyarrow.Table: the handed off table
+    """
+    return ipc.open_file(pa.memory_map(handoff_path(parent_directory, file_name))).read_all()
+
+def discard_handoff(parent_directory, file_name, poll_interval=0.1):
+    """
+    Removes the handoff of the data of a Parquet file, if any, once it is superseded by data written elsewhere
+
+    A process started by persist_handoff and still writing the handoff is waited for first, so it
+    neither overwrites the newer Parquet file nor records the state of a handoff removed under it.
+    A process not started yet exits without writing anything once it finds the status file removed.
+
+    Args:
+    parent_directory (str): the name of the parent directory of the Parquet file holding the data
+    file_name (str): the name of the Parquet file without extension
+    poll_interval (float): the time between two reads of the status of a running process, in seconds
+    """
+    file_path = handoff_path(parent_directory, file_name)
+    status_path = file_path + persist_status_suffix
+    while True:
+        try:
+            with open(status_path) as f:
+                status = json.load(f)
+        except FileNotFoundError:
+            break
+        if status['state'] != 'running' or 'pid' not in status or not process_alive(status['pid']):
+            break
+        time.sleep(poll_interval)
+    for file_path in (file_path, status_path):
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+def write_persist_status(status_path, **status):
+    """Records the state of the process persisting a handoff, through a temporary file renamed into place."""
+    tmp_path = os.path.join(os.path.dirname(status_path), '.' + os.path.basename(status_path) + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(status, f)
+    os.replace(tmp_path, status_path)
+
+def persist_handoff(parent_directory, file_name, sorted_by=None):
+    """
+    Starts a process writing handed off data to its Parquet file with write_parquet
+
+    The process runs in its own session, so it outlives the stage that started it, and the
+    durable copy of the data is written off the critical path of the pipeline. It records its
+    state in a status file next to the handoff and logs its failures to persist_log_path, so
+    that the later stages, which run in other processes, find out with check_persisted.
+
+    Args:
+    parent_directory (str): the name of the parent directory
+    file_name (str): the name of the Parquet file without extension
+    sorted_by (str): the column the data is sorted by
+
+    Returns:
+    subprocess.Popen: the writing process, also appended to persist_processes
+    """
+    arguments = [handoff_path(parent_directory, file_name), path(parent_directory, file_name, '.parquet'), sorted_by or '']
+    status_path = arguments[0] + persist_status_suffix
+    # the status is written before the process starts, then again with its pid before it is
+    # released by closing its stdin, after which only the process replaces it
+    write_persist_status(status_path, state='running', parquet_file=arguments[1])
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__)] + arguments, stdin=subprocess.PIPE,
+                               start_new_session=True)
+    try:
+        write_persist_status(status_path, state='running', parquet_file=arguments[1], pid=process.pid)
+    finally:
+        process.stdin.close()
+    persist_processes.append(process)
+    return process
+
+def wait_for_persisted(timeout=None):
+    """
+    Waits for the processes started by persist_handoff in this process
+
+    Args:
+    timeout (float): the longest wait for each process, in seconds
+
+    Raises:
+    RuntimeError: If a Parquet file could not be written
+
+    Returns:
+    int: the number of Parquet files written
+    """
+    failed = []
+    num_processes = len(persist_processes)
+    while persist_processes:
+        process = persist_processes.pop(0)
+        if process.wait(timeout) != 0:
+            failed.append(process.args[3])
+    if failed:
+        raise RuntimeError(f"Failed to write {failed}")
+    return num_processes
+
+def check_persisted(timeout=None, poll_interval=0.1):
+    """
+    Checks the processes started by persist_handoff in any process, from their status files
+
+    Stages run in processes of their own, so a stage, or a final task of the pipeline, checks
+    the writers started by the earlier stages through the status files of their handoffs. A
+    writer still running after the timeout is left running and not reported.
+
+    Args:
+    timeout (float): the longest wait for the running processes, in seconds, 0 to only check
+                     the finished ones and None to wait for every one of them
+    poll_interval (float): the time between two reads of the status of a running process, in seconds
+
+    Raises:
+    RuntimeError: If a Parquet file could not be written, or its process exited without saying
+
+    Returns:
+    int: the number of Parquet files written
+    """
+    if not os.path.isdir(handoff_directory):
+        return 0
+    status_paths = [os.path.join(directory, name) for directory, _, names in os.walk(handoff_directory)
+                    for name in sorted(names) if name.endswith(persist_status_suffix)]
+    deadline = None if timeout is None else time.monotonic() + timeout
+    failed, num_written = [], 0
+    for status_path in status_paths:
+        while True:
+            try:
+                with open(status_path) as f:
+                    status = json.load(f)
+            except FileNotFoundError:
+                # the handoff was discarded meanwhile
+                status = {'state': 'discarded'}
+            if status['state'] != 'running':
+                break
+            if 'pid' in status and not process_alive(status['pid']):
+                # the status is read again, the process may have finished in between
+                with open(status_path) as f:
+                    status = json.load(f)
+                if status['state'] == 'running':
+                    status = dict(status, state='failed', error='the process exited without recording its status')
+                break
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            time.sleep(poll_interval)
+        if status['state'] == 'written':
+            num_written += 1
+        elif status['state'] == 'failed':
+            failed.append(f"{status['parquet_file']}: {status['error']}")
+    if failed:
+        raise RuntimeError(f"Failed to write {failed}")
+    return num_written
+
+def process_alive(pid):
+    """Returns whether a process is still running."""
+    for process in persist_processes:
+        if process.pid == pid:
+            # a child of this process stays in the process table until it is waited for
+            return process.poll() is None
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+if __name__ == '__main__':
+    # started by persist_handoff: python data_handling.py <handoff file> <parquet file> <sorted by>
+    handoff_file, parquet_file, sorted_column = sys.argv[1:4]
+    status_file = handoff_file + persist_status_suffix
+    # released once persist_handoff recorded the pid of this process
+    sys.stdin.read()
+    if not os.path.exists(status_file) and not os.path.exists(handoff_file):
+        # the handoff was discarded before this process started, its data is superseded
+        sys.exit(0)
+    try:
+        write_parquet(ipc.open_file(pa.memory_map(handoff_file)).read_all(), parquet_file, sorted_by=sorted_column or None)
+    except Exception as e:
+        # the stage that started this process may be long gone, the failure is logged to a file of its own
+        logger = logging.getLogger('persist_handoff')
+        handler = logging.FileHandler(persist_log_path)
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+        logger.addHandler(handler)
+        logger.error(f"Failed to write {handoff_file} to {parquet_file}. Error - {e}")
+        write_persist_status(status_file, state='failed', parquet_file=parquet_file, pid=os.getpid(), error=str(e))
+        sys.exit(1)
+    write_persist_status(status_file, state='written', parquet_file=parquet_file, pid=os.getpid())
@@ -0,0 +1,204 @@
+import numpy as np
+import pandas as pd
+
+
+class RollingFeatureEngine:
+    """Computes per-symbol rolling window statistics over contiguous numpy arrays.
+
+    The frame is sorted once by (symbol, date) and the group boundaries are found once,
+    then every statistic reuses them. Windows follow pandas' groupby().rolling(window, on=date)
+    semantics: a time based window such as '30D' holds the rows of the same symbol dated within
+    the window up to and including the current row and needs one non-NaN value, a fixed window
+    of n rows needs n non-NaN values. Rows must be in date order within each symbol, as
+    required by pandas.
+
+    Args:
+        dataframe (pandas.DataFrame): the data to compute statistics for.
+        by (str): the column identifying the groups.
+        on (str): the datetime column the time based windows are computed on.
+        max_chunk_cells (int): the largest (rows x window length) matrix gathered at once
+                               when computing medians.
+    """
+
+    def __init__(self, dataframe, by='Symbol', on='Date', max_chunk_cells=2 ** 22):
+        self.dataframe = dataframe
+        self.max_chunk_cells = max_chunk_cells
+        codes, _ = pd.factorize(dataframe[by], sort=True)
+        dates = dataframe[on].to_numpy(dtype='datetime64[ns]').view(np.int64)
+        # lexsort is stable, so rows sharing a symbol and a date keep their frame order
+        self.order = np.lexsort((dates, codes))
+        self.dates = dates[self.order]
+        codes = codes[self.order]
+        boundaries = np.flatnonzero(np.diff(codes)) + 1
+        self.group_starts = np.concatenate([[0], boundaries]).astype(np.int64)
+        self.group_ends = np.concatenate([boundaries, [len(codes)]]).astype(np.int64)
+        self._window_starts = {}
+
+    def window_starts(self, window):
+        """Returns the position of the first row in the window of every sorted row, and the minimum number of values.
+
+        Args:
+            window (str or int): a pandas offset such as '30D', or a number of rows.
+
+        Returns:
+            tuple: the window starts as an int64 array, and the minimum number of non-NaN values.
+        """
+        if window not in self._window_starts:
+            starts = np.empty(len(self.dates), dtype=np.int64)
+            if isinstance(window, (int, np.integer)):
+                positions = np.arange(len(self.dates), dtype=np.int64)
+                for group_start, group_end in zip(self.group_starts, self.group_ends):
+                    starts[group_start:group_end] = np.maximum(positions[group_start:group_end] - window + 1, group_start)
+                min_periods = window
+            else:
+                offset = pd.Timedelta(window).value
+                for group_start, group_end in zip(self.group_starts, self.group_ends):
+                    dates = self.dates[group_start:group_end]
+                    starts[group_start:group_end] = group_start + np.searchsorted(dates, dates - offset, side='right')
+                min_periods = 1
+            self._window_starts[window] = (starts, min_periods)
+        return self._window_starts[window]
+
+    def mean(self, column, window='30D'):
+        """Returns the rolling mean of a column, computed from per-symbol prefix sums.
+
+        Args:
+            column (str or pandas.Series): the column to average, or values aligned on the frame.
+            window (str or int): a pandas offset such as '30D', or a number of rows.
+
+        Returns:
+            pandas.Series: the rolling mean of every row, aligned on the index of the frame.
+        """
+        starts, min_periods = self.window_starts(window)
+        values = self._sorted_values(column)
+        window_sums, window_counts = self._window_sums(values, starts)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            result = (window_sums / window_counts).astype(np.float64)
+        result[window_counts < min_periods] = np.nan
+        return self._unsort(result, column)
+
+    def sum(self, column, window='30D'):
+        """Returns the rolling sum of a column, computed from per-symbol prefix sums.
+
+        Args:
+            column (str or pandas.Series): the column to sum, or values aligned on the frame.
+            window (str or int): a pandas offset such as '30D', or a number of rows.
+
+        Returns:
+            pandas.Series: the rolling sum of every row, aligned on the index of the frame.
+        """
+        starts, min_periods = self.window_starts(window)
+        window_sums, window_counts = self._window_sums(self._sorted_values(column), starts)
+        result = window_sums.astype(np.float64)
+        result[window_counts < min_periods] = np.nan
+        return self._unsort(result, column)
+
+    def std(self, column, window='30D'):
+        """Returns the rolling sample standard deviation of a column.
+
+        Computed from per-symbol prefix sums of the values and of their squares, shifted by
+        the first value of the symbol to limit cancellation. Needs two non-NaN values in
+        time based windows, like pandas.
+
+        Args:
+            column (str or pandas.Series): the column to take the deviation of, or values aligned on the frame.
+            window (str or int): a pandas offset such as '30D', or a number of rows.
+
+        Returns:
+            pandas.Series: the rolling standard deviation of every row, aligned on the index of the frame.
+        """
+        starts, min_periods = self.window_starts(window)
+        values = self._sorted_values(column)
+        shifted = np.empty_like(values)
+        for group_start, group_end in zip(self.group_starts, self.group_ends):
+            group_values = values[group_start:group_end]
+            valid = group_values[~np.isnan(group_values)]
+            shifted[group_start:group_end] = group_values - (valid[0] if len(valid) else 0)
+        window_sums, window_counts = self._window_sums(shifted, starts)
+        window_squares, _ = self._window_sums(shifted * shifted, starts)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            variance = (window_squares - window_sums * window_sums / window_counts) / (window_counts - 1)
+        result = np.sqrt(np.maximum(variance, 0).astype(np.float64))
+        result[window_counts < max(min_periods, 2)] = np.nan
+        return self._unsort(result, column)
+
+    def shift(self, column, periods=1):
+        """Returns the value of a column `periods` rows earlier within the same symbol.
+
+        Args:
+            column (str or pandas.Series): the column to shift, or values aligned on the frame.
+            periods (int): the number of rows to shift by, at least 1.
+
+        Returns:
+            pandas.Series: the shifted values, NaN for the first `periods` rows of every symbol.
+        """
+        values = self._sorted_values(column)
+        positions = np.arange(len(values), dtype=np.int64)
+        group_of_row = np.repeat(self.group_starts, self.group_ends - self.group_starts)
+        result = np.full(len(values), np.nan)
+        shifted = positions - periods >= group_of_row
+        result[shifted] = values[positions[shifted] - periods]
+        return self._unsort(result, column)
+
+    def _window_sums(self, values, starts):
+        """Returns the sum and the number of the non-NaN values in the window of every sorted row."""
+        valid = ~np.isnan(values)
+        ends = np.arange(1, len(values) + 1)
+        sums = np.empty(len(values) + 1, dtype=np.longdouble)
+        counts = np.empty(len(values) + 1, dtype=np.int64)
+        sums[0] = counts[0] = 0
+        # prefix sums restart for every symbol so their rounding error stays relative to the symbol's own values
+        for group_start, group_end in zip(self.group_starts, self.group_ends):
+            sums[group_start + 1:group_end + 1] = np.cumsum(
+                np.where(valid[group_start:group_end], values[group_start:group_end], 0), dtype=np.longdouble)
+            counts[group_start + 1:group_end + 1] = np.cumsum(valid[group_start:group_end])
+        group_of_start = np.repeat(self.group_starts, self.group_ends - self.group_starts)
+        window_sums = sums[ends] - np.where(starts > group_of_start, sums[starts], 0)
+        window_counts = counts[ends] - np.where(starts > group_of_start, counts[starts], 0)
+        return window_sums, window_counts
+
+    def median(self, column, window='30D'):
+        """Returns the rolling median of a column.
+
+        The values of every window are gathered into a row of a NaN padded matrix, a chunk of
+        rows at a time, and sorted so that NaNs end up after the valid values; the median is
+        then read at the middle of the valid values.
+
+        Args:
+            column (str): the column to take the median of.
+            window (str or int): a pandas offset such as '30D', or a number of rows.
+
+        Returns:
+            pandas.Series: the rolling median of every row, aligned on the index of the frame.
+        """
+        starts, min_periods = self.window_starts(window)
+        values = self._sorted_values(column)
+        result = np.full(len(values), np.nan)
+        if len(values) == 0:
+            return self._unsort(result, column)
+        positions = np.arange(len(values), dtype=np.int64)
+        max_length = int((positions - starts).max()) + 1
+        offsets = np.arange(max_length, dtype=np.int64)
+        chunk_rows = max(1, self.max_chunk_cells // max_length)
+        for chunk_start in range(0, len(values), chunk_rows):
+            rows = positions[chunk_start:chunk_start + chunk_rows]
+            cells = starts[chunk_start:chunk_start + chunk_rows, None] + offsets
+            in_window = cells <= rows[:, None]
+            window_values = np.where(in_window, values[np.minimum(cells, rows[:, None])], np.nan)
+            window_values.sort(axis=1)
+            counts = (~np.isnan(window_values)).sum(axis=1)
+            lower = np.take_along_axis(window_values, np.maximum(counts - 1, 0)[:, None] // 2, axis=1)[:, 0]
+            upper = np.take_along_axis(window_values, (counts // 2)[:, None], axis=1)[:, 0]
+            medians = (lower + upper) / 2
+            medians[counts < min_periods] = np.nan
+            result[chunk_start:chunk_start + len(rows)] = medians
+        return self._unsort(result, column)
+
+    def _sorted_values(self, column):
+        values = self.dataframe[column] if isinstance(column, str) else column
+        return np.asarray(values, dtype=np.float64)[self.order]
+
+    def _unsort(self, values, column):
+        result = np.empty_like(values)
+        result[self.order] = values
+        return pd.Series(result, index=self.dataframe.index, name=column if isinstance(column, str) else None)
@@ -0,0 +1,127 @@
+import concurrent.futures
+import numpy as np
+import pandas as pd
+from .feature_engine import RollingFeatureEngine
+
+
+class Feature:
+    """A feature computed from the columns of the market data and from other features.
+
+    Args:
+        name (str): the name of the column holding the feature.
+        compute (callable): takes the RollingFeatureEngine of the data, the window and a dict
+                            mapping the name of every dependency to its values, and returns
+                            the values of the feature aligned on the frame of the engine.
+        inputs (tuple of str): the columns of the market data read by compute.
+        window (str or int): the rolling window of the feature, None when it has none.
+        dependencies (tuple of str): the features whose values compute needs.
+    """
+
+    def __init__(self, name, compute, inputs=(), window=None, dependencies=()):
+        self.name = name
+        self.compute = compute
+        self.inputs = tuple(inputs)
+        self.window = window
+        self.dependencies = tuple(dependencies)
+
+
+class FeatureRegistry:
+    """Registers features and computes them in dependency order, independent features in parallel.
+
+    Every feature of a computation shares one RollingFeatureEngine, so the data is sorted and
+    the symbol groups found once, and the window boundaries of every distinct window are found
+    once before any feature runs. The features run on a thread pool as soon as all of their
+    dependencies are available; the numpy work behind them releases the GIL.
+
+    Args:
+        by (str): the column identifying the groups.
+        on (str): the datetime column the time based windows are computed on.
+    """
+
+    def __init__(self, by='Symbol', on='Date'):
+        self.by = by
+        self.on = on
+        self.features = {}
+
+    def register(self, name, inputs=(), window=None, dependencies=()):
+        """Returns a decorator registering a function as the compute function of a feature, see Feature."""
+        def decorator(compute):
+            if name in self.features:
+                raise ValueError(f"Feature {name} is already registered")
+            self.features[name] = Feature(name, compute, inputs, window, dependencies)
+            return compute
+        return decorator
+
+    def resolve(self, names):
+        """Returns the requested features and their dependencies, every feature after its dependencies.
+
+        Args:
+            names (list of str): the names of the requested features.
+
+        Raises:
+            ValueError: If a feature is unknown or depends on itself.
+
+        Returns:
+            list of Feature: the features to compute.
+        """
+        order = []
+        visiting = set()
+
+        def visit(name):
+            if name in visiting:
+                raise ValueError(f"Feature {name} depends on itself")
+            if any(feature.name == name for feature in order):
+                return
+            if name not in self.features:
+                raise ValueError(f"Unknown feature: {name}")
+            visiting.add(name)
+            for dependency in self.features[name].dependencies:
+                visit(dependency)
+            visiting.remove(name)
+            order.append(self.features[name])
+
+        for name in names:
+            visit(name)
+        return order
+
+    def input_columns(self, names):
+        """Returns the columns of the market data read to compute the requested features, in a stable order."""
+        columns = [self.by, self.on]
+        for feature in self.resolve(names):
+            columns += [column for column in feature.inputs if column not in columns]
+        return columns
+
+    def compute(self, dataframe, names, window=None, max_workers=None):
+        """Computes the requested features of the market data.
+
+        Args:
+            dataframe (pandas.DataFrame): the data, holding at least the input columns of the features.
+            names (list of str): the names of the requested features.
+            window (str or int): overrides the window of every feature that has one.
+            max_workers (int): the number of threads computing features.
+
+        Returns:
+            pandas.DataFrame: one column per requested feature, aligned on the index of the frame.
+        """
+        features = self.resolve(names)
+        engine = RollingFeatureEngine(dataframe, by=self.by, on=self.on)
+        windows = {feature.name: feature.window if window is None or feature.window is None else window
+                   for feature in features}
+        for feature_window in set(windows.values()) - {None}:
+            engine.window_starts(feature_window)
+
+        values = {}
+        pending = {feature.name: feature for feature in features}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            running = {}
+            while pending or running:
+                for name, feature in list(pending.items()):
+                    if all(dependency in values for dependency in feature.dependencies):
+                        dependencies = {dependency: values[dependency] for dependency in feature.dependencies}
+                        running[executor.submit(feature.compute, engine, windows[name], dependencies)] = name
+                        del pending[name]
+                done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    values[running.pop(future)] = future.result()
+        # the frame is built once from the arrays rather than by inserting columns one at a time
+        return pd.DataFrame({name: np.asarray(values[name], dtype=np.float64) for name in names}, index=dataframe.index)
@@ -0,0 +1,31 @@
+import os
+import sys
+import numpy as np
+import pytest
+# Add the web_api directory to sys.path
+web_api_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'web_api')
+sys.path.append(web_api_path)
+
+
+class SumModel:
+    """Predicts the sum of the features of every row."""
+
+    def predict(self, x_hat):
+        return np.asarray(x_hat).sum(axis=1)
+
+@pytest.fixture
+def api(monkeypatch):
+    """The Flask app of the web API, serving a SumModel and accepting batches of at most 4 rows."""
+    # the API resolves its model files relative to the web_api directory
+    monkeypatch.chdir(web_api_path)
+    import app
+    monkeypatch.setattr(app.model_store, 'model', SumModel())
+    monkeypatch.setitem(app.app.config, 'MAX_BATCH_SIZE', 4)
+    app.prediction_cache.clear()
+    return app
+
+@pytest.fixture
+def asgi(api):
+    """The ASGI application of the web API, serving the app of the api fixture."""
+    import asgi
+    return asgi
@@ -0,0 +1,136 @@
+import concurrent.futures
+import json
+import numpy as np
+import pyarrow as pa
+from tests.conftest import SumModel
+
+
+def test_batch_rows(api):
+    response = api.app.test_client().post('/predict/batch', json=[[1.0, 2.0], [3.0, 4.0]])
+    assert response.status_code == 200
+    assert response.get_json() == [[3.0], [7.0]]
+
+def test_batch_columnar(api):
+    response = api.app.test_client().post('/predict/batch', json={'vol_moving_avg': [1.0, 3.0],
+                                                                  'adj_close_rolling_med': [2.0, 4.0]})
+    assert response.status_code == 200
+    assert response.get_json() == {'Volume Prediction': [3.0, 7.0]}
+
+def test_batch_packed(api):
+    body = np.array([[1.0, 2.0], [3.0, 4.0]], dtype='<f8').tobytes()
+    response = api.app.test_client().post('/predict/batch', data=body, content_type='application/octet-stream')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/octet-stream'
+    assert np.frombuffer(response.data, dtype='<f8').tolist() == [3.0, 7.0]
+
+def arrow_body(table, file_format=False):
+    sink = pa.BufferOutputStream()
+    writer = pa.ipc.new_file(sink, table.schema) if file_format else pa.ipc.new_stream(sink, table.schema)
+    with writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+def test_batch_arrow(api):
+    client = api.app.test_client()
+    table = pa.table({'symbol': ['A', 'B'], 'vol_moving_avg': [1.0, 3.0], 'adj_close_rolling_med': pa.array([2, 4], pa.int32())})
+    for mimetype, file_format in [('application/vnd.apache.arrow.stream', False), ('application/vnd.apache.arrow.file', True)]:
+        response = client.post('/predict/batch', data=arrow_body(table, file_format), content_type=mimetype)
+        assert response.status_code == 200
+        assert response.mimetype == 'application/vnd.apache.arrow.stream'
+        assert pa.ipc.open_stream(response.data).read_all().column('Volume Prediction').to_pylist() == [3.0, 7.0]
+    invalid = [pa.table({'vol_moving_avg': [1.0]}), pa.table({'vol_moving_avg': ['x'], 'adj_close_rolling_med': [1.0]})]
+    for table in invalid:
+        response = client.post('/predict/batch', data=arrow_body(table), content_type='application/vnd.apache.arrow.stream')
+        assert response.status_code == 400
+    response = client.post('/predict/batch', data=b'not arrow', content_type='application/vnd.apache.arrow.stream')
+    assert response.status_code == 400
+    table = pa.table({'vol_moving_avg': [1.0] * 5, 'adj_close_rolling_med': [2.0] * 5})
+    response = client.post('/predict/batch', data=arrow_body(table), content_type='application/vnd.apache.arrow.stream')
+    assert response.status_code == 413
+
+def test_batch_indented_json(api):
+    # a full batch of indented JSON rows of full floats is not rejected from its length
+    body = json.dumps([[1.2345678901234567e+100, 2.2345678901234567e-100]] * 4, indent=8).encode()
+    response = api.app.test_client().post('/predict/batch', data=body, content_type='application/json')
+    assert response.status_code == 200
+
+def test_batch_invalid(api):
+    client = api.app.test_client()
+    assert client.post('/predict/batch', json=[]).status_code == 400
+    assert client.post('/predict/batch', json=[[1.0, 2.0, 3.0]]).status_code == 400
+    assert client.post('/predict/batch', json={'vol_moving_avg': [1.0]}).status_code == 400
+    assert client.post('/predict/batch', data=b'not json', content_type='application/json').status_code == 400
+    assert client.post('/predict/batch', data=b'\0' * 15, content_type='application/octet-stream').status_code == 400
+
+def test_batch_too_large(api):
+    client = api.app.test_client()
+    assert client.post('/predict/batch', json=[[1.0, 2.0]] * 5).status_code == 413
+    # bodies longer than the largest batch are rejected from their length, before being parsed
+    body = np.zeros((5, 2), dtype='<f8').tobytes()
+    assert client.post('/predict/batch', data=body, content_type='application/octet-stream').status_code == 413
+    assert client.post('/predict/batch', data=b' ' * 3000, content_type='application/json').status_code == 413
+
+class RewrittenRouter:
+    """Routes to a shard that the routing index no longer holds once its model is asked for."""
+
+    def __init__(self):
+        self.shards = iter(['old', 'new'])
+
+    def route(self, symbol, asset_class):
+        return next(self.shards)
+
+    def model(self, shard):
+        if shard == 'old':
+            raise KeyError(shard)
+        return SumModel()
+
+def test_requests_are_routed_again_after_an_index_rewrite(api, monkeypatch):
+    monkeypatch.setattr(api, 'shard_router', RewrittenRouter())
+    response = api.app.test_client().post('/predict/batch?symbol=SYM', json=[[1.0, 2.0]])
+    assert response.status_code == 200 and response.get_json() == [[3.0]]
+    monkeypatch.setattr(api, 'shard_router', RewrittenRouter())
+    response = api.app.test_client().get('/predict?symbol=SYM&vol_moving_avg=1&adj_close_rolling_med=3')
+    assert response.status_code == 200 and response.get_json() == {'Volume Prediction': 4.0}
+
+class RecordingFeatureStore:
+    """Records the bars it is updated with."""
+
+    def __init__(self):
+        self.bars = []
+
+    def update(self, bars):
+        self.bars.extend(bars)
+        return len(bars)
+
+def test_feature_updates_require_the_admin_token(api, monkeypatch):
+    monkeypatch.setattr(api, 'feature_store', RecordingFeatureStore())
+    client = api.app.test_client()
+    bars = [{'symbol': 'SYM', 'date': '2020-01-02', 'volume': 1.0, 'adj_close': 2.0}]
+    # refused while no token is configured
+    monkeypatch.setitem(api.app.config, 'ADMIN_TOKEN', None)
+    assert client.post('/features/bars', json=bars).status_code == 403
+    monkeypatch.setitem(api.app.config, 'ADMIN_TOKEN', 'secret')
+    assert client.post('/features/bars', json=bars).status_code == 403
+    assert client.post('/features/bars', json=bars, headers={'X-Admin-Token': 'wrong'}).status_code == 403
+    assert api.feature_store.bars == []
+    response = client.post('/features/bars', json=bars, headers={'X-Admin-Token': 'secret'})
+    assert response.status_code == 200 and response.get_json() == {'applied': 1, 'skipped': 0}
+
+def test_reload_requires_the_admin_token(api, monkeypatch):
+    client = api.app.test_client()
+    monkeypatch.setitem(api.app.config, 'ADMIN_TOKEN', None)
+    assert client.post('/admin/reload').status_code == 403
+    monkeypatch.setitem(api.app.config, 'ADMIN_TOKEN', 'secret')
+    assert client.post('/admin/reload', headers={'X-Admin-Token': 'wrong'}).status_code == 403
+
+class StalledBatcher:
+    """Queues rows that are never scored."""
+
+    def submit(self, row):
+        return concurrent.futures.Future()
+
+def test_predict_times_out(api, monkeypatch):
+    monkeypatch.setattr(api, 'batcher', StalledBatcher())
+    monkeypatch.setitem(api.app.config, 'MICRO_BATCH_TIMEOUT', 0.01)
+    response = api.app.test_client().get('/predict?vol_moving_avg=1&adj_close_rolling_med=5')
+    assert response.status_code == 503
@@ -0,0 +1,42 @@
+import asyncio
+import json
+
+
+def request(asgi, path, query=''):
+    """Sends a GET request to the ASGI application, returning the status, the headers and the JSON body."""
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {'type': 'http', 'method': 'GET', 'path': path, 'query_string': query.encode()}
+    asyncio.run(asgi.application(scope, receive, send))
+    start, body = messages
+    return start['status'], dict(start['headers']), json.loads(body['body'])
+
+def test_predict(asgi):
+    rows = asgi.flask_api.batcher.stats()['rows']
+    status, _, body = request(asgi, '/predict', 'vol_moving_avg=1&adj_close_rolling_med=2')
+    assert status == 200 and body == {'Volume Prediction': 3.0}
+    # the row was scored by the micro-batcher, the repeated request is answered from the cache
+    assert asgi.flask_api.batcher.stats()['rows'] == rows + 1
+    assert request(asgi, '/predict', 'vol_moving_avg=1&adj_close_rolling_med=2')[2] == body
+    assert asgi.flask_api.batcher.stats()['rows'] == rows + 1
+
+def test_invalid_parameters(asgi):
+    assert request(asgi, '/predict', 'vol_moving_avg=1')[0] == 400
+    assert request(asgi, '/predict', 'vol_moving_avg=1&adj_close_rolling_med=x')[0] == 400
+
+def test_not_found(asgi):
+    assert request(asgi, '/unknown')[0] == 404
+    assert request(asgi, '/predict', 'symbol=UNKNOWN')[0] == 404
+
+def test_sheds_load(asgi, monkeypatch):
+    monkeypatch.setattr(asgi, 'max_queue_depth', 0)
+    rejected = asgi.rejected
+    status, headers, _ = request(asgi, '/predict', 'vol_moving_avg=5&adj_close_rolling_med=6')
+    assert status == 503 and headers[b'retry-after'] == b'1'
+    assert asgi.rejected == rejected + 1
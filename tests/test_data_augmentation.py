@@ -1,20 +1,30 @@
 import os
+import shutil
 import pytest
 import pyarrow as pa
 from pyarrow import parquet
 import pandas as pd
 import numpy as np
 import sys
+import time
 # Add the root directory to sys.path
 root_path = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(root_path)
+from scripts.util.data_handling import CopyTracker, export_table_as_handoff, handoff_path, import_handoff_table
 from scripts.data_augmentation import (
     manipulate_data,
     calculate_volume_moving_average,
     calculate_adj_rolling_median,
+    calculate_rolling_features,
+    plan_symbol_shards,
+    transform_data_in_processes,
+    incremental_transform_data,
+    transform_data_in_arrow,
     read_data,
     save_data,
+    transform_data,
 )
+from scripts import data_augmentation as data_augmentation_module
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 data_directory = os.path.join(current_dir, '..', 'data')
@@ -127,4 +137,174 @@ def test_save_data():
     assert os.path.exists(saved_file_path)
 
     # Clean up - delete the saved file
-    os.remove(saved_file_path)
\ No newline at end of file
+    os.remove(saved_file_path)
+
+def test_plan_symbol_shards():
+    symbol_counts = [('A', 5), ('B', 1), ('C', 1), ('D', 3), ('E', 2)]
+    shards = plan_symbol_shards(symbol_counts, 3)
+    assert shards == [('A', 'A'), ('B', 'D'), ('E', 'E')]
+    assert plan_symbol_shards(symbol_counts, 1) == [('A', 'E')]
+    assert plan_symbol_shards([], 4) == []
+
+def test_transform_data_in_processes():
+    # Set up a processed parquet file holding several symbols
+    rng = np.random.default_rng(0)
+    dates = pd.date_range('2021-01-01', periods=40, freq='D')
+    df = pd.concat([
+        pd.DataFrame({
+            'Symbol': symbol,
+            'Date': dates,
+            'Volume': rng.integers(0, 1000, len(dates)).astype(float),
+            'Adj Close': rng.random(len(dates)),
+        })
+        for symbol in ['AAPL', 'IBM', 'MSFT', 'SPY', 'TSLA']
+    ], ignore_index=True)
+    parquet.write_table(pa.Table.from_pandas(df), os.path.join(data_directory, 'processed', 'test_shards.parquet'))
+    dataset_path = os.path.join(data_directory, 'training', 'test_shards')
+    try:
+        num_rows = transform_data_in_processes('test_shards', 'test_shards', num_workers=2, window='10D')
+        assert num_rows == len(df)
+        assert len(os.listdir(dataset_path)) > 1
+        result = parquet.read_table(dataset_path).to_pandas()
+        result = result.sort_values(['Symbol', 'Date'], ignore_index=True)
+        expected = df.sort_values(['Symbol', 'Date'], ignore_index=True)
+        for column_name, column_value in calculate_rolling_features(expected, window='10D'):
+            expected[column_name] = column_value
+        pd.testing.assert_frame_equal(result[expected.columns], expected, check_dtype=False)
+    finally:
+        os.remove(os.path.join(data_directory, 'processed', 'test_shards.parquet'))
+        shutil.rmtree(dataset_path, ignore_errors=True)
+
+def test_incremental_transform_data():
+    # Set up a processed dataset, augment it, then append new dates and a new symbol
+    rng = np.random.default_rng(1)
+    dates = pd.date_range('2021-01-01', periods=60, freq='D')
+    df = pd.concat([
+        pd.DataFrame({
+            'Symbol': symbol,
+            'Date': dates,
+            'Volume': rng.integers(0, 1000, len(dates)).astype(float),
+            'Adj Close': rng.random(len(dates)),
+        })
+        for symbol in ['AAPL', 'IBM', 'SPY']
+    ], ignore_index=True)
+    input_path = os.path.join(data_directory, 'processed', 'test_incremental.parquet')
+    dataset_path = os.path.join(data_directory, 'training', 'test_incremental')
+    state_path = os.path.join(data_directory, 'training', 'test_incremental_state.json')
+
+    def augment(data):
+        parquet.write_table(pa.Table.from_pandas(data), input_path)
+        return incremental_transform_data('test_incremental', 'test_incremental', window='10D')
+
+    def check(data):
+        result = parquet.read_table(dataset_path).to_pandas()
+        result = result.sort_values(['Symbol', 'Date'], ignore_index=True)
+        expected = data.sort_values(['Symbol', 'Date'], ignore_index=True)
+        for column_name, column_value in calculate_rolling_features(expected, window='10D'):
+            expected[column_name] = column_value
+        pd.testing.assert_frame_equal(result[expected.columns], expected, check_dtype=False)
+
+    try:
+        old = df[df['Date'] < '2021-02-20']
+        assert augment(old)['mode'] == 'full'
+        check(old)
+
+        new_symbol = pd.DataFrame({'Symbol': 'TSLA', 'Date': dates[:5], 'Volume': 1.0, 'Adj Close': 2.0})
+        appended = pd.concat([df, new_symbol], ignore_index=True)
+        result = augment(appended)
+        assert result == {'mode': 'incremental', 'rows': len(appended) - len(old), 'reason': None}
+        assert len(os.listdir(dataset_path)) == 2
+        check(appended)
+        assert augment(appended) == {'mode': 'incremental', 'rows': 0, 'reason': None}
+
+        # only the history of symbols with new rows is read, so the modified rows come with a new one
+        new_day = pd.DataFrame({'Symbol': 'AAPL', 'Date': [dates[-1] + pd.Timedelta(days=1)], 'Volume': 1.0, 'Adj Close': 2.0})
+        modified = pd.concat([appended, new_day], ignore_index=True)
+        modified.loc[modified['Date'] == dates[-3], 'Volume'] += 1
+        result = augment(modified)
+        assert result['mode'] == 'full' and result['reason'] == 'past rows were modified'
+        check(modified)
+
+        removed = modified[modified['Date'] != dates[1]]
+        assert augment(removed)['reason'] == 'past rows were inserted or removed'
+        check(removed)
+    finally:
+        os.remove(input_path)
+        shutil.rmtree(dataset_path, ignore_errors=True)
+        if os.path.exists(state_path):
+            os.remove(state_path)
+
+def test_transform_data_in_arrow():
+    # Set up an unsorted processed parquet file holding several symbols
+    rng = np.random.default_rng(2)
+    dates = pd.date_range('2021-01-01', periods=40, freq='D')
+    df = pd.concat([
+        pd.DataFrame({
+            'Symbol': symbol,
+            'Date': dates,
+            'Close': rng.random(len(dates)),
+            'Volume': rng.integers(0, 1000, len(dates)).astype(float),
+            'Adj Close': rng.random(len(dates)),
+        })
+        for symbol in ['AAPL', 'IBM', 'SPY']
+    ], ignore_index=True)
+    parquet.write_table(pa.Table.from_pandas(df), os.path.join(data_directory, 'processed', 'test_arrow.parquet'))
+    output_path = os.path.join(data_directory, 'training', 'test_arrow.parquet')
+    try:
+        arrow_tracker = CopyTracker()
+        assert transform_data_in_arrow('test_arrow', 'test_arrow', tracker=arrow_tracker) == len(df)
+        result = parquet.read_table(output_path).to_pandas()
+        assert result['Date'].is_monotonic_increasing
+        result = result.sort_values(['Symbol', 'Date'], ignore_index=True)
+        expected = df.sort_values(['Symbol', 'Date'], ignore_index=True)
+        for column_name, column_value in calculate_rolling_features(expected):
+            expected[column_name] = column_value
+        pd.testing.assert_frame_equal(result[expected.columns], expected, check_dtype=False, check_categorical=False)
+
+        # the pandas path copies the whole frame out of and back into Arrow
+        pandas_tracker = CopyTracker()
+        save_data(read_data('test_arrow', pandas_tracker), 'test_arrow', pandas_tracker)
+        assert arrow_tracker.total() < pandas_tracker.total()
+    finally:
+        os.remove(os.path.join(data_directory, 'processed', 'test_arrow.parquet'))
+        os.remove(output_path)
+
+def test_transform_data_in_arrow_with_handoff():
+    # the processed data is only handed off, as by ingest_data before its parquet file is written
+    dates = pd.date_range('2021-01-01', periods=40, freq='D')
+    df = pd.DataFrame({
+        'Symbol': np.repeat(['AAPL', 'SPY'], len(dates)),
+        'Date': np.tile(dates, 2),
+        'Volume': np.arange(2 * len(dates), dtype=float),
+        'Adj Close': np.linspace(1, 2, 2 * len(dates)),
+    }).sort_values('Date', kind='stable', ignore_index=True)
+    export_table_as_handoff(pa.Table.from_pandas(df, preserve_index=False), 'processed', 'test_handoff')
+    output_path = os.path.join(data_directory, 'training', 'test_handoff.parquet')
+    try:
+        assert transform_data_in_arrow('test_handoff', 'test_handoff', handoff=True) == len(df)
+        result = import_handoff_table('training', 'test_handoff').to_pandas()
+        for column_name, column_value in calculate_rolling_features(df.copy()):
+            np.testing.assert_allclose(result[column_name], column_value)
+        # the durable copy is written in the background
+        deadline = time.monotonic() + 60
+        while not os.path.exists(output_path) and time.monotonic() < deadline:
+            time.sleep(0.1)
+        pd.testing.assert_frame_equal(parquet.read_table(output_path).to_pandas(), result)
+    finally:
+        os.remove(handoff_path('processed', 'test_handoff'))
+        os.remove(handoff_path('training', 'test_handoff'))
+        if os.path.exists(output_path):
+            os.remove(output_path)
+
+def test_transform_data_raises_feature_failures(monkeypatch):
+    def failing_add_features(dataframe, engine, features=None):
+        raise ValueError('feature failure')
+
+    saved = []
+    monkeypatch.setattr(data_augmentation_module, 'read_data', lambda *args: pd.DataFrame({'Volume': [1.0]}))
+    monkeypatch.setattr(data_augmentation_module, 'add_features', failing_add_features)
+    monkeypatch.setattr(data_augmentation_module, 'save_data', lambda df, *args: saved.append(df))
+    with pytest.raises(ValueError, match='feature failure'):
+        transform_data(engine='numpy')
+    # the data without its features is not written for the training to find
+    assert saved == []
@@ -8,8 +8,28 @@ from scripts.util.data_handling import (
     import_parquet_as_df,
     path,
     export_df_as_parquet,
-    validate_data_types
+    validate_data_types,
+    row_filters,
+    sorted_by_key,
+    compact_market_data,
+    memory_report,
+    CopyTracker,
+    validate_table,
+    sort_table,
+    market_data_schema,
+    label_type,
+    write_parquet,
+    export_table_as_parquet,
+    import_parquet_table,
+    handoff_path,
+    import_handoff_table,
+    export_table_as_handoff,
+    persist_handoff,
+    discard_handoff,
+    wait_for_persisted,
+    check_persisted,
 )
+from scripts.util import data_handling
 
 # Assuming your test file is in the same directory as the utility functions
 
@@ -97,6 +117,9 @@ def test_import_csv_as_df(csv_fixture):
     assert 'Close' in df.columns
     assert 'Adj Close' in df.columns
     assert 'Volume' in df.columns
+    assert df['Date'].dtype == 'datetime64[ns]'
+    assert df['Open'].dtype == 'float32'
+    assert df['Volume'].dtype == 'float64'
 
 def test_validate_data_types():
     df = pd.DataFrame({'Date': ['2023-01-01'], 'Value': [10]})
@@ -121,4 +144,205 @@ def test_export_df_as_parquet():
     export_df_as_parquet(df, 'test_data', 'exported_data')
     exported_path = os.path.join(data_directory, 'test_data', 'exported_data.parquet')
     assert os.path.exists(exported_path)
-    os.remove(exported_path)
\ No newline at end of file
+    os.remove(exported_path)
+
+@pytest.fixture
+def market_parquet_fixture():
+    # Set up a Parquet file holding two symbols, not sorted by date
+    parquet_path = os.path.join(data_directory, 'test_data', 'market.parquet')
+    df = pd.DataFrame({
+        'Symbol': ['SPY', 'SPY', 'SPY', 'IBM', 'IBM', 'IBM'],
+        'Date': pd.to_datetime(['2021-01-01', '2021-01-02', '2021-01-03'] * 2),
+        'Open': [1.0, 2.0, 3.0, 4.0, 5.0, 6.0],
+        'Volume': [10, 20, 30, 40, 50, 60],
+    })
+    parquet.write_table(pa.Table.from_pandas(df, preserve_index=False), parquet_path)
+    yield parquet_path
+    os.remove(parquet_path)
+
+def test_import_parquet_as_df_columns(market_parquet_fixture):
+    df = import_parquet_as_df('test_data', 'market', columns=['Date', 'Volume'])
+    assert list(df.columns) == ['Date', 'Volume']
+    assert df['Date'].is_monotonic_increasing
+    df = import_parquet_as_df('test_data', 'market', columns=['Volume'])
+    assert df['Volume'].tolist() == [10, 20, 30, 40, 50, 60]
+
+def test_import_parquet_as_df_filters(market_parquet_fixture):
+    df = import_parquet_as_df('test_data', 'market', symbols=['IBM'], start_date='2021-01-02')
+    assert df['Volume'].tolist() == [50, 60]
+    df = import_parquet_as_df('test_data', 'market', filters=[('Volume', '>', 15)], end_date='2021-01-01')
+    assert df['Volume'].tolist() == [40]
+
+def test_row_filters():
+    assert row_filters() is None
+    assert row_filters(symbols=['SPY']) == [('Symbol', 'in', ['SPY'])]
+    assert row_filters([('Volume', '>', 0)], end_date='2021-01-01') == [
+        ('Volume', '>', 0), ('Date', '<=', pd.Timestamp('2021-01-01'))]
+    assert row_filters([[('Volume', '>', 0)], [('Open', '>', 0)]], symbols=['SPY']) == [
+        [('Volume', '>', 0), ('Symbol', 'in', ['SPY'])],
+        [('Open', '>', 0), ('Symbol', 'in', ['SPY'])],
+    ]
+
+def test_export_df_as_parquet_records_sort_order():
+    df = pd.DataFrame({'Date': pd.to_datetime(['2023-01-01', '2023-01-02']), 'Value': [10, 20]})
+    export_df_as_parquet(df, 'test_data', 'sorted_data')
+    export_df_as_parquet(df.iloc[::-1], 'test_data', 'unsorted_data')
+    sorted_path = os.path.join(data_directory, 'test_data', 'sorted_data.parquet')
+    unsorted_path = os.path.join(data_directory, 'test_data', 'unsorted_data.parquet')
+    try:
+        assert parquet.read_schema(sorted_path).metadata[sorted_by_key] == b'Date'
+        assert sorted_by_key not in parquet.read_schema(unsorted_path).metadata
+        assert import_parquet_as_df('test_data', 'unsorted_data')['Value'].tolist() == [10, 20]
+    finally:
+        os.remove(sorted_path)
+        os.remove(unsorted_path)
+
+def test_compact_market_data():
+    df = pd.DataFrame({
+        'Symbol': ['SPY', 'SPY', 'IBM'],
+        'Close': [40.29999923706055, 40.08000183105469, 1.5],
+        'Volume': [1200.0, 0.0, 400.0],
+        'Value': [1.0, 2.0, 3.0],
+    })
+    compact_market_data(df)
+    assert isinstance(df['Symbol'].dtype, pd.CategoricalDtype)
+    assert df['Close'].dtype == 'float32'
+    assert df['Close'].astype('float64').tolist() == [40.29999923706055, 40.08000183105469, 1.5]
+    assert df['Volume'].dtype == 'float64'
+    assert df['Value'].dtype == 'float64'
+
+def test_memory_report():
+    df = compact_market_data(pd.DataFrame({'Symbol': ['SPY'] * 1000, 'Close': [1.0] * 1000}))
+    report = memory_report(df)
+    assert report['bytes'] == df.memory_usage(deep=True).sum()
+    assert report['saved_bytes'] == report['uncompacted_bytes'] - report['bytes']
+    # 4 bytes saved on every price and 7 on every symbol, whose codes take a single byte
+    assert report['saved_bytes'] > 1000 * 10
+
+def test_validate_table():
+    table = pa.table({
+        'Date': pa.array(pd.to_datetime(['2021-01-02', '2021-01-01'])),
+        'Close': pa.array([1.5, 2.5], pa.float64()),
+        'Symbol': pa.array(['SPY', 'SPY']),
+        'Value': pa.array([1.0, 2.0]),
+    })
+    tracker = CopyTracker()
+    result = validate_table(table, tracker=tracker)
+    assert result.schema.field('Close').type == market_data_schema.field('Close').type
+    assert result.schema.field('Symbol').type == market_data_schema.field('Symbol').type
+    assert result.schema.field('Value').type == pa.float64()
+    assert set(tracker.steps) == {'cast'}
+    # columns already of the right type are not copied
+    assert result.column('Date').chunk(0).buffers()[1].address == table.column('Date').chunk(0).buffers()[1].address
+    tracker = CopyTracker()
+    validate_table(result, tracker=tracker)
+    assert tracker.report() == {'total': 0}
+
+def test_sort_table():
+    table = pa.table({'Date': pa.array(pd.to_datetime(['2021-01-02', '2021-01-01', '2021-01-02'])), 'Value': [1, 2, 3]})
+    tracker = CopyTracker()
+    result = sort_table(table, tracker=tracker)
+    assert result.column('Value').to_pylist() == [2, 1, 3]
+    assert tracker.steps == {'sort': result.nbytes}
+    assert sort_table(result, tracker=tracker) is result
+    assert tracker.total() == result.nbytes
+
+def test_sort_table_by_several_columns():
+    table = pa.table({
+        'Symbol': pa.array(['SPY', 'AAPL', 'SPY', 'AAPL']).cast(label_type),
+        'Date': pa.array(pd.to_datetime(['2021-01-01', '2021-01-02', '2021-01-02', '2021-01-01'])),
+        'Value': [1, 2, 3, 4],
+    })
+    result = sort_table(table, ['Symbol', 'Date'])
+    assert result.column('Value').to_pylist() == [4, 2, 1, 3]
+    assert result.schema == table.schema
+    assert sort_table(result, ['Symbol', 'Date']) is result
+
+def test_write_parquet(tmp_path):
+    table = pa.table({
+        'Symbol': pa.array(['SPY', 'AAPL', 'SPY', 'AAPL']).cast(label_type),
+        'Date': pa.array(pd.to_datetime(['2021-01-01', '2021-01-02', '2021-01-02', '2021-01-01'])),
+        'Value': [1.0, 2.0, 3.0, 4.0],
+    })
+    file_path = str(tmp_path / 'data.parquet')
+    assert write_parquet(table, file_path, sort_by=['Symbol', 'Date'], row_group_size=2, compression='zstd') == file_path
+    assert os.listdir(tmp_path) == ['data.parquet']
+    metadata = parquet.ParquetFile(file_path).metadata
+    assert metadata.num_row_groups == 2
+    assert metadata.row_group(0).column(0).compression == 'ZSTD'
+    assert [column.column_index for column in metadata.row_group(0).sorting_columns] == [0, 1]
+    assert metadata.row_group(0).column(1).statistics.has_min_max
+    assert parquet.read_schema(file_path).metadata[sorted_by_key] == b'Symbol,Date'
+    assert parquet.read_table(file_path).column('Value').to_pylist() == [4.0, 2.0, 1.0, 3.0]
+
+def test_write_parquet_is_atomic(tmp_path):
+    file_path = str(tmp_path / 'data.parquet')
+    write_parquet(pa.table({'Value': [1, 2]}), file_path)
+    with pytest.raises(Exception):
+        write_parquet(pa.table({'Value': [3, 4]}), file_path, compression='not-a-codec')
+    assert os.listdir(tmp_path) == ['data.parquet']
+    assert parquet.read_table(file_path).column('Value').to_pylist() == [1, 2]
+
+def test_export_table_as_parquet_with_handoff(tmp_path, monkeypatch):
+    monkeypatch.setattr(data_handling, 'handoff_directory', str(tmp_path / 'handoff'))
+    table = pa.table({'Date': pa.array(pd.to_datetime(['2021-01-01', '2021-01-02'])), 'Value': [1.0, 2.0]})
+    process = export_table_as_parquet(table, str(tmp_path), 'data', sorted_by='Date', handoff=True)
+    assert process is not None
+    # the next stage reads the handoff while the Parquet file is being written
+    handed_off = import_handoff_table(str(tmp_path), 'data')
+    assert handed_off.equals(table)
+    assert handed_off.schema.metadata[sorted_by_key] == b'Date'
+    assert import_parquet_table(str(tmp_path), 'data', columns=['Value'], filters=[('Value', '>', 1.0)],
+                                handoff=True).to_pydict() == {'Value': [2.0]}
+    assert wait_for_persisted(timeout=60) == 1
+    file_path = os.path.join(str(tmp_path), 'data.parquet')
+    assert parquet.read_table(file_path).equals(table)
+    assert parquet.read_schema(file_path).metadata[sorted_by_key] == b'Date'
+
+    # writing the data without handoff supersedes the previous handoff
+    export_table_as_parquet(table.slice(0, 1), str(tmp_path), 'data')
+    assert not os.path.exists(handoff_path(str(tmp_path), 'data'))
+    assert import_parquet_table(str(tmp_path), 'data', handoff=True).num_rows == 1
+def test_check_persisted(tmp_path, monkeypatch):
+    monkeypatch.setattr(data_handling, 'handoff_directory', str(tmp_path / 'handoff'))
+    # the writers are processes of their own, reading the path of their log from the environment
+    monkeypatch.setenv('PIPELINE_PERSIST_LOG', str(tmp_path / 'persist_handoff.log'))
+    assert check_persisted() == 0
+    table = pa.table({'Value': [1.0, 2.0]})
+    export_table_as_parquet(table, str(tmp_path), 'data', handoff=True)
+    # a later stage, in another process, only sees the status files of the writers
+    monkeypatch.setattr(data_handling, 'persist_processes', [])
+    assert check_persisted(timeout=60) == 1
+
+    # the Parquet file of a missing directory cannot be written, the failure is logged and reported
+    monkeypatch.setattr(data_handling, 'persist_processes', [])
+    export_table_as_parquet(table, str(tmp_path / 'missing'), 'data', handoff=True)
+    with pytest.raises(RuntimeError, match='missing'):
+        wait_for_persisted(timeout=60)
+    with pytest.raises(RuntimeError, match='missing'):
+        check_persisted(timeout=60)
+    assert 'Failed to write' in (tmp_path / 'persist_handoff.log').read_text()
+
+
+def test_discard_handoff_before_it_is_persisted(tmp_path, monkeypatch):
+    monkeypatch.setattr(data_handling, 'handoff_directory', str(tmp_path / 'handoff'))
+    monkeypatch.setenv('PIPELINE_PERSIST_LOG', str(tmp_path / 'persist_handoff.log'))
+    monkeypatch.setattr(data_handling, 'persist_processes', [])
+    table = pa.table({'Value': [1.0, 2.0]})
+    export_table_as_handoff(table, str(tmp_path), 'data')
+    # the handoff is discarded while its writer is still starting, which then exits without a trace
+    with monkeypatch.context() as m:
+        m.setattr(data_handling, 'write_persist_status', lambda status_path, **status: None)
+        process = persist_handoff(str(tmp_path), 'data')
+    discard_handoff(str(tmp_path), 'data')
+    assert process.wait(60) == 0
+    assert check_persisted(timeout=60) == 0
+    assert not (tmp_path / 'data.parquet').exists()
+    assert not (tmp_path / 'persist_handoff.log').exists()
+
+    # a writer already started is waited for before its handoff is removed
+    export_table_as_parquet(table, str(tmp_path), 'data', handoff=True)
+    discard_handoff(str(tmp_path), 'data')
+    assert not os.path.exists(handoff_path(str(tmp_path), 'data'))
+    assert parquet.read_table(tmp_path / 'data.parquet').column('Value').to_pylist() == [1.0, 2.0]
+    assert check_persisted(timeout=60) == 0
@@ -1,7 +1,19 @@
 import os
+import shutil
 import pytest
 import pandas as pd
-from scripts.data_ingestion import import_data, combine_dir_data, save_data
+from pyarrow import parquet
+from scripts.data_ingestion import (
+    import_data,
+    combine_dir_data,
+    save_data,
+    import_table,
+    stream_data,
+    partition_data,
+    incremental_partition_data,
+    arrow_data,
+)
+from scripts.util.data_handling import import_parquet_as_df, market_data_schema, sorted_by_key, CopyTracker
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 data_directory = os.path.join(current_dir, '..', 'data')
@@ -89,6 +101,17 @@ def test_combine_dir_data(csv_fixture):
     assert 'Volume' in df.columns
 
 
+@pytest.mark.parametrize('executor', ['serial', 'process'])
+def test_combine_dir_data_executors(csv_fixture, executor):
+    path = os.path.join(data_directory, 'test_data')
+    df = combine_dir_data(path, executor=executor, num_workers=2)
+    pd.testing.assert_frame_equal(df, combine_dir_data(path))
+
+def test_combine_dir_data_unknown_executor(csv_fixture):
+    path = os.path.join(data_directory, 'test_data')
+    with pytest.raises(ValueError):
+        combine_dir_data(path, executor='gpu')
+
 def test_save_data(csv_fixture):
     df = pd.DataFrame({'Symbol': ['ABC', 'DEF'], 'Value': [10, 20]})
     file_name = 'test_output'
@@ -96,3 +119,94 @@ def test_save_data(csv_fixture):
     assert os.path.exists(os.path.join(data_ingestion_output_path, 'test_output.parquet'))
     os.remove(os.path.join(data_ingestion_output_path, 'test_output.parquet'))
 
+def test_import_table(csv_fixture):
+    directory, file_name = os.path.split(csv_fixture)
+    table = import_table(directory, file_name, 'etfs')
+    assert table.schema.equals(market_data_schema)
+    assert len(table) == 5
+    assert table.column('Symbol').to_pylist() == ['test'] * 5
+    assert table.column('asset_class').to_pylist() == ['etfs'] * 5
+
+def test_stream_data(csv_fixture):
+    path = os.path.join(data_directory, 'test_data')
+    # a tiny buffer writes every file as its own row group
+    num_rows = stream_data([(path, 'etfs'), (path, 'stocks')], 'test_stream', buffer_bytes=1)
+    file_path = os.path.join(data_ingestion_output_path, 'test_stream.parquet')
+    try:
+        assert num_rows == 10
+        assert parquet.ParquetFile(file_path).metadata.num_row_groups == 2
+        df = import_parquet_as_df('processed', 'test_stream')
+        assert len(df) == 10
+        assert sorted(df['asset_class'].unique()) == ['etfs', 'stocks']
+        assert isinstance(df['Symbol'].dtype, pd.CategoricalDtype)
+        assert df['Adj Close'].dtype == 'float32'
+    finally:
+        os.remove(file_path)
+
+def test_arrow_data(csv_fixture):
+    path = os.path.join(data_directory, 'test_data')
+    tracker = CopyTracker()
+    num_rows = arrow_data([(path, 'etfs'), (path, 'stocks')], 'test_arrow', tracker=tracker)
+    file_path = os.path.join(data_ingestion_output_path, 'test_arrow.parquet')
+    try:
+        assert num_rows == 10
+        schema = parquet.read_schema(file_path)
+        assert schema.metadata[sorted_by_key] == b'Date'
+        df = import_parquet_as_df('processed', 'test_arrow')
+        assert df['Date'].is_monotonic_increasing
+        assert sorted(df['asset_class'].unique()) == ['etfs', 'stocks']
+        # the parsed tables already match the schema, only sorting copies them
+        assert set(tracker.steps) <= {'sort'}
+    finally:
+        os.remove(file_path)
+
+def test_partition_data(csv_fixture):
+    path = os.path.join(data_directory, 'test_data')
+    num_rows = partition_data([(path, 'etfs')], 'test_partitioned')
+    dataset_path = os.path.join(data_ingestion_output_path, 'test_partitioned')
+    try:
+        assert num_rows == 5
+        assert os.path.exists(os.path.join(dataset_path, 'asset_class=etfs', 'Symbol=test', 'part-0.parquet'))
+        df = import_parquet_as_df('processed', 'test_partitioned')
+        assert len(df) == 5
+        assert df['Symbol'].tolist() == ['test'] * 5
+        assert isinstance(df['Symbol'].dtype, pd.CategoricalDtype)
+        assert df['Date'].is_monotonic_increasing
+    finally:
+        shutil.rmtree(dataset_path)
+
+def test_incremental_partition_data(tmp_path):
+    raw_path = os.path.join(tmp_path, 'raw')
+    os.makedirs(raw_path)
+    dataset_path = os.path.join(data_ingestion_output_path, 'test_incremental')
+    manifest_path = os.path.join(data_ingestion_output_path, 'test_incremental_manifest.json')
+    df = pd.DataFrame({'Date': ['2015-07-13', '2015-07-14'], 'Open': [1.0, 2.0], 'Volume': [10, 20]})
+    df.to_csv(os.path.join(raw_path, 'AAA.csv'), index=False)
+    df.to_csv(os.path.join(raw_path, 'BBB.csv'), index=False)
+    try:
+        counts = incremental_partition_data([(raw_path, 'etfs')], 'test_incremental')
+        assert counts == {'added': 2, 'modified': 0, 'deleted': 0, 'unchanged': 0}
+        assert len(import_parquet_as_df('processed', 'test_incremental')) == 4
+
+        # nothing changed, nothing is read
+        counts = incremental_partition_data([(raw_path, 'etfs')], 'test_incremental')
+        assert counts == {'added': 0, 'modified': 0, 'deleted': 0, 'unchanged': 2}
+
+        # touching a file without changing its content only rehashes it
+        os.utime(os.path.join(raw_path, 'AAA.csv'), ns=(0, 0))
+        counts = incremental_partition_data([(raw_path, 'etfs')], 'test_incremental')
+        assert counts == {'added': 0, 'modified': 0, 'deleted': 0, 'unchanged': 2}
+
+        # append a day to one file and delete the other
+        pd.concat([df, pd.DataFrame({'Date': ['2015-07-15'], 'Open': [3.0], 'Volume': [30]})]).to_csv(
+            os.path.join(raw_path, 'AAA.csv'), index=False)
+        os.remove(os.path.join(raw_path, 'BBB.csv'))
+        counts = incremental_partition_data([(raw_path, 'etfs')], 'test_incremental')
+        assert counts == {'added': 0, 'modified': 1, 'deleted': 1, 'unchanged': 0}
+        result = import_parquet_as_df('processed', 'test_incremental')
+        assert result['Symbol'].tolist() == ['AAA'] * 3
+        assert result['Volume'].tolist() == [10, 20, 30]
+    finally:
+        shutil.rmtree(dataset_path, ignore_errors=True)
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scripts.util.feature_engine import RollingFeatureEngine
+from scripts.data_augmentation import (
+    calculate_volume_moving_average,
+    calculate_adj_rolling_median,
+    calculate_rolling_features,
+)
+
+
+@pytest.fixture
+def market_df():
+    rng = np.random.default_rng(0)
+    frames = []
+    for i in range(20):
+        num_rows = int(rng.integers(1, 120))
+        days = np.sort(rng.choice(400, num_rows, replace=False))
+        frames.append(pd.DataFrame({
+            'Symbol': f'S{i}',
+            'Date': pd.Timestamp('2020-01-01') + pd.to_timedelta(days, 'D'),
+            'Volume': rng.integers(0, 10 ** 7, num_rows).astype(float),
+            'Adj Close': rng.lognormal(2, 1, num_rows),
+        }))
+    df = pd.concat(frames, ignore_index=True)
+    df.loc[rng.random(len(df)) < 0.1, 'Volume'] = np.nan
+    df.loc[rng.random(len(df)) < 0.1, 'Adj Close'] = np.nan
+    # symbols interleaved in date order, as read from the processed data
+    return df.sort_values('Date', kind='stable')
+
+@pytest.mark.parametrize('window', ['30D', '7D', 3])
+def test_mean_matches_pandas(market_df, window):
+    _, expected = calculate_volume_moving_average(market_df, window=window)
+    result = RollingFeatureEngine(market_df).mean('Volume', window)
+    pd.testing.assert_series_equal(result, expected.reindex(market_df.index), check_names=False)
+
+@pytest.mark.parametrize('window', ['30D', '7D', 3])
+def test_median_matches_pandas(market_df, window):
+    _, expected = calculate_adj_rolling_median(market_df, window=window)
+    result = RollingFeatureEngine(market_df).median('Adj Close', window)
+    pd.testing.assert_series_equal(result, expected.reindex(market_df.index), check_names=False)
+
+def test_median_in_small_chunks(market_df):
+    _, expected = calculate_adj_rolling_median(market_df)
+    result = RollingFeatureEngine(market_df, max_chunk_cells=7).median('Adj Close', '30D')
+    pd.testing.assert_series_equal(result, expected.reindex(market_df.index), check_names=False)
+
+def test_calculate_rolling_features():
+    data = {
+        'Symbol': ['AAPL', 'AAPL', 'AAPL', 'AAPL'],
+        'Date': pd.to_datetime(['2021-01-01', '2021-01-02', '2021-01-03', '2021-01-04']),
+        'Volume': [100, 200, 300, 400],
+        'Adj Close': [50.0, 51.0, 52.0, 53.0]
+    }
+    df = pd.DataFrame(data)
+    (mean_name, mean_column), (median_name, median_column) = calculate_rolling_features(df, window=2)
+    assert mean_name == 'vol_moving_avg'
+    assert median_name == 'adj_close_rolling_med'
+    assert mean_column.equals(pd.Series([np.nan, 150.0, 250.0, 350.0], name='Volume'))
+    assert median_column.equals(pd.Series([np.nan, 50.5, 51.5, 52.5], name='Adj Close'))
+
+@pytest.mark.parametrize('window', ['30D', 3])
+def test_sum_matches_pandas(market_df, window):
+    expected = (
+        market_df[['Symbol', 'Date', 'Volume']]
+        .groupby('Symbol', as_index=False)
+        .rolling(window, on='Date')
+        .sum()['Volume']
+    )
+    result = RollingFeatureEngine(market_df).sum('Volume', window)
+    pd.testing.assert_series_equal(result, expected.reindex(market_df.index), check_names=False, rtol=1e-12)
+
+@pytest.mark.parametrize('window', ['30D', 3])
+def test_std_matches_pandas(market_df, window):
+    expected = (
+        market_df[['Symbol', 'Date', 'Adj Close']]
+        .groupby('Symbol', as_index=False)
+        .rolling(window, on='Date')
+        .std()['Adj Close']
+    )
+    result = RollingFeatureEngine(market_df).std('Adj Close', window)
+    pd.testing.assert_series_equal(result, expected.reindex(market_df.index), check_names=False, rtol=1e-8)
+
+def test_shift_matches_pandas(market_df):
+    expected = market_df.sort_values(['Symbol', 'Date']).groupby('Symbol')['Adj Close'].shift(2)
+    result = RollingFeatureEngine(market_df).shift('Adj Close', 2)
+    pd.testing.assert_series_equal(result, expected.reindex(market_df.index), check_names=False)
+
+def test_values_instead_of_column(market_df):
+    engine = RollingFeatureEngine(market_df)
+    result = engine.mean(market_df['Volume'] * 2, '30D')
+    pd.testing.assert_series_equal(result, engine.mean('Volume', '30D') * 2, check_names=False)
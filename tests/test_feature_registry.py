@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pytest
+from scripts.util.feature_engine import RollingFeatureEngine
+from scripts.util.feature_registry import FeatureRegistry
+from scripts.data_augmentation import registry, augment_table, add_features
+
+
+@pytest.fixture
+def market_df():
+    rng = np.random.default_rng(0)
+    frames = []
+    for i in range(5):
+        num_rows = int(rng.integers(20, 80))
+        days = np.sort(rng.choice(200, num_rows, replace=False))
+        frames.append(pd.DataFrame({
+            'Symbol': f'S{i}',
+            'Date': pd.Timestamp('2020-01-01') + pd.to_timedelta(days, 'D'),
+            'Open': rng.lognormal(2, 1, num_rows),
+            'Close': rng.lognormal(2, 1, num_rows),
+            'Adj Close': rng.lognormal(2, 1, num_rows),
+            'Volume': rng.integers(0, 10 ** 7, num_rows).astype(float),
+        }))
+    return pd.concat(frames, ignore_index=True).sort_values('Date', kind='stable')
+
+def test_resolve_orders_dependencies():
+    features = FeatureRegistry()
+    for name, dependencies in [('c', ['a', 'b']), ('b', ['a']), ('a', [])]:
+        features.register(name, dependencies=dependencies)(lambda engine, window, dependencies: 0)
+    assert [feature.name for feature in features.resolve(['c'])] == ['a', 'b', 'c']
+    assert [feature.name for feature in features.resolve(['b', 'a'])] == ['a', 'b']
+    with pytest.raises(ValueError):
+        features.resolve(['d'])
+
+def test_resolve_rejects_cycles():
+    features = FeatureRegistry()
+    features.register('a', dependencies=['b'])(lambda engine, window, dependencies: 0)
+    features.register('b', dependencies=['a'])(lambda engine, window, dependencies: 0)
+    with pytest.raises(ValueError):
+        features.resolve(['a'])
+
+def test_register_rejects_duplicates():
+    features = FeatureRegistry()
+    features.register('a')(lambda engine, window, dependencies: 0)
+    with pytest.raises(ValueError):
+        features.register('a')(lambda engine, window, dependencies: 0)
+
+def test_input_columns():
+    assert registry.input_columns(['vwap_30d', 'volatility_30d']) == ['Symbol', 'Date', 'Close', 'Volume', 'Adj Close']
+
+def test_compute_matches_engine(market_df):
+    result = registry.compute(market_df, ['vol_moving_avg', 'vwap_30d', 'volatility_30d'])
+    engine = RollingFeatureEngine(market_df)
+    assert list(result.columns) == ['vol_moving_avg', 'vwap_30d', 'volatility_30d']
+    assert result.index.equals(market_df.index)
+    np.testing.assert_array_equal(result['vol_moving_avg'], engine.mean('Volume', '30D'))
+    dollar_volume = market_df['Close'] * market_df['Volume']
+    np.testing.assert_allclose(result['vwap_30d'], engine.sum(dollar_volume, '30D') / engine.sum('Volume', '30D'))
+    returns = market_df['Adj Close'] / engine.shift('Adj Close') - 1
+    np.testing.assert_allclose(result['volatility_30d'], engine.std(returns, '30D'))
+
+def test_compute_window_override(market_df):
+    result = registry.compute(market_df, ['vol_moving_avg_7d', 'daily_return'], window='3D')
+    engine = RollingFeatureEngine(market_df)
+    np.testing.assert_array_equal(result['vol_moving_avg_7d'], engine.mean('Volume', '3D'))
+
+def test_augment_table_keeps_row_order(market_df):
+    table = pa.Table.from_pandas(market_df, preserve_index=False)
+    result = augment_table(table, features=['vol_moving_avg', 'volatility_30d'])
+    assert result.column_names == table.column_names + ['vol_moving_avg', 'volatility_30d']
+    expected = market_df.copy()
+    add_features(expected, features=['vol_moving_avg', 'volatility_30d'])
+    np.testing.assert_array_equal(result.column('vol_moving_avg').to_numpy(), expected['vol_moving_avg'])
+
+@pytest.mark.parametrize('engine', ['numpy', 'pandas'])
+def test_augment_table_engines_agree(market_df, engine):
+    table = pa.Table.from_pandas(market_df, preserve_index=False)
+    result = augment_table(table, engine=engine)
+    expected = market_df.copy()
+    add_features(expected, engine='numpy')
+    np.testing.assert_allclose(result.column('adj_close_rolling_med').to_numpy(), expected['adj_close_rolling_med'])
+    with pytest.raises(ValueError):
+        augment_table(table, engine='pandas', features=['vwap_30d'])
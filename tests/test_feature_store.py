@@ -0,0 +1,138 @@
+import json
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+# Add the web_api directory to sys.path
+web_api_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'web_api')
+sys.path.append(web_api_path)
+from feature_store import FeatureStore
+import scripts.train_model as train_model_module
+from scripts.data_augmentation import add_features
+
+
+def market_data(num_days=60):
+    rng = np.random.default_rng(0)
+    frames = []
+    for symbol in ('AAA', 'BBB'):
+        # trading days with gaps, so the 30 day window holds a varying number of rows
+        dates = pd.to_datetime('2021-01-01') + pd.to_timedelta(np.sort(rng.choice(90, num_days, replace=False)), 'D')
+        frames.append(pd.DataFrame({
+            'Symbol': symbol,
+            'Date': dates,
+            'Volume': rng.integers(1000, 100000, num_days).astype(np.float64),
+            'Adj Close': rng.uniform(10, 20, num_days),
+        }))
+    data = pd.concat(frames, ignore_index=True)
+    data.loc[5, 'Volume'] = np.nan
+    return data
+
+def augmented(data):
+    data = data.sort_values(['Symbol', 'Date'], ignore_index=True)
+    add_features(data, 'numpy')
+    return data
+
+@pytest.fixture
+def store_paths(tmp_path, monkeypatch):
+    monkeypatch.setattr(train_model_module, 'feature_store_path', str(tmp_path / 'feature_store.arrow'))
+    monkeypatch.setattr(train_model_module, 'feature_store_journal_path', str(tmp_path / 'feature_store.journal'))
+    monkeypatch.setattr(train_model_module, 'data_augmentation_output_path', str(tmp_path))
+    return str(tmp_path / 'feature_store.arrow'), str(tmp_path / 'feature_store.journal'), str(tmp_path / 'augmented_data.parquet')
+
+def export(data, file_path):
+    augmented(data).sample(frac=1, random_state=0).to_parquet(file_path)
+    train_model_module.export_feature_store()
+
+def test_looks_up_the_latest_features(store_paths):
+    store_path, journal_path, file_path = store_paths
+    data = market_data()
+    export(data, file_path)
+    store = FeatureStore(store_path, journal_path)
+    expected = augmented(data).groupby('Symbol').last()
+    for symbol in ('AAA', 'BBB'):
+        features = store.features(symbol)
+        assert features['Date'] == expected.loc[symbol, 'Date'].isoformat()
+        assert features['vol_moving_avg'] == pytest.approx(expected.loc[symbol, 'vol_moving_avg'])
+        assert features['adj_close_rolling_med'] == pytest.approx(expected.loc[symbol, 'adj_close_rolling_med'])
+    assert store.features('CCC') is None
+    # only the rows within the window of the last date of every symbol are exported
+    assert store.stats()['symbols'] == 2
+    assert len(store._dates) < len(data)
+
+def test_columns_are_read_from_the_map(store_paths):
+    store_path, journal_path, file_path = store_paths
+    data = market_data()
+    # a NaN volume within the window is written as NaN, a null would force a copy
+    data.loc[len(data) - 1, 'Volume'] = np.nan
+    export(data, file_path)
+    store = FeatureStore(store_path, journal_path)
+    assert np.isnan(store._volume).any()
+    start, end = store._buffer.address, store._buffer.address + store._buffer.size
+    for values in (store._dates, store._volume, store._adj_close, store._vol_moving_avg, store._adj_close_rolling_med):
+        address = values.__array_interface__['data'][0]
+        assert start <= address and address + values.nbytes <= end
+
+def test_stale_symbols_only_add_their_window(store_paths):
+    store_path, journal_path, file_path = store_paths
+    data = market_data()
+    # a symbol last traded long before the others
+    stale = market_data(10).query("Symbol == 'AAA'").assign(Symbol='OLD', Date=lambda df: df['Date'] - pd.Timedelta(days=3650))
+    data = pd.concat([data, stale], ignore_index=True)
+    augmented(data).sample(frac=1, random_state=0).to_parquet(file_path)
+    last_dates = data.groupby('Symbol')['Date'].max()
+    offset = pd.Timedelta('30D')
+    tails = train_model_module.read_window_tails(last_dates, offset, batch_rows=7).to_pandas()
+    expected = data[data['Date'] > data['Symbol'].map(last_dates) - offset]
+    assert len(tails) == len(expected)
+    assert (tails.groupby('Symbol')['Date'].min() > last_dates - offset).all()
+
+def test_updates_match_the_augmentation(store_paths):
+    store_path, journal_path, file_path = store_paths
+    data = market_data()
+    export(data, file_path)
+    store = FeatureStore(store_path, journal_path)
+    last_date = data.loc[data['Symbol'] == 'AAA', 'Date'].max()
+    bars = [
+        {'symbol': 'AAA', 'date': (last_date + pd.Timedelta(days=1)).strftime('%Y-%m-%d'), 'volume': 5000.0, 'adj_close': 15.0},
+        {'symbol': 'AAA', 'date': (last_date + pd.Timedelta(days=9)).strftime('%Y-%m-%d'), 'volume': np.nan, 'adj_close': 11.0},
+        # bars already known are skipped
+        {'symbol': 'AAA', 'date': last_date.strftime('%Y-%m-%d'), 'volume': 1.0, 'adj_close': 1.0},
+        {'symbol': 'NEW', 'date': '2021-05-01', 'volume': 300.0, 'adj_close': 2.0},
+    ]
+    assert store.update(bars) == 3
+    new_rows = pd.DataFrame({
+        'Symbol': [bar['symbol'] for bar in bars[:2] + bars[3:]],
+        'Date': pd.to_datetime([bar['date'] for bar in bars[:2] + bars[3:]]),
+        'Volume': [bar['volume'] for bar in bars[:2] + bars[3:]],
+        'Adj Close': [bar['adj_close'] for bar in bars[:2] + bars[3:]],
+    })
+    expected = augmented(pd.concat([data, new_rows], ignore_index=True)).groupby('Symbol').last()
+    for symbol in ('AAA', 'NEW'):
+        features = store.features(symbol)
+        assert features['Date'] == expected.loc[symbol, 'Date'].isoformat()
+        assert features['vol_moving_avg'] == pytest.approx(expected.loc[symbol, 'vol_moving_avg'])
+        assert features['adj_close_rolling_med'] == pytest.approx(expected.loc[symbol, 'adj_close_rolling_med'])
+    with pytest.raises(ValueError):
+        store.update([{'symbol': 'AAA', 'date': 'not a date', 'volume': 1.0, 'adj_close': 1.0}])
+
+def test_other_processes_replay_the_journal(store_paths):
+    store_path, journal_path, file_path = store_paths
+    export(market_data(), file_path)
+    store = FeatureStore(store_path, journal_path, check_interval=0)
+    other = FeatureStore(store_path, journal_path, check_interval=0)
+    store.update([{'symbol': 'NEW', 'date': '2021-05-01', 'volume': 300.0, 'adj_close': 2.0}])
+    assert other.features('NEW') == store.features('NEW')
+    with open(journal_path) as f:
+        assert [json.loads(line)['symbol'] for line in f] == ['NEW']
+
+    # a new export supersedes the journal and every update
+    export(market_data(), file_path)
+    assert not os.path.exists(journal_path)
+    assert other.features('NEW') is None
+
+def test_missing_store(tmp_path):
+    store = FeatureStore(str(tmp_path / 'feature_store.arrow'))
+    assert store.features('AAA') is None
+    assert store.update([{'symbol': 'AAA', 'date': '2021-01-01', 'volume': 1.0, 'adj_close': 2.0}]) == 1
+    assert store.features('AAA') == {'Date': '2021-01-01T00:00:00', 'vol_moving_avg': 1.0, 'adj_close_rolling_med': 2.0}
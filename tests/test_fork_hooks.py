@@ -0,0 +1,25 @@
+import gc
+import os
+import sys
+import threading
+import weakref
+# Add the web_api directory to sys.path
+web_api_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'web_api')
+sys.path.append(web_api_path)
+import fork_hooks
+from prediction_cache import PredictionCache
+
+
+def test_registered_objects_are_not_kept_alive():
+    cache = PredictionCache(max_size=10)
+    assert cache in fork_hooks._instances
+    reference = weakref.ref(cache)
+    del cache
+    gc.collect()
+    assert reference() is None
+
+def test_fork_resets_locks():
+    cache = PredictionCache(max_size=11)
+    lock = cache._lock
+    fork_hooks._after_fork()
+    assert cache._lock is not lock and isinstance(cache._lock, type(threading.Lock()))
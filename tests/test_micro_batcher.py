@@ -0,0 +1,75 @@
+import os
+import sys
+import concurrent.futures
+import threading
+import numpy as np
+import pytest
+# Add the web_api directory to sys.path
+web_api_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'web_api')
+sys.path.append(web_api_path)
+from micro_batcher import MicroBatcher
+
+
+def sum_features(input_array):
+    return input_array.sum(axis=1)
+
+def test_submit_returns_prediction():
+    batcher = MicroBatcher(sum_features, max_batch_size=8, max_wait_us=100)
+    assert batcher.submit([1.0, 2.0]).result(timeout=5) == 3.0
+
+def test_concurrent_rows_are_coalesced():
+    batcher = MicroBatcher(sum_features, max_batch_size=16, max_wait_us=50000)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=16) as executor:
+        futures = list(executor.map(lambda i: batcher.submit([i, 1.0]), range(64)))
+    results = [future.result(timeout=5) for future in futures]
+    assert results == [i + 1.0 for i in range(64)]
+
+    stats = batcher.stats()
+    assert stats['rows'] == 64
+    assert stats['batches'] < 64
+    assert max(int(size) for size in stats['batch_size_histogram']) <= 16
+
+def test_predict_errors_are_propagated():
+    def failing_predict(input_array):
+        raise RuntimeError('model failure')
+
+    batcher = MicroBatcher(failing_predict, max_batch_size=4, max_wait_us=100)
+    with pytest.raises(RuntimeError):
+        batcher.submit([1.0, 2.0]).result(timeout=5)
+
+def test_predictions_must_match_the_rows():
+    batcher = MicroBatcher(lambda input_array: input_array.sum(), max_batch_size=4, max_wait_us=100)
+    with pytest.raises(ValueError):
+        batcher.submit([1.0, 2.0]).result(timeout=5)
+    batcher = MicroBatcher(lambda input_array: input_array.sum(axis=1)[:1], max_batch_size=2, max_wait_us=50000)
+    futures = [batcher.submit([1.0, 2.0]), batcher.submit([3.0, 4.0])]
+    with pytest.raises(ValueError):
+        futures[1].result(timeout=5)
+    with pytest.raises(ValueError):
+        futures[0].result(timeout=5)
+
+def test_cancelled_waiters_do_not_stop_the_batcher():
+    started, release = threading.Event(), threading.Event()
+
+    def blocking_sum(input_array):
+        started.set()
+        release.wait(5)
+        return input_array.sum(axis=1)
+
+    batcher = MicroBatcher(blocking_sum, max_batch_size=1, max_wait_us=0)
+    scored = batcher.submit([1.0, 2.0])
+    queued = batcher.submit([3.0, 4.0])
+    assert started.wait(5)
+    # a row being scored can no longer be cancelled, a queued one is dropped
+    assert not scored.cancel()
+    assert queued.cancel()
+    release.set()
+    assert scored.result(timeout=5) == 3.0
+    assert batcher.submit([5.0, 6.0]).result(timeout=5) == 11.0
+    assert batcher.stats()['rows'] == 2
+
+def test_invalid_settings():
+    with pytest.raises(ValueError):
+        MicroBatcher(sum_features, max_batch_size=0)
+    with pytest.raises(ValueError):
+        MicroBatcher(sum_features, max_wait_us=-1)
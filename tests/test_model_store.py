@@ -0,0 +1,62 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+import lightgbm as lgb
+import pytest
+# Add the web_api directory to sys.path
+web_api_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'web_api')
+sys.path.append(web_api_path)
+from model_store import ModelStore
+from tree_predictor import TreePredictor
+from scripts.train_model import export_tree_arrays
+
+
+def write_trees(file_path, scale):
+    rng = np.random.default_rng(0)
+    X = pd.DataFrame({'vol_moving_avg': rng.uniform(0, 100, 500), 'adj_close_rolling_med': rng.uniform(0, 10, 500)})
+    model = lgb.LGBMRegressor(n_estimators=10, verbose=-1)
+    model.fit(X, X['vol_moving_avg'] * scale)
+    with open(file_path + '.tmp', 'wb') as f:
+        np.savez(f, **export_tree_arrays(model))
+    os.replace(file_path + '.tmp', file_path)
+
+@pytest.fixture
+def model_paths(tmp_path):
+    path = os.path.join(tmp_path, 'lightgbm_predictor.joblib')
+    tree_path = os.path.join(tmp_path, 'lightgbm_predictor.npz')
+    write_trees(tree_path, scale=1)
+    return path, tree_path
+
+def test_loads_trees(model_paths):
+    store = ModelStore(*model_paths)
+    assert isinstance(store.model, TreePredictor)
+    assert store.info()['version'] == 0
+
+def test_reload_swaps_model(model_paths):
+    store = ModelStore(*model_paths)
+    previous = store.model
+    assert store.reload() is False
+
+    write_trees(model_paths[1], scale=2)
+    reloaded = []
+    store.on_reload.append(lambda: reloaded.append(True))
+    assert store.reload() is True
+    assert store.model is not previous
+    assert store.info()['version'] == 1
+    assert reloaded == [True]
+    # the previous model keeps serving requests that already hold it
+    row = np.array([[50.0, 5.0]])
+    assert store.model.predict(row)[0] > previous.predict(row)[0]
+
+def test_failed_reload_keeps_model(model_paths):
+    store = ModelStore(*model_paths)
+    previous = store.model
+    with open(model_paths[1] + '.tmp', 'wb') as f:
+        f.write(b'not a model')
+    os.replace(model_paths[1] + '.tmp', model_paths[1])
+    with pytest.raises(Exception):
+        store.reload()
+    assert store.model is previous
+    assert store.info()['version'] == 0
+    assert len(previous.predict(np.array([[50.0, 5.0]]))) == 1
@@ -0,0 +1,79 @@
+import os
+import sys
+import pytest
+# Add the web_api directory to sys.path
+web_api_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'web_api')
+sys.path.append(web_api_path)
+from prediction_cache import PredictionCache
+
+
+def test_hits_and_misses():
+    cache = PredictionCache(max_size=10)
+    assert cache.get([1.0, 2.0]) is None
+    cache.put([1.0, 2.0], 42.0)
+    assert cache.get([1.0, 2.0]) == 42.0
+    stats = cache.stats()
+    assert stats['hits'] == 1
+    assert stats['misses'] == 1
+    assert stats['size'] == 1
+
+def test_quantized_keys():
+    cache = PredictionCache(max_size=10, precision=3)
+    cache.put([12345.0, 25.01], 1.0)
+    assert cache.get([12349.0, 25.04]) == 1.0
+    assert cache.get([12450.0, 25.01]) is None
+
+def test_model_keys():
+    cache = PredictionCache(max_size=10)
+    cache.put([1.0, 2.0], 1.0)
+    cache.put([1.0, 2.0], 2.0, model='asset_class_etfs')
+    assert cache.get([1.0, 2.0]) == 1.0
+    assert cache.get([1.0, 2.0], model='asset_class_etfs') == 2.0
+    assert cache.get([1.0, 2.0], model='asset_class_stocks') is None
+
+def test_lru_eviction():
+    cache = PredictionCache(max_size=2)
+    cache.put([1.0, 1.0], 1.0)
+    cache.put([2.0, 2.0], 2.0)
+    # refresh the first entry so the second one is the least recently used
+    assert cache.get([1.0, 1.0]) == 1.0
+    cache.put([3.0, 3.0], 3.0)
+    assert cache.get([2.0, 2.0]) is None
+    assert cache.get([1.0, 1.0]) == 1.0
+    assert cache.get([3.0, 3.0]) == 3.0
+
+def test_disabled_cache():
+    cache = PredictionCache(max_size=0)
+    cache.put([1.0, 1.0], 1.0)
+    assert cache.get([1.0, 1.0]) is None
+    assert cache.stats()['size'] == 0
+
+def test_model_change_invalidates(tmp_path):
+    model_path = os.path.join(tmp_path, 'model.joblib')
+    with open(model_path, 'wb') as f:
+        f.write(b'first model')
+    cache = PredictionCache(max_size=10, watched_paths=[model_path], check_interval=0)
+    cache.put([1.0, 1.0], 1.0)
+    assert cache.get([1.0, 1.0]) == 1.0
+
+    with open(model_path, 'wb') as f:
+        f.write(b'a retrained model')
+    assert cache.get([1.0, 1.0]) is None
+    assert cache.stats()['invalidations'] == 1
+
+def test_stale_predictions_are_not_cached():
+    cache = PredictionCache(max_size=10)
+    # a miss scored by the previous model, which is replaced before the prediction is cached
+    generation = cache.generation
+    assert cache.get([1.0, 1.0]) is None
+    cache.clear()
+    cache.put([1.0, 1.0], 1.0, generation=generation)
+    assert cache.get([1.0, 1.0]) is None
+    cache.put([1.0, 1.0], 2.0, generation=cache.generation)
+    assert cache.get([1.0, 1.0]) == 2.0
+
+def test_invalid_settings():
+    with pytest.raises(ValueError):
+        PredictionCache(max_size=-1)
+    with pytest.raises(ValueError):
+        PredictionCache(precision=0)
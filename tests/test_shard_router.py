@@ -0,0 +1,74 @@
+import json
+import os
+import sys
+import numpy as np
+import pandas as pd
+import lightgbm as lgb
+import pytest
+# Add the web_api directory to sys.path
+web_api_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'web_api')
+sys.path.append(web_api_path)
+from shard_router import ShardRouter
+from tree_predictor import TreePredictor
+from scripts.train_model import export_tree_arrays
+
+
+def write_shards(directory, scales):
+    rng = np.random.default_rng(0)
+    X = pd.DataFrame({'vol_moving_avg': rng.uniform(0, 100, 500), 'adj_close_rolling_med': rng.uniform(0, 10, 500)})
+    for shard, scale in scales.items():
+        model = lgb.LGBMRegressor(n_estimators=10, verbose=-1)
+        model.fit(X, X['vol_moving_avg'] * scale)
+        np.savez(os.path.join(directory, f'{shard}.npz'), **export_tree_arrays(model))
+    index = {
+        'symbols': {f'SYM{i}': shard for i, shard in enumerate(scales)},
+        'asset_classes': {'etfs': next(iter(scales))},
+        'shards': {shard: {'file': f'{shard}.npz'} for shard in scales},
+    }
+    with open(os.path.join(directory, 'routing.json.tmp'), 'w') as f:
+        json.dump(index, f)
+    os.replace(os.path.join(directory, 'routing.json.tmp'), os.path.join(directory, 'routing.json'))
+
+def test_routes_symbols_and_asset_classes(tmp_path):
+    write_shards(tmp_path, {'a': 1, 'b': 1000})
+    router = ShardRouter(str(tmp_path))
+    assert router.route(symbol='SYM1') == 'b'
+    assert router.route(asset_class='etfs') == 'a'
+    # the symbol takes precedence over the asset class
+    assert router.route(symbol='SYM1', asset_class='etfs') == 'b'
+    assert router.route(symbol='UNKNOWN') is None
+    assert router.route() is None
+
+def test_loads_shards_lazily_with_lru_eviction(tmp_path):
+    write_shards(tmp_path, {'a': 1, 'b': 1000, 'c': 10})
+    router = ShardRouter(str(tmp_path), max_loaded=2)
+    assert router.stats()['loaded'] == 0
+    model = router.model('b')
+    assert isinstance(model, TreePredictor)
+    assert model.predict(np.array([[50.0, 5.0]]))[0] == pytest.approx(50000, rel=0.2)
+    assert router.model('b') is model
+    router.model('a')
+    # 'b' was used more recently than 'a', so 'a' is evicted
+    router.model('b')
+    router.model('c')
+    stats = router.stats()
+    assert stats['loaded'] == 2 and stats['loads'] == 3 and stats['evictions'] == 1
+    assert router.model('b') is model
+    with pytest.raises(KeyError):
+        router.model('d')
+
+def test_missing_index(tmp_path):
+    router = ShardRouter(str(tmp_path))
+    assert router.route(symbol='SYM0') is None
+    assert router.stats()['shards'] == 0
+
+def test_reads_rewritten_index(tmp_path):
+    write_shards(tmp_path, {'a': 1})
+    router = ShardRouter(str(tmp_path), check_interval=0)
+    router.model('a')
+    reloads = []
+    router.on_reload.append(lambda: reloads.append(True))
+    write_shards(tmp_path, {'a': 1, 'b': 1000})
+    assert router.route(symbol='SYM1') == 'b'
+    assert router.stats()['loaded'] == 0
+    assert reloads == [True]
@@ -1,8 +1,25 @@
+import os
+import json
+import joblib
+import numpy as np
 import pandas as pd
 import pytest
 import lightgbm as lgb
 
-from scripts.train_model import train_model
+from scripts.train_model import (
+    train_model,
+    iter_training_batches,
+    train_model_out_of_core,
+    time_split,
+    search_model,
+    dataset_cache_key,
+    update_model,
+    deploy_model,
+    symbol_clusters,
+    train_sharded,
+    data_augmentation_output_path,
+)
+import scripts.train_model as train_model_module
 
 def test_train_model():
     # Create a test DataFrame
@@ -23,3 +40,194 @@ def test_train_model():
     assert isinstance(result[0], lgb.LGBMRegressor)
     assert isinstance(result[1], float)
     assert isinstance(result[2], float)
+
+def test_train_model_out_of_core():
+    # Set up an augmented parquet file holding a few rows with NaN values
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        'Date': pd.date_range('2021-01-01', periods=1000, freq='D'),
+        'vol_moving_avg': rng.random(1000) * 1000,
+        'adj_close_rolling_med': rng.random(1000) * 100,
+    })
+    df['Volume'] = df['vol_moving_avg'] * 2 + rng.random(1000)
+    df.loc[::10, 'vol_moving_avg'] = np.nan
+    file_path = os.path.join(data_augmentation_output_path, 'test_out_of_core.parquet')
+    df.to_parquet(file_path)
+    try:
+        batches = list(iter_training_batches('test_out_of_core', batch_rows=128))
+        assert max(len(target) for _, target in batches) <= 128
+        assert sum(len(target) for _, target in batches) == df['vol_moving_avg'].notna().sum()
+        assert all(features.dtype == np.float32 and not np.isnan(features).any() for features, _ in batches)
+
+        model, mae, mse = train_model_out_of_core('test_out_of_core', batch_rows=128)
+        assert isinstance(model, lgb.Booster)
+        assert model.feature_name() == ['vol_moving_avg', 'adj_close_rolling_med']
+        assert 0 < mae < df['Volume'].std()
+        assert mse > 0
+        assert os.listdir(data_augmentation_output_path).count('test_out_of_core.parquet') == 1
+        assert not [name for name in os.listdir(data_augmentation_output_path) if name.startswith('tmp')]
+    finally:
+        os.remove(file_path)
+
+def test_time_split():
+    data = pd.DataFrame({
+        'Symbol': ['A'] * 5 + ['B'] * 5,
+        'Date': list(pd.date_range('2021-01-01', periods=5)) + list(pd.date_range('2021-01-04', periods=5)),
+    })
+    # the most recent fifth of the whole data is dated after 2021-01-06
+    assert time_split(data, 0.2).tolist() == [False] * 8 + [True] * 2
+    # the most recent fifth of every symbol
+    assert time_split(data, 0.2, by='Symbol').tolist() == ([False] * 4 + [True]) * 2
+
+def test_search_model():
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        'Date': pd.date_range('2021-01-01', periods=600, freq='D'),
+        'vol_moving_avg': rng.random(600) * 1000,
+        'adj_close_rolling_med': rng.random(600) * 100,
+    })
+    df['Volume'] = df['vol_moving_avg'] * 2 + rng.random(600)
+    df.loc[::50, 'adj_close_rolling_med'] = np.nan
+
+    model, mae, mse, trials = search_model(df, num_trials=3, num_workers=2, num_boost_round=50, early_stopping_rounds=5)
+    assert isinstance(model, lgb.Booster)
+    assert len(trials) == 3
+    assert [trial['mae'] for trial in trials] == sorted(trial['mae'] for trial in trials)
+    assert all(trial['seconds'] > 0 and 0 < trial['best_iteration'] <= 50 for trial in trials)
+    # the best trial is reported on the most recent rows, which no trial validated on
+    data = df.dropna()
+    test = time_split(data, 0.1)
+    y_pred = model.predict(data.loc[test, ['vol_moving_avg', 'adj_close_rolling_med']].to_numpy(np.float32))
+    assert mae == pytest.approx(np.abs(data.loc[test, 'Volume'] - y_pred).mean(), rel=1e-6)
+    assert mse == pytest.approx(((data.loc[test, 'Volume'] - y_pred) ** 2).mean(), rel=1e-6)
+
+def test_dataset_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(train_model_module, 'dataset_cache_directory', str(tmp_path))
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        'Date': pd.date_range('2021-01-01', periods=600, freq='D'),
+        'vol_moving_avg': rng.random(600) * 1000,
+        'adj_close_rolling_med': rng.random(600) * 100,
+    })
+    df['Volume'] = df['vol_moving_avg'] * 2 + rng.random(600)
+    file_path = os.path.join(data_augmentation_output_path, 'test_dataset_cache.parquet')
+    df.to_parquet(file_path)
+    try:
+        cache_key = dataset_cache_key('test_dataset_cache')
+        assert dataset_cache_key('test_dataset_cache') == cache_key
+
+        _, mae, mse = train_model_out_of_core('test_dataset_cache', cache_key=cache_key)
+        entries = [name for name in os.listdir(tmp_path) if not name.startswith('.')]
+        assert len(entries) == 1
+        assert sorted(os.listdir(tmp_path / entries[0])) == [
+            'metadata.json', 'test_features.bin', 'test_target.bin', 'train.bin']
+        # a later run loads the binned dataset and the test rows, the data is not read again
+        monkeypatch.setattr(train_model_module, 'iter_training_batches', None)
+        assert train_model_out_of_core('test_dataset_cache', cache_key=cache_key)[1:] == pytest.approx([mae, mse])
+
+        # the search keeps its own datasets, and runs from them without the data
+        search_mae = search_model(df, num_trials=2, num_workers=1, num_boost_round=20, cache_key=cache_key)[1]
+        assert len(os.listdir(tmp_path)) == 2
+        assert search_model(None, num_trials=2, num_workers=1, num_boost_round=20,
+                            cache_key=cache_key)[1] == pytest.approx(search_mae)
+
+        df.loc[0, 'Volume'] += 1
+        df.to_parquet(file_path)
+        assert dataset_cache_key('test_dataset_cache') != cache_key
+    finally:
+        os.remove(file_path)
+
+def market_rows(start, periods, seed):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'Date': pd.date_range(start, periods=periods, freq='D'),
+        'vol_moving_avg': rng.random(periods) * 1000,
+        'adj_close_rolling_med': rng.random(periods) * 100,
+    })
+    df['Volume'] = df['vol_moving_avg'] * 2 + rng.random(periods)
+    return df
+
+@pytest.mark.parametrize('update', ['boost', 'refit'])
+def test_update_model(update):
+    model = train_model(market_rows('2000-01-01', 500, 0))[0]
+    updated, mae, mse, previous_mae, previous_mse = update_model(model, market_rows('2002-01-01', 200, 1), update,
+                                                                 num_boost_round=10)
+    assert isinstance(updated, lgb.Booster)
+    assert updated.num_trees() == model.booster_.num_trees() + (10 if update == 'boost' else 0)
+    assert mae > 0 and mse > 0 and previous_mae > 0 and previous_mse > 0
+    # a reference model is tested on the same rows
+    metrics = update_model(model, market_rows('2002-01-01', 200, 1), update, num_boost_round=10, reference=model)
+    assert metrics[5:] == [previous_mae, previous_mse]
+
+def test_deploy_model_incremental(tmp_path, monkeypatch):
+    monkeypatch.setattr(train_model_module, 'model_destination_path', str(tmp_path))
+    monkeypatch.setattr(train_model_module, 'training_state_path', str(tmp_path / 'training_state.json'))
+    monkeypatch.setattr(train_model_module, 'incremental_min_rows', 10)
+    monkeypatch.setattr(train_model_module, 'data_augmentation_output_path', str(tmp_path))
+    file_path = tmp_path / 'augmented_data.parquet'
+    history = market_rows('2000-01-01', 400, 0)
+    history.to_parquet(file_path)
+    # without a deployed model the first run trains from scratch
+    deploy_model(mode='incremental')
+    state = json.loads((tmp_path / 'training_state.json').read_text())
+    assert state['watermark'] == '2001-02-03T00:00:00' and state['updates'] == 0
+    full_trees = joblib.load(tmp_path / 'lightgbm_predictor.joblib').booster_.num_trees()
+
+    # too few new rows leave the deployed model in place
+    pd.concat([history, market_rows('2001-02-04', 5, 1)]).to_parquet(file_path)
+    deploy_model(mode='incremental')
+    assert json.loads((tmp_path / 'training_state.json').read_text()) == state
+
+    # the update continues boosting on the new rows only
+    pd.concat([history, market_rows('2001-02-04', 100, 1)]).to_parquet(file_path)
+    monkeypatch.setattr(train_model_module, 'incremental_metric_tolerance', float('inf'))
+    deploy_model(mode='incremental')
+    updated_state = json.loads((tmp_path / 'training_state.json').read_text())
+    assert updated_state['watermark'] == '2001-05-14T00:00:00' and updated_state['updates'] == 1
+    assert updated_state['full_trained_at'] == state['full_trained_at']
+    model = joblib.load(tmp_path / 'lightgbm_predictor.joblib')
+    assert model.num_trees() == full_trees + train_model_module.incremental_rounds
+    # the last fully trained model is kept to test the next updates against
+    assert joblib.load(tmp_path / 'full_lightgbm_predictor.joblib').booster_.num_trees() == full_trees
+
+    # the scheduled full retrain trains from scratch again
+    deploy_model(mode='incremental', full_retrain_days=0)
+    assert json.loads((tmp_path / 'training_state.json').read_text())['updates'] == 0
+    assert joblib.load(tmp_path / 'lightgbm_predictor.joblib').booster_.num_trees() == full_trees
+
+def test_symbol_clusters():
+    data = pd.DataFrame({'Symbol': ['A', 'A', 'B', 'C', 'D'], 'Volume': [10.0, 30.0, 1e6, 5.0, 1e4]})
+    assert symbol_clusters(data, 2).to_dict() == {'A': 0, 'B': 1, 'C': 0, 'D': 1}
+
+@pytest.mark.parametrize('by', ['asset_class', 'cluster'])
+def test_train_sharded(by):
+    df = pd.concat([market_rows('2000-01-01', 300, seed).assign(Symbol=f'SYM{seed}') for seed in range(4)])
+    df['asset_class'] = np.where(df['Symbol'].isin(['SYM0', 'SYM1']), 'etfs', 'stocks')
+    df.loc[df['Symbol'] == 'SYM3', 'Volume'] *= 1000
+    models, routes, metrics = train_sharded(df, by, num_clusters=2, num_workers=1)
+    assert set(models) == set(metrics)
+    assert len(models) == 2
+    assert sorted(routes['symbols']) == ['SYM0', 'SYM1', 'SYM2', 'SYM3']
+    assert set(routes['symbols'].values()) == set(models)
+    if by == 'asset_class':
+        assert routes['asset_classes'] == {'etfs': 'asset_class_etfs', 'stocks': 'asset_class_stocks'}
+        assert routes['symbols']['SYM0'] == 'asset_class_etfs'
+    else:
+        assert routes['asset_classes'] == {}
+        assert routes['symbols']['SYM3'] == 'cluster_1'
+    assert sum(shard['rows'] for shard in metrics.values()) == len(df)
+
+def test_deploy_model_sharded_without_asset_class(tmp_path, monkeypatch):
+    # the pandas ingestion mode writes no asset_class column
+    monkeypatch.setattr(train_model_module, 'data_augmentation_output_path', str(tmp_path))
+    monkeypatch.setattr(train_model_module, 'shard_directory', str(tmp_path / 'shards'))
+    df = pd.concat([market_rows('2000-01-01', 300, seed).assign(Symbol=f'SYM{seed}') for seed in range(4)])
+    df.to_parquet(tmp_path / 'augmented_data.parquet')
+
+    deploy_model(mode='sharded', shard_by='cluster', num_clusters=2, num_workers=1)
+    routing = json.loads((tmp_path / 'shards' / 'routing.json').read_text())
+    assert sorted(routing['shards']) == ['cluster_0', 'cluster_1']
+    assert sorted(routing['symbols']) == ['SYM0', 'SYM1', 'SYM2', 'SYM3']
+
+    with pytest.raises(ValueError, match='asset_class'):
+        deploy_model(mode='sharded', shard_by='asset_class', num_workers=1)
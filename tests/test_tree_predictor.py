@@ -0,0 +1,100 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+import lightgbm as lgb
+import pytest
+# Add the web_api directory to sys.path
+web_api_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'web_api')
+sys.path.append(web_api_path)
+from tree_predictor import TreePredictor, table_path
+from scripts.train_model import export_tree_arrays
+
+
+def fit_model(with_nan):
+    rng = np.random.default_rng(42)
+    X = pd.DataFrame({
+        'vol_moving_avg': rng.lognormal(10, 2, 2000),
+        'adj_close_rolling_med': rng.lognormal(3, 1, 2000),
+    })
+    y = X['vol_moving_avg'] * rng.uniform(0.5, 1.5, 2000)
+    if with_nan:
+        X.loc[::7, 'vol_moving_avg'] = np.nan
+    model = lgb.LGBMRegressor(n_estimators=50, num_leaves=15, verbose=-1)
+    model.fit(X, y)
+    return model
+
+def sample_rows():
+    rng = np.random.default_rng(7)
+    X = np.column_stack([rng.lognormal(10, 3, 1000), rng.lognormal(3, 2, 1000)])
+    X[::11, 0] = np.nan
+    X[::13, 1] = 0.0
+    return X
+
+def test_table_matches_lightgbm():
+    model = fit_model(with_nan=False)
+    predictor = TreePredictor(export_tree_arrays(model))
+    assert predictor.table is not None
+    X = sample_rows()
+    np.testing.assert_allclose(predictor.predict(X), model.booster_.predict(X), rtol=1e-9)
+
+def test_traversal_matches_lightgbm():
+    model = fit_model(with_nan=True)
+    predictor = TreePredictor(export_tree_arrays(model), chunk_size=128)
+    assert predictor.table is None
+    X = sample_rows()
+    np.testing.assert_allclose(predictor.predict(X), model.booster_.predict(X), rtol=1e-9)
+
+def test_table_can_be_disabled():
+    model = fit_model(with_nan=False)
+    predictor = TreePredictor(export_tree_arrays(model), max_table_size=0)
+    assert predictor.table is None
+    X = sample_rows()
+    np.testing.assert_allclose(predictor.predict(X), model.booster_.predict(X), rtol=1e-9)
+
+def test_load(tmp_path):
+    model = fit_model(with_nan=False)
+    file_path = os.path.join(tmp_path, 'model.npz')
+    np.savez(file_path, **export_tree_arrays(model))
+    predictor = TreePredictor.load(file_path)
+    X = sample_rows()
+    np.testing.assert_allclose(predictor.predict(X), model.booster_.predict(X), rtol=1e-9)
+
+def test_predict_rejects_wrong_shape():
+    predictor = TreePredictor(export_tree_arrays(fit_model(with_nan=False)))
+    with pytest.raises(ValueError):
+        predictor.predict(np.zeros((3, 3)))
+
+def test_load_mmap(tmp_path):
+    model = fit_model(with_nan=False)
+    file_path = os.path.join(tmp_path, 'model.npz')
+    np.savez(file_path, **export_tree_arrays(model))
+    predictor = TreePredictor.load(file_path, mmap=True)
+    X = sample_rows()
+    np.testing.assert_allclose(predictor.predict(X), model.booster_.predict(X), rtol=1e-9)
+
+def test_load_mmap_rejects_compressed(tmp_path):
+    file_path = os.path.join(tmp_path, 'model.npz')
+    np.savez_compressed(file_path, **export_tree_arrays(fit_model(with_nan=False)))
+    with pytest.raises(ValueError):
+        TreePredictor.load(file_path, mmap=True)
+
+def test_load_cached_table(tmp_path):
+    model = fit_model(with_nan=False)
+    file_path = os.path.join(tmp_path, 'model.npz')
+    np.savez(file_path, **export_tree_arrays(model))
+    compiled = TreePredictor.load(file_path, mmap=True)
+    assert os.path.exists(table_path(file_path))
+    predictor = TreePredictor.load(file_path, mmap=True)
+    # the table is mapped from the cache rather than compiled again
+    assert not predictor.table.flags.owndata and not predictor.table.flags.writeable
+    np.testing.assert_array_equal(predictor.table, compiled.table)
+    X = sample_rows()
+    np.testing.assert_allclose(predictor.predict(X), model.booster_.predict(X), rtol=1e-9)
+
+    # rewritten trees are loaded without the table cached for the previous ones
+    model = fit_model(with_nan=True)
+    np.savez(file_path, **export_tree_arrays(model))
+    predictor = TreePredictor.load(file_path, mmap=True)
+    assert predictor.table is None
+    np.testing.assert_allclose(predictor.predict(X), model.booster_.predict(X), rtol=1e-9)
@@ -1,11 +1,46 @@
-from flask import Flask, request, jsonify
-import joblib
-import numpy as np
+from flask import Flask, Response, request, jsonify
 import concurrent.futures
+import json
+import numpy as np
 import os
 import sys
+from micro_batcher import MicroBatcher
+from feature_store import FeatureStore
+from model_store import ModelStore
+from prediction_cache import PredictionCache
+from shard_router import ShardRouter
 
 app = Flask(__name__)
+# upper bound on the number of rows accepted by a single /predict/batch call
+app.config['MAX_BATCH_SIZE'] = int(os.environ.get('MAX_BATCH_SIZE', 100000))
+# concurrent /predict calls are coalesced into batches of at most MICRO_BATCH_MAX_SIZE
+# rows, waiting no longer than MICRO_BATCH_MAX_WAIT_US microseconds for a batch to fill
+app.config['MICRO_BATCH_MAX_SIZE'] = int(os.environ.get('MICRO_BATCH_MAX_SIZE', 64))
+app.config['MICRO_BATCH_MAX_WAIT_US'] = int(os.environ.get('MICRO_BATCH_MAX_WAIT_US', 1000))
+# a /predict call waiting longer than MICRO_BATCH_TIMEOUT seconds for its batch is answered with a 503
+app.config['MICRO_BATCH_TIMEOUT'] = float(os.environ.get('MICRO_BATCH_TIMEOUT', 10))
+# repeated /predict calls are answered from an LRU cache of PREDICTION_CACHE_SIZE entries (0 disables it),
+# keyed on the features rounded to PREDICTION_CACHE_PRECISION significant digits when set
+app.config['PREDICTION_CACHE_SIZE'] = int(os.environ.get('PREDICTION_CACHE_SIZE', 10000))
+app.config['PREDICTION_CACHE_PRECISION'] = (
+    int(os.environ['PREDICTION_CACHE_PRECISION']) if 'PREDICTION_CACHE_PRECISION' in os.environ else None
+)
+# the model files are checked for a retrained model every MODEL_WATCH_INTERVAL seconds (0 disables it),
+# the exported trees are memory-mapped unless MODEL_MMAP is 0
+app.config['MODEL_WATCH_INTERVAL'] = float(os.environ.get('MODEL_WATCH_INTERVAL', 0))
+app.config['MODEL_MMAP'] = os.environ.get('MODEL_MMAP', '1') != '0'
+# requests naming a symbol or an asset class are scored by the model of their shard, loaded on first use;
+# at most SHARD_CACHE_SIZE shards are held in memory, the least recently used being dropped first
+app.config['SHARD_CACHE_SIZE'] = int(os.environ.get('SHARD_CACHE_SIZE', 8))
+# POST /admin/reload and POST /features/bars require this value in the X-Admin-Token header,
+# and are refused altogether while it is not set
+app.config['ADMIN_TOKEN'] = os.environ.get('ADMIN_TOKEN')
+features = ['vol_moving_avg', 'adj_close_rolling_med']
+# a generous bound on the bytes a JSON row of the features takes, full floats indented on lines of
+# their own, which bounds the body of a JSON batch before it is parsed; the number of rows is checked once parsed
+max_json_row_bytes = 256
+# the Arrow IPC stream and file formats, accepted by /predict/batch as tables of the feature columns
+arrow_mimetypes = ('application/vnd.apache.arrow.stream', 'application/vnd.apache.arrow.file')
 
 def return_prediction(model, x_hat):
     prediction = model.predict(x_hat)
@@ -17,10 +52,72 @@ path = os.path.join('app','ml-models','lightgbm_predictor.joblib')
 if not os.path.exists(path):
     #this will default to presaved model for web hosting.
     path = os.path.join("ml-model", "lightgbm_predictor.joblib")
-model = joblib.load(path)
+#prefer the flattened trees exported next to the model, they are evaluated without lightgbm.
+tree_path = os.path.splitext(path)[0] + '.npz'
+model_store = ModelStore(path, tree_path, mmap=app.config['MODEL_MMAP'])
+#the models of the asset classes or symbol clusters, when trained, and their routing index.
+#the latest features of every symbol, looked up by /predict?symbol= and updated with new daily bars.
+feature_store = FeatureStore(os.path.join(os.path.dirname(path), 'feature_store.arrow'),
+                             journal_path=os.path.join(os.path.dirname(path), 'feature_store.journal'))
+shard_router = ShardRouter(os.path.join(os.path.dirname(path), 'shards'), max_loaded=app.config['SHARD_CACHE_SIZE'],
+                           mmap=app.config['MODEL_MMAP'])
 sys.path.append(path)
-executor = concurrent.futures.ThreadPoolExecutor()
+batcher = MicroBatcher(
+    lambda x_hat: return_prediction(model_store.model, x_hat),
+    max_batch_size=app.config['MICRO_BATCH_MAX_SIZE'],
+    max_wait_us=app.config['MICRO_BATCH_MAX_WAIT_US'],
+)
+prediction_cache = PredictionCache(
+    max_size=app.config['PREDICTION_CACHE_SIZE'],
+    precision=app.config['PREDICTION_CACHE_PRECISION'],
+    watched_paths=[path, tree_path, shard_router.index_path],
+)
+model_store.on_reload.append(prediction_cache.clear)
+shard_router.on_reload.append(prediction_cache.clear)
+if app.config['MODEL_WATCH_INTERVAL'] > 0:
+    model_store.watch(app.config['MODEL_WATCH_INTERVAL'])
+
+
+def route(args):
+    """Returns the shard named by the optional 'symbol' or 'asset_class' arguments of a request, None without them.
+
+    Args:
+        args (mapping): the query arguments of the request.
+
+    Raises:
+        KeyError: If an asset class is named but neither it nor the symbol is routed to any shard.
+
+    Returns:
+        str: the shard scoring the request, None for the single model, which also scores symbols without a shard.
+    """
+    symbol, asset_class = args.get('symbol'), args.get('asset_class')
+    if symbol is None and asset_class is None:
+        return None
+    shard = shard_router.route(symbol, asset_class)
+    if shard is None and asset_class is not None:
+        raise KeyError(f'asset class {asset_class}')
+    return shard
+
+def route_model(args, shard):
+    """Returns the model of the shard a request was routed to, routing the request again when the
+    routing index was rewritten since and no longer holds the shard.
+
+    Args:
+        args (mapping): the query arguments of the request.
+        shard (str): the shard returned by route.
+
+    Raises:
+        KeyError: If the request is routed again and its asset class is no longer routed to any shard.
 
+    Returns:
+        tuple: the shard finally scoring the request and its model, the single model when the shard is None.
+    """
+    while shard is not None:
+        try:
+            return shard, shard_router.model(shard)
+        except KeyError:
+            shard = route(args)
+    return None, model_store.model
 
 # Health check endpoint
 @app.route('/health', methods=['GET'])
@@ -32,6 +129,14 @@ def prediction():
     # Get the query parameters
     vol_moving_avg = request.args.get('vol_moving_avg')
     adj_close_rolling_med = request.args.get('adj_close_rolling_med')
+    symbol = request.args.get('symbol')
+
+    # Look the features of a symbol up when the request does not pass them
+    if symbol is not None and vol_moving_avg is None and adj_close_rolling_med is None:
+        features = feature_store.features(symbol)
+        if features is None:
+            return jsonify({'error': f'No features for symbol {symbol}'}), 404
+        vol_moving_avg, adj_close_rolling_med = features['vol_moving_avg'], features['adj_close_rolling_med']
 
     try:
         # Validate the parameters
@@ -41,15 +146,209 @@ def prediction():
         adj_close_rolling_med = float(adj_close_rolling_med)
     except ValueError:
         return jsonify({'error': 'Invalid query parameters: arguments must be float'}), 400
+    try:
+        shard = route(request.args)
+    except KeyError as e:
+        return jsonify({'error': f'No model for {e.args[0]}'}), 404
     
-    # Create the input array and get the prediction asynchronously
-    input_array = np.array([[vol_moving_avg, adj_close_rolling_med]])
-    future = executor.submit(return_prediction, model, input_array)
-    prediction = future.result()[0]
+    # Answer repeated requests from the cache, otherwise queue the row
+    # with concurrent requests and wait for its batch to be scored;
+    # rows of a shard are scored on their own by the model of the shard
+    # the generation is read first, so a prediction of a model replaced meanwhile is not cached
+    input_row = [vol_moving_avg, adj_close_rolling_med]
+    generation = prediction_cache.generation
+    prediction = prediction_cache.get(input_row, shard)
+    if prediction is None:
+        if shard is None:
+            future = batcher.submit(input_row)
+            try:
+                prediction = future.result(timeout=app.config['MICRO_BATCH_TIMEOUT'])
+            except concurrent.futures.TimeoutError:
+                # the row is dropped if it is still queued
+                future.cancel()
+                return jsonify({'error': 'Server busy: the prediction timed out'}), 503
+        else:
+            try:
+                shard, model = route_model(request.args, shard)
+            except KeyError as e:
+                return jsonify({'error': f'No model for {e.args[0]}'}), 404
+            prediction = float(return_prediction(model, np.array([input_row]))[0])
+        prediction_cache.put(input_row, prediction, shard, generation)
     
     # Return the prediction
     return jsonify({'Volume Prediction': prediction}), 200
 
+def batch_body_limit(mimetype):
+    """Returns the largest body, in bytes, of a /predict/batch request of MAX_BATCH_SIZE rows."""
+    if mimetype == 'application/octet-stream':
+        return app.config['MAX_BATCH_SIZE'] * len(features) * np.dtype('<f8').itemsize
+    if mimetype in arrow_mimetypes:
+        # the float64 feature columns and their validity bitmaps, with room for the schema and batch headers
+        return app.config['MAX_BATCH_SIZE'] * len(features) * (np.dtype('<f8').itemsize + 1) + 65536
+    return app.config['MAX_BATCH_SIZE'] * max_json_row_bytes + 1024
+
+def parse_batch(body, mimetype):
+    """Parses the body of a /predict/batch request into a feature matrix.
+
+    Accepts either a JSON array of [vol_moving_avg, adj_close_rolling_med] rows,
+    a JSON object holding one array per feature (columnar), an
+    application/octet-stream body of packed little-endian float64 rows, or an
+    Arrow IPC stream or file holding a column per feature.
+
+    Args:
+        body (bytes): the body of the request.
+        mimetype (str): the mimetype of the request.
+
+    Raises:
+        ValueError: If the body does not match any of the supported layouts.
+
+    Returns:
+        tuple: the (n, 2) float64 feature matrix and the name of the layout used.
+    """
+    if mimetype == 'application/octet-stream':
+        row_size = len(features) * np.dtype('<f8').itemsize
+        if len(body) % row_size != 0:
+            raise ValueError(f'packed body length must be a multiple of {row_size} bytes')
+        return np.frombuffer(body, dtype='<f8').reshape(-1, len(features)), 'packed'
+    if mimetype in arrow_mimetypes:
+        return parse_arrow_batch(body, mimetype), 'arrow'
+
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        payload = None
+    try:
+        if isinstance(payload, dict):
+            if any(feature not in payload for feature in features):
+                raise ValueError('A feature column is missing')
+            columns = [np.asarray(payload[feature], dtype=np.float64) for feature in features]
+            if any(column.ndim != 1 or len(column) != len(columns[0]) for column in columns):
+                raise ValueError('feature columns must be flat arrays of equal length')
+            return np.column_stack(columns), 'columnar'
+        if isinstance(payload, list):
+            input_array = np.asarray(payload, dtype=np.float64)
+            if len(payload) == 0:
+                input_array = input_array.reshape(0, len(features))
+            if input_array.ndim != 2 or input_array.shape[1] != len(features):
+                raise ValueError(f'each row must hold {len(features)} values')
+            return input_array, 'rows'
+    except TypeError:
+        raise ValueError('arguments must be float')
+    raise ValueError('expected a JSON array, a JSON object, a packed float64 body or an Arrow IPC body')
+
+def parse_arrow_batch(body, mimetype):
+    """Reads the feature columns of an Arrow IPC body into a feature matrix, other columns are ignored."""
+    # pyarrow is only needed by Arrow requests, importing it lazily keeps it out of the startup of workers
+    import pyarrow as pa
+    try:
+        if mimetype == 'application/vnd.apache.arrow.file':
+            table = pa.ipc.open_file(pa.py_buffer(body)).read_all()
+        else:
+            table = pa.ipc.open_stream(pa.py_buffer(body)).read_all()
+    except pa.ArrowException as e:
+        raise ValueError(f'invalid Arrow IPC body: {e}')
+    if any(feature not in table.column_names for feature in features):
+        raise ValueError('A feature column is missing')
+    try:
+        # null values are read as NaN, as missing values of the packed layout
+        columns = [table.column(feature).cast(pa.float64()).to_numpy() for feature in features]
+    except pa.ArrowException:
+        raise ValueError('feature columns must be numeric')
+    return np.column_stack(columns)
+
+def arrow_reply(predictions):
+    """Returns the predictions as an Arrow IPC stream of a single 'Volume Prediction' column."""
+    import pyarrow as pa
+    table = pa.table({'Volume Prediction': predictions})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return Response(sink.getvalue().to_pybytes(), mimetype='application/vnd.apache.arrow.stream')
+
+def batch_too_large():
+    return jsonify({'error': f"Batch too large: at most {app.config['MAX_BATCH_SIZE']} rows are accepted"}), 413
+
+@app.route("/predict/batch", methods=["POST"])
+def batch_prediction():
+    # Reject oversized bodies from their length, before reading or parsing them
+    limit = batch_body_limit(request.mimetype)
+    if request.content_length is not None and request.content_length > limit:
+        return batch_too_large()
+    body = request.stream.read(limit + 1)
+    if len(body) > limit:
+        return batch_too_large()
+    try:
+        input_array, layout = parse_batch(body, request.mimetype)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid request body: {e}'}), 400
+
+    if len(input_array) == 0:
+        return jsonify({'error': 'Invalid request body: the batch is empty'}), 400
+    if len(input_array) > app.config['MAX_BATCH_SIZE']:
+        return batch_too_large()
+    try:
+        shard, model = route_model(request.args, route(request.args))
+    except KeyError as e:
+        return jsonify({'error': f'No model for {e.args[0]}'}), 404
+
+    # Score the whole matrix in a single vectorized call
+    predictions = np.asarray(return_prediction(model, input_array), dtype='<f8')
+
+    # Reply using the same layout as the request
+    if layout == 'packed':
+        return Response(predictions.tobytes(), mimetype='application/octet-stream'), 200
+    if layout == 'arrow':
+        return arrow_reply(predictions), 200
+    if layout == 'columnar':
+        return jsonify({'Volume Prediction': predictions.tolist()}), 200
+    return jsonify(predictions.reshape(-1, 1).tolist()), 200
+
+def admin_forbidden():
+    """Returns the 403 reply of an admin request without the ADMIN_TOKEN, None when it carries it.
+
+    Admin requests are refused whenever no ADMIN_TOKEN is configured, so that an anonymous
+    client cannot change what the API serves.
+    """
+    token = app.config['ADMIN_TOKEN']
+    if not token or request.headers.get('X-Admin-Token') != token:
+        return jsonify({'error': 'Forbidden'}), 403
+    return None
+
+@app.route('/features/bars', methods=['POST'])
+def update_features():
+    forbidden = admin_forbidden()
+    if forbidden is not None:
+        return forbidden
+    bars = request.get_json(silent=True)
+    if not isinstance(bars, list):
+        return jsonify({'error': 'Invalid request body: expected a JSON array of bars'}), 400
+    try:
+        applied = feature_store.update(bars)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid request body: {e}'}), 400
+    return jsonify({'applied': applied, 'skipped': len(bars) - applied}), 200
+
+@app.route('/admin/reload', methods=['POST'])
+def reload_model():
+    forbidden = admin_forbidden()
+    if forbidden is not None:
+        return forbidden
+    try:
+        reloaded = model_store.reload(force=request.args.get('force') == 'true')
+    except Exception as e:
+        return jsonify({'error': f'Failed to reload the model: {e}'}), 500
+    return jsonify({'reloaded': reloaded, 'model': model_store.info()}), 200
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return jsonify({
+        'micro_batcher': batcher.stats(),
+        'prediction_cache': prediction_cache.stats(),
+        'model': model_store.info(),
+        'shards': shard_router.stats(),
+        'feature_store': feature_store.stats(),
+    }), 200
+
 # Default 404 path
 @app.errorhandler(404)
 def not_found(error):
@@ -0,0 +1,149 @@
+"""Async ASGI entry point of the prediction API.
+
+Serves the /health, /predict and 404 behaviour of the Flask app from an event loop, so
+a single process can hold many more concurrent connections than a Flask worker. Rows
+scored by the single model are coalesced with those of other requests by the micro-batcher
+of the Flask app, the rows of a shard run on a bounded thread pool, and requests are rejected
+with a 503 once too many predictions are pending.
+
+Run it with any ASGI server, e.g. `uvicorn asgi:application --port 5000`.
+"""
+import asyncio
+import concurrent.futures
+import json
+import os
+from urllib.parse import parse_qs
+import numpy as np
+import app as flask_api
+
+# number of threads running the inference of shards
+inference_workers = int(os.environ.get('ASGI_INFERENCE_WORKERS', os.cpu_count() or 1))
+# number of predictions allowed to wait for or run inference before requests are rejected
+max_queue_depth = int(os.environ.get('ASGI_MAX_QUEUE_DEPTH', 1024))
+executor = concurrent.futures.ThreadPoolExecutor(max_workers=inference_workers)
+
+queue_depth = 0
+rejected = 0
+
+
+async def send_response(send, status, body, content_type, headers=()):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', content_type), (b'content-length', str(len(body)).encode())] + list(headers),
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+async def send_json(send, payload, status, headers=()):
+    body = (json.dumps(payload) + '\n').encode()
+    await send_response(send, status, body, b'application/json', headers)
+
+async def health_check(scope, send):
+    await send_response(send, 200, b'OK', b'text/html; charset=utf-8')
+
+def predict_row(args, shard, x_hat):
+    # the model of a shard may be loaded from disk on first use, which is kept off the event loop
+    return flask_api.return_prediction(flask_api.route_model(args, shard)[1], x_hat)
+
+async def prediction(scope, send):
+    global queue_depth, rejected
+    # Get the query parameters
+    params = parse_qs(scope['query_string'].decode('latin-1'), keep_blank_values=True)
+    vol_moving_avg = params.get('vol_moving_avg', [None])[0]
+    adj_close_rolling_med = params.get('adj_close_rolling_med', [None])[0]
+    symbol = params.get('symbol', [None])[0]
+
+    # Look the features of a symbol up when the request does not pass them
+    if symbol is not None and vol_moving_avg is None and adj_close_rolling_med is None:
+        features = flask_api.feature_store.features(symbol)
+        if features is None:
+            return await send_json(send, {'error': f'No features for symbol {symbol}'}, 404)
+        vol_moving_avg, adj_close_rolling_med = features['vol_moving_avg'], features['adj_close_rolling_med']
+
+    try:
+        # Validate the parameters
+        if vol_moving_avg is None or adj_close_rolling_med is None:
+            return await send_json(send, {'error': 'Invalid query parameters: A parameter is missing]'}, 400)
+        vol_moving_avg = float(vol_moving_avg)
+        adj_close_rolling_med = float(adj_close_rolling_med)
+    except ValueError:
+        return await send_json(send, {'error': 'Invalid query parameters: arguments must be float'}, 400)
+    args = {name: values[0] for name, values in params.items()}
+    try:
+        shard = flask_api.route(args)
+    except KeyError as e:
+        return await send_json(send, {'error': f'No model for {e.args[0]}'}, 404)
+
+    # the generation is read first, so a prediction of a model replaced meanwhile is not cached
+    input_row = [vol_moving_avg, adj_close_rolling_med]
+    generation = flask_api.prediction_cache.generation
+    prediction = flask_api.prediction_cache.get(input_row, shard)
+    if prediction is None:
+        # Shed load instead of letting the executor queue grow without bound
+        if queue_depth >= max_queue_depth:
+            rejected += 1
+            return await send_json(send, {'error': 'Server busy: too many pending predictions'}, 503,
+                                   [(b'retry-after', b'1')])
+        queue_depth += 1
+        try:
+            if shard is None:
+                # awaited without holding a thread, the batcher scores the row with concurrent ones
+                prediction = float(await asyncio.wrap_future(flask_api.batcher.submit(input_row)))
+            else:
+                loop = asyncio.get_running_loop()
+                predictions = await loop.run_in_executor(executor, predict_row, args, shard, np.array([input_row]))
+                prediction = float(predictions[0])
+        except KeyError as e:
+            # the request was routed again to an asset class no longer routed to any shard
+            return await send_json(send, {'error': f'No model for {e.args[0]}'}, 404)
+        finally:
+            queue_depth -= 1
+        flask_api.prediction_cache.put(input_row, prediction, shard, generation)
+
+    # Return the prediction
+    await send_json(send, {'Volume Prediction': prediction}, 200)
+
+async def metrics(scope, send):
+    await send_json(send, {
+        'asgi': {
+            'queue_depth': queue_depth,
+            'max_queue_depth': max_queue_depth,
+            'inference_workers': inference_workers,
+            'rejected': rejected,
+        },
+        'micro_batcher': flask_api.batcher.stats(),
+        'prediction_cache': flask_api.prediction_cache.stats(),
+        'model': flask_api.model_store.info(),
+        'shards': flask_api.shard_router.stats(),
+        'feature_store': flask_api.feature_store.stats(),
+    }, 200)
+
+routes = {
+    '/health': (health_check, ('GET', 'HEAD')),
+    '/predict': (prediction, ('GET', 'POST')),
+    '/metrics': (metrics, ('GET', 'HEAD')),
+}
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            executor.shutdown(wait=True)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+    route = routes.get(scope['path'])
+    # Default 404 path
+    if route is None:
+        return await send_json(send, {'error': 'Not found'}, 404)
+    handler, methods = route
+    if scope['method'] not in methods:
+        return await send_json(send, {'error': 'Method not allowed'}, 405)
+    await handler(scope, send)
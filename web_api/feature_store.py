@@ -0,0 +1,217 @@
+import json
+import os
+import threading
+import time
+import warnings
+import numpy as np
+import fork_hooks
+
+# the window of a store without one recorded, 30 days in nanoseconds
+default_window_ns = 30 * 24 * 3600 * 10 ** 9
+
+
+def iso_date(value):
+    """Returns the ISO string of a date in nanoseconds since the epoch."""
+    return np.datetime_as_string(np.datetime64(int(value), 'ns'), unit='s')
+
+
+class FeatureStore:
+    """Serves the latest rolling features of every symbol and updates them with new daily bars.
+
+    The store file written by scripts/train_model.export_feature_store holds the rows of every
+    symbol dated within the rolling window of its last date, sorted by symbol and date. It is
+    memory-mapped, so every worker serving it shares one copy in the page cache, and the row
+    range of every symbol is indexed once, so the features of a symbol are found in O(1).
+
+    A new daily bar of a symbol is appended to the rows of its window, which are copied out of
+    the file the first time the symbol is updated, and its features are computed like the
+    augmentation does: the mean of the volumes and the median of the adjusted closes dated
+    within the window, up to and including the bar, ignoring NaN values. Bars are also appended
+    to a journal, which every other process serving the store replays, so the updates reach every
+    worker without a reload. Bars dated on or before the last date of their symbol are ignored,
+    which makes replaying them harmless. The file is read again, and the updates dropped, once
+    it is rewritten; these checks happen at most once every `check_interval` seconds.
+
+    Args:
+        path (str): the path of the Arrow IPC file of the store.
+        journal_path (str): the path of the journal of the bars, None to keep updates in this process.
+        check_interval (float): the minimum time between two checks of the files, in seconds.
+    """
+
+    def __init__(self, path, journal_path=None, check_interval=1.0):
+        self.path = path
+        self.journal_path = journal_path
+        self.check_interval = check_interval
+        self.updates = 0
+        self._lock = threading.Lock()
+        fork_hooks.register(self)
+        self._signature = self._file_signature()
+        self._load()
+        self._last_check = time.monotonic()
+
+    def features(self, symbol):
+        """Returns the latest features of a symbol.
+
+        Args:
+            symbol (str): the symbol.
+
+        Returns:
+            dict: the 'Date' of the latest row of the symbol, as an ISO string, along with its
+                  'vol_moving_avg' and 'adj_close_rolling_med', None when the symbol is unknown.
+        """
+        with self._lock:
+            self._check_files()
+            if symbol in self._latest:
+                return self._latest[symbol]
+            if symbol not in self._index:
+                return None
+            row = self._index[symbol][1] - 1
+            return {
+                'Date': iso_date(self._dates[row]),
+                'vol_moving_avg': float(self._vol_moving_avg[row]),
+                'adj_close_rolling_med': float(self._adj_close_rolling_med[row]),
+            }
+
+    def update(self, bars):
+        """Appends new daily bars and updates the features of their symbols.
+
+        Args:
+            bars (list of dict): the bars, each holding a 'symbol', an ISO 'date', a 'volume' and an 'adj_close'.
+
+        Raises:
+            ValueError: If a bar is malformed, in which case no bar is applied.
+
+        Returns:
+            int: the number of bars applied, bars not dated after the last date of their symbol are skipped.
+        """
+        parsed = [self._parse_bar(bar) for bar in bars]
+        with self._lock:
+            self._check_files()
+            if self.journal_path is not None and parsed:
+                lines = ''.join(json.dumps(bar) + '\n' for bar in bars)
+                # a single write in append mode keeps the bars of concurrent processes whole
+                with open(self.journal_path, 'a') as f:
+                    f.write(lines)
+            return sum(self._apply(*bar) for bar in parsed)
+
+    def stats(self):
+        """Returns the number of symbols in the store, the number of symbols and bars updated and the window."""
+        with self._lock:
+            return {
+                'symbols': len(self._index.keys() | self._latest.keys()),
+                'updated_symbols': len(self._latest),
+                'updates': self.updates,
+                'window_days': self.window_ns / (24 * 3600 * 10 ** 9),
+            }
+
+    def _after_fork(self):
+        # a fork copies the lock in whatever state another thread left it
+        self._lock = threading.Lock()
+
+    def _load(self):
+        """Memory-maps the store file and indexes the row range of every symbol."""
+        self._index, self._tails, self._latest = {}, {}, {}
+        self._buffer = None
+        self._journal_offset, self._journal_inode = 0, None
+        self.window_ns = default_window_ns
+        self._dates = self._volume = self._adj_close = np.empty(0)
+        self._vol_moving_avg = self._adj_close_rolling_med = np.empty(0)
+        if not os.path.exists(self.path):
+            return
+        # pyarrow is only needed once a store is exported, importing it lazily keeps it out of
+        # the startup of workers serving requests that pass their features
+        import pyarrow as pa
+        self._buffer = pa.memory_map(self.path).read_buffer()
+        reader = pa.ipc.open_file(self._buffer)
+        self.window_ns = int((reader.schema.metadata or {}).get(b'window_ns', default_window_ns))
+        if reader.num_record_batches == 0:
+            return
+        if reader.num_record_batches != 1:
+            raise ValueError(f'{self.path} must hold a single record batch, see export_feature_store')
+        batch = reader.get_batch(0)
+        # the export writes NaN rather than nulls, so the numeric columns are numpy views of the
+        # mapped file, shared by every process serving it, and never copied into a worker
+        columns = [batch.column(name).to_numpy(zero_copy_only=True)
+                   for name in ('Volume', 'Adj Close', 'vol_moving_avg', 'adj_close_rolling_med')]
+        self._volume, self._adj_close, self._vol_moving_avg, self._adj_close_rolling_med = columns
+        self._dates = batch.column('Date').view(pa.int64()).to_numpy(zero_copy_only=True)
+        # the symbol codes are only needed to find the row range of every symbol
+        symbols = batch.column('Symbol').dictionary_encode()
+        codes = symbols.indices.to_numpy()
+        boundaries = np.flatnonzero(np.diff(codes)) + 1
+        starts = np.concatenate([[0], boundaries]).astype(np.int64)
+        ends = np.concatenate([boundaries, [len(codes)]]).astype(np.int64)
+        names = symbols.dictionary.to_pylist()
+        self._index = {names[codes[start]]: (int(start), int(end)) for start, end in zip(starts, ends) if end > start}
+
+    def _parse_bar(self, bar):
+        try:
+            return (str(bar['symbol']), int(np.datetime64(bar['date'], 'ns').astype(np.int64)),
+                    float(bar['volume']), float(bar['adj_close']))
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError(f'malformed bar {bar}: {e}')
+
+    def _apply(self, symbol, date, volume, adj_close):
+        """Appends a bar to the window of its symbol and computes its features. Must be called with the lock held."""
+        if symbol not in self._tails:
+            start, end = self._index.get(symbol, (0, 0))
+            self._tails[symbol] = (self._dates[start:end].copy(), self._volume[start:end].copy(),
+                                   self._adj_close[start:end].copy())
+        dates, volumes, adj_closes = self._tails[symbol]
+        if len(dates) and date <= dates[-1]:
+            return False
+        # the window holds the rows dated after the date of the bar minus the window, like pandas
+        keep = dates > date - self.window_ns
+        dates = np.append(dates[keep], date)
+        volumes = np.append(volumes[keep], volume)
+        adj_closes = np.append(adj_closes[keep], adj_close)
+        self._tails[symbol] = (dates, volumes, adj_closes)
+        with warnings.catch_warnings():
+            # a window of NaN values has NaN features
+            warnings.simplefilter('ignore', RuntimeWarning)
+            self._latest[symbol] = {
+                'Date': iso_date(date),
+                'vol_moving_avg': float(np.nanmean(volumes)),
+                'adj_close_rolling_med': float(np.nanmedian(adj_closes)),
+            }
+        self.updates += 1
+        return True
+
+    def _file_signature(self):
+        try:
+            stat = os.stat(self.path)
+            return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            return None
+
+    def _check_files(self):
+        """Reads the store again if it was rewritten and replays the new bars of the journal.
+
+        Must be called with the lock held.
+        """
+        now = time.monotonic()
+        if now - self._last_check < self.check_interval:
+            return
+        self._last_check = now
+        signature = self._file_signature()
+        if signature != self._signature:
+            self._signature = signature
+            self._load()
+        if self.journal_path is None:
+            return
+        try:
+            with open(self.journal_path, 'rb') as f:
+                inode = os.fstat(f.fileno()).st_ino
+                if inode != self._journal_inode:
+                    # a new journal was started since, its bars are all new
+                    self._journal_offset, self._journal_inode = 0, inode
+                f.seek(self._journal_offset)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        # a bar still being written by another process is left for the next check
+        complete = data[:data.rfind(b'\n') + 1]
+        self._journal_offset += len(complete)
+        for line in complete.splitlines():
+            if line.strip():
+                self._apply(*self._parse_bar(json.loads(line)))
@@ -0,0 +1,24 @@
+"""Resets the locks and threads of the objects of the web API in the child of a fork.
+
+A fork copies the locks of the parent in whatever state another thread left them, and none of
+its threads, e.g. in the gunicorn workers of a preloaded app. A single hook is registered for
+the whole process and walks the objects still alive, so registering an object does not keep
+it alive the way a hook registered per object would.
+"""
+import os
+import weakref
+
+_instances = weakref.WeakSet()
+
+
+def register(instance):
+    """Calls `instance._after_fork()` in the child of every later fork, for as long as the instance is alive."""
+    _instances.add(instance)
+
+
+def _after_fork():
+    for instance in list(_instances):
+        instance._after_fork()
+
+
+os.register_at_fork(after_in_child=_after_fork)
@@ -0,0 +1,15 @@
+# gunicorn settings for the prediction API, read from the working directory by `gunicorn app:app`.
+import gc
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+# import the app, and therefore load the model, once in the master before forking the workers.
+# workers then share the model pages copy-on-write and start without importing or loading anything.
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') != '0'
+
+
+def pre_fork(server, worker):
+    # move everything loaded so far out of reach of the garbage collector, otherwise its
+    # bookkeeping writes to the preloaded objects and unshares their pages in every worker
+    gc.freeze()
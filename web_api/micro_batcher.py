@@ -0,0 +1,116 @@
+import collections
+import concurrent.futures
+import queue
+import threading
+import time
+
+import numpy as np
+import fork_hooks
+
+
+class MicroBatcher:
+    """Coalesces concurrent single-row predictions into vectorized model calls.
+
+    Rows submitted from request threads are queued. A background thread takes
+    the first waiting row, then keeps collecting rows until either
+    `max_batch_size` rows are gathered or `max_wait_us` microseconds have
+    passed, scores them with one call to `predict` and resolves the future of
+    every waiting request with its own prediction.
+
+    Args:
+        predict (callable): takes an (n, k) numpy array and returns n predictions.
+        max_batch_size (int): the largest number of rows scored in one call.
+        max_wait_us (int): how long a batch may wait for more rows, in microseconds.
+    """
+
+    def __init__(self, predict, max_batch_size=64, max_wait_us=1000):
+        if max_batch_size < 1:
+            raise ValueError('max_batch_size must be at least 1')
+        if max_wait_us < 0:
+            raise ValueError('max_wait_us must not be negative')
+        self.predict = predict
+        self.max_batch_size = max_batch_size
+        self.max_wait_us = max_wait_us
+        self._start()
+        # threads do not survive a fork, so a process forked after import (e.g. a gunicorn
+        # worker of a preloaded app) gets its own queue and batching thread
+        fork_hooks.register(self)
+
+    def _after_fork(self):
+        self._start()
+
+    def _start(self):
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._batch_sizes = collections.Counter()
+        self._worker = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+        self._worker.start()
+
+    def submit(self, row):
+        """Queues a single feature row for scoring.
+
+        Args:
+            row (sequence of float): the feature values of one observation.
+
+        Returns:
+            concurrent.futures.Future: resolves to the prediction for the row.
+        """
+        future = concurrent.futures.Future()
+        self._queue.put((row, future))
+        return future
+
+    def stats(self):
+        """Returns the number of batches and rows scored, along with the batch size distribution.
+
+        Returns:
+            dict: 'batches', 'rows', 'mean_batch_size' and 'batch_size_histogram',
+                  the latter mapping each observed batch size to its count.
+        """
+        with self._lock:
+            histogram = dict(sorted(self._batch_sizes.items()))
+        batches = sum(histogram.values())
+        rows = sum(size * count for size, count in histogram.items())
+        return {
+            'batches': batches,
+            'rows': rows,
+            'mean_batch_size': rows / batches if batches else 0.0,
+            'batch_size_histogram': {str(size): count for size, count in histogram.items()},
+        }
+
+    def _collect(self):
+        """Blocks for the first row, then gathers more until the batch is full or the wait expires."""
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait_us / 1e6
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                if remaining <= 0:
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            # rows whose waiter cancelled its future meanwhile, e.g. an ASGI request that timed out,
+            # are dropped; the others can no longer be cancelled once they are being scored
+            batch = [(row, future) for row, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            futures = [future for _, future in batch]
+            try:
+                predictions = self.predict(np.array([row for row, _ in batch], dtype=np.float64))
+                if np.shape(predictions) != (len(futures),):
+                    raise ValueError(f'predict returned {np.shape(predictions)} predictions for {len(futures)} rows')
+                for future, prediction in zip(futures, predictions):
+                    future.set_result(prediction)
+            except Exception as e:
+                # every waiter left is resolved, so none blocks and the thread keeps serving
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+            with self._lock:
+                self._batch_sizes[len(batch)] += 1
@@ -0,0 +1,119 @@
+import logging
+import os
+import threading
+import time
+from tree_predictor import TreePredictor
+import fork_hooks
+
+logger = logging.getLogger(__name__)
+
+
+class ModelStore:
+    """Holds the model served by the API and swaps in retrained models without downtime.
+
+    The flattened trees at `tree_path` are preferred over the joblib model at `path`.
+    A reload fully loads the new model before replacing the reference held by the
+    store, so requests already scoring with the previous model finish with it and
+    no request ever sees a partially loaded model.
+
+    Args:
+        path (str): the path of the joblib model.
+        tree_path (str): the path of the flattened trees exported next to the model.
+        mmap (bool): whether to memory-map the flattened trees so that every worker
+                     serving the same file shares one copy of the arrays.
+    """
+
+    def __init__(self, path, tree_path, mmap=True):
+        self.path = path
+        self.tree_path = tree_path
+        self.mmap = mmap
+        self.version = 0
+        self.loaded_at = None
+        self.on_reload = []
+        self._lock = threading.Lock()
+        self._watch_interval = None
+        # a fork copies the lock in whatever state another thread left it, and drops the watcher thread
+        fork_hooks.register(self)
+        self._signature = self._model_signature()
+        self.model = self._load()
+        self.loaded_at = time.time()
+
+    def reload(self, force=False):
+        """Loads the model files again and swaps the new model in.
+
+        Args:
+            force (bool): whether to reload even if the model files did not change.
+
+        Raises:
+            Exception: If the new model cannot be loaded, in which case the previous model stays in service.
+
+        Returns:
+            bool: whether a new model was swapped in.
+        """
+        with self._lock:
+            signature = self._model_signature()
+            if not force and signature == self._signature:
+                return False
+            model = self._load()
+            self.model = model
+            self._signature = signature
+            self.version += 1
+            self.loaded_at = time.time()
+        logger.info(f"Swapped in model version {self.version}")
+        for callback in self.on_reload:
+            callback()
+        return True
+
+    def watch(self, interval):
+        """Starts a daemon thread reloading the model whenever its files change.
+
+        Args:
+            interval (float): the time between two checks of the model files, in seconds.
+
+        Returns:
+            threading.Thread: the watcher thread.
+        """
+        self._watch_interval = interval
+        watcher = threading.Thread(target=self._watch, name='model-watcher', daemon=True)
+        watcher.start()
+        return watcher
+
+    def _watch(self):
+        while True:
+            time.sleep(self._watch_interval)
+            try:
+                self.reload()
+            except Exception as e:
+                logger.error(f"Failed to reload the model, keeping version {self.version}. Error - {e}")
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        if self._watch_interval is not None:
+            self.watch(self._watch_interval)
+
+    def info(self):
+        """Returns the version of the served model, when it was loaded and which file it came from."""
+        return {
+            'version': self.version,
+            'loaded_at': self.loaded_at,
+            'source': self.tree_path if isinstance(self.model, TreePredictor) else self.path,
+            'mmap': self.mmap,
+        }
+
+    def _load(self):
+        if os.path.exists(self.tree_path):
+            return TreePredictor.load(self.tree_path, mmap=self.mmap)
+        # joblib and lightgbm are only needed without exported trees, importing them
+        # lazily keeps them out of the startup of workers serving the trees
+        import joblib
+        return joblib.load(self.path)
+
+    def _model_signature(self):
+        signature = []
+        for path in (self.path, self.tree_path):
+            try:
+                stat = os.stat(path)
+                signature.append((stat.st_ino, stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                signature.append(None)
+        return signature
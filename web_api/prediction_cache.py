@@ -0,0 +1,137 @@
+import collections
+import os
+import threading
+import time
+import fork_hooks
+
+
+class PredictionCache:
+    """A bounded LRU cache of predictions keyed on the feature values of a request, and on the model scoring it.
+
+    Keys can be quantized to a number of significant digits so that nearly identical
+    requests share an entry. The cache empties itself whenever one of the watched model
+    files is modified, which is checked at most once every `check_interval` seconds.
+
+    Every emptying starts a new generation. A request reads the generation before scoring a
+    miss and passes it to put, which drops the prediction when the cache was emptied since,
+    since the prediction may then come from the model that was replaced.
+
+    Args:
+        max_size (int): the largest number of cached predictions, 0 disables caching.
+        precision (int): the number of significant digits kept in keys, None keeps exact values.
+        watched_paths (list of str): the model files whose modification invalidates the cache.
+        check_interval (float): the minimum time between two checks of the watched files, in seconds.
+    """
+
+    def __init__(self, max_size=10000, precision=None, watched_paths=(), check_interval=1.0):
+        if max_size < 0:
+            raise ValueError('max_size must not be negative')
+        if precision is not None and precision < 1:
+            raise ValueError('precision must be at least 1')
+        self.max_size = max_size
+        self.precision = precision
+        self.watched_paths = list(watched_paths)
+        self.check_interval = check_interval
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.generation = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        fork_hooks.register(self)
+        self._signature = self._model_signature()
+        self._last_check = time.monotonic()
+
+    def key(self, row, model=None):
+        """Returns the cache key of a feature row scored by a model, quantized to the configured precision."""
+        if self.precision is None:
+            values = tuple(float(value) for value in row)
+        else:
+            values = tuple(float(f'{value:.{self.precision}g}') for value in row)
+        return values if model is None else (model,) + values
+
+    def get(self, row, model=None):
+        """Returns the cached prediction for a feature row, or None when it is not cached.
+
+        Args:
+            row (list): the feature values.
+            model (str): the shard scoring the row, None for the single model.
+        """
+        if self.max_size == 0:
+            return None
+        key = self.key(row, model)
+        with self._lock:
+            self._check_model()
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, row, prediction, model=None, generation=None):
+        """Caches the prediction of a model for a feature row, evicting the least recently used entry when full.
+
+        Args:
+            row (list): the feature values.
+            prediction (float): the prediction of the model.
+            model (str): the shard scoring the row, None for the single model.
+            generation (int): the generation read before scoring the row, None to always cache the prediction.
+        """
+        if self.max_size == 0:
+            return
+        key = self.key(row, model)
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._entries[key] = prediction
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Drops every cached prediction."""
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+            self.generation += 1
+
+    def stats(self):
+        """Returns the size of the cache along with its hit, miss and invalidation counters."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'invalidations': self.invalidations,
+            }
+
+    def _after_fork(self):
+        # a fork copies the lock in whatever state another thread left it
+        self._lock = threading.Lock()
+
+    def _model_signature(self):
+        signature = []
+        for path in self.watched_paths:
+            try:
+                stat = os.stat(path)
+                signature.append((path, stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                signature.append((path, None, None))
+        return signature
+
+    def _check_model(self):
+        """Empties the cache if a watched model file changed. Must be called with the lock held."""
+        now = time.monotonic()
+        if now - self._last_check < self.check_interval:
+            return
+        self._last_check = now
+        signature = self._model_signature()
+        if signature != self._signature:
+            self._signature = signature
+            self._entries.clear()
+            self.invalidations += 1
+            self.generation += 1
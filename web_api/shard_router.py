@@ -0,0 +1,130 @@
+import collections
+import json
+import os
+import threading
+import time
+from tree_predictor import TreePredictor
+import fork_hooks
+
+
+class ShardRouter:
+    """Routes requests naming a symbol or an asset class to the model of their shard.
+
+    The routing index written by scripts/train_model.save_shards maps every symbol, and every
+    asset class when the shards are asset classes, to a shard. It is small and held in memory.
+    The flattened trees of a shard are only loaded the first time a request is routed to it,
+    and at most `max_loaded` shards are held at once, the least recently used being dropped
+    first. The index is read again, and the loaded shards dropped, whenever it is rewritten,
+    which is checked at most once every `check_interval` seconds; the callbacks of `on_reload`
+    are then called.
+
+    Args:
+        directory (str): the directory holding routing.json and the .npz file of every shard.
+        max_loaded (int): the largest number of shards held in memory.
+        mmap (bool): whether to memory-map the flattened trees, see TreePredictor.load.
+        check_interval (float): the minimum time between two checks of the index, in seconds.
+    """
+
+    def __init__(self, directory, max_loaded=8, mmap=True, check_interval=1.0):
+        if max_loaded < 1:
+            raise ValueError('max_loaded must be at least 1')
+        self.directory = directory
+        self.index_path = os.path.join(directory, 'routing.json')
+        self.max_loaded = max_loaded
+        self.mmap = mmap
+        self.check_interval = check_interval
+        self.loads = 0
+        self.evictions = 0
+        self.on_reload = []
+        self._loaded = collections.OrderedDict()
+        self._lock = threading.Lock()
+        fork_hooks.register(self)
+        self._signature = self._index_signature()
+        self._index = self._load_index()
+        self._last_check = time.monotonic()
+
+    def route(self, symbol=None, asset_class=None):
+        """Returns the shard of a symbol, or else of an asset class, None when neither is routed to a shard."""
+        with self._lock:
+            reloaded = self._check_index()
+            if symbol in self._index['symbols']:
+                shard = self._index['symbols'][symbol]
+            else:
+                shard = self._index['asset_classes'].get(asset_class)
+        if reloaded:
+            for callback in self.on_reload:
+                callback()
+        return shard
+
+    def model(self, shard):
+        """Returns the model of a shard, loading it and evicting the least recently used shard when needed.
+
+        Args:
+            shard (str): a shard returned by route.
+
+        Raises:
+            KeyError: If the shard is not in the index.
+
+        Returns:
+            TreePredictor: the model of the shard.
+        """
+        with self._lock:
+            if shard in self._loaded:
+                self._loaded.move_to_end(shard)
+                return self._loaded[shard]
+            path = os.path.join(self.directory, self._index['shards'][shard]['file'])
+            signature = self._signature
+        # shards load outside of the lock so requests for loaded shards are not held up
+        model = TreePredictor.load(path, mmap=self.mmap)
+        with self._lock:
+            if signature == self._signature:
+                self._loaded[shard] = model
+                self._loaded.move_to_end(shard)
+                self.loads += 1
+                while len(self._loaded) > self.max_loaded:
+                    self._loaded.popitem(last=False)
+                    self.evictions += 1
+        return model
+
+    def stats(self):
+        """Returns the number of shards in the index and in memory, along with the load and eviction counters."""
+        with self._lock:
+            return {
+                'shards': len(self._index['shards']),
+                'loaded': len(self._loaded),
+                'max_loaded': self.max_loaded,
+                'loads': self.loads,
+                'evictions': self.evictions,
+            }
+
+    def _after_fork(self):
+        # a fork copies the lock in whatever state another thread left it
+        self._lock = threading.Lock()
+
+    def _load_index(self):
+        try:
+            with open(self.index_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {'symbols': {}, 'asset_classes': {}, 'shards': {}}
+
+    def _index_signature(self):
+        try:
+            stat = os.stat(self.index_path)
+            return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            return None
+
+    def _check_index(self):
+        """Reads the index again if it was rewritten, returning whether it was. Must be called with the lock held."""
+        now = time.monotonic()
+        if now - self._last_check < self.check_interval:
+            return False
+        self._last_check = now
+        signature = self._index_signature()
+        if signature == self._signature:
+            return False
+        self._signature = signature
+        self._index = self._load_index()
+        self._loaded.clear()
+        return True
@@ -0,0 +1,248 @@
+import logging
+import os
+import struct
+import zipfile
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# missing value handling codes, matching scripts/train_model.missing_types
+MISSING_NONE, MISSING_ZERO, MISSING_NAN = 0, 1, 2
+# LightGBM treats any value within this distance of zero as zero
+ZERO_THRESHOLD = 1e-35
+
+
+class TreePredictor:
+    """Evaluates a LightGBM forest exported by scripts/train_model.export_tree_arrays.
+
+    The split thresholds of every feature cut the input space into a grid of cells in
+    which each tree, and therefore the whole forest, is constant. When that grid is
+    small enough (the model served here uses two features and a few hundred distinct
+    thresholds) the forest is compiled into a dense table holding the summed leaf values
+    of every cell, and a prediction becomes one binary search per feature plus a single
+    lookup. Otherwise all trees are walked in lockstep over the batch with numpy gathers.
+
+    The table compiled when the trees are first loaded is cached next to them, see load,
+    so that the workers loading them later map it rather than each compiling a private copy.
+
+    Args:
+        arrays (mapping): the arrays returned by export_tree_arrays, along with those of table_arrays if any.
+        max_table_size (int): the largest number of grid cells compiled into a table.
+        chunk_size (int): the number of rows walked at once when no table is compiled,
+                          bounding the (rows x trees) working arrays.
+    """
+
+    def __init__(self, arrays, max_table_size=2 ** 22, chunk_size=4096):
+        self.feature = np.asarray(arrays['feature'])
+        self.threshold = np.asarray(arrays['threshold'])
+        self.left = np.asarray(arrays['left'])
+        self.right = np.asarray(arrays['right'])
+        self.default_left = np.asarray(arrays['default_left'])
+        self.missing_type = np.asarray(arrays['missing_type'])
+        self.value = np.asarray(arrays['value'])
+        self.roots = np.asarray(arrays['roots'])
+        self.max_depth = int(arrays['max_depth'])
+        self.num_features = int(arrays['num_features'])
+        self.chunk_size = chunk_size
+        self.thresholds, self.table = None, None
+
+        if 'table' in arrays and np.size(arrays['table']) <= max_table_size:
+            self.thresholds = [np.asarray(arrays[f'table_thresholds_{feature}']) for feature in range(self.num_features)]
+            self.table = np.asarray(arrays['table'])
+            return
+        is_split = self.left != np.arange(len(self.left))
+        thresholds = [
+            np.unique(self.threshold[is_split & (self.feature == feature)])
+            for feature in range(self.num_features)
+        ]
+        table_size = np.prod([len(values) + 1 for values in thresholds], dtype=np.float64)
+        # the table assumes NaN reads as zero, which only holds without explicit missing routing
+        if table_size <= max_table_size and not np.any(self.missing_type[is_split] != MISSING_NONE):
+            self.thresholds = thresholds
+            self.table = self._compile(is_split)
+
+    def table_arrays(self):
+        """Returns the compiled table and the thresholds of its grid, to cache with the trees, empty without a table."""
+        if self.table is None:
+            return {}
+        arrays = {f'table_thresholds_{feature}': values for feature, values in enumerate(self.thresholds)}
+        arrays['table'] = self.table
+        return arrays
+
+    @classmethod
+    def load(cls, path, mmap=False, **kwargs):
+        """Loads the tree arrays saved by scripts/train_model.save_tree_arrays.
+
+        The table compiled from the trees is cached in the file of table_path, along with the
+        signature of the trees it was compiled from. Later loads of the same trees, e.g. by the
+        other workers reloading a retrained model, read or map the cached table instead of
+        compiling it again. The cache is compiled again once the trees are rewritten, and is
+        skipped when it cannot be written next to them.
+
+        Args:
+            path (str): the path of the .npz file.
+            mmap (bool): whether to memory-map the arrays instead of reading them, so that
+                         every process serving the same file shares one copy in the page cache.
+
+        Returns:
+            TreePredictor: a predictor over the saved trees.
+        """
+        signature = file_signature(path)
+        arrays = read_npz(path, mmap)
+        if 'table' not in arrays:
+            arrays.update(read_cached_table(path, signature, mmap))
+        predictor = cls(arrays, **kwargs)
+        if 'table' not in arrays and predictor.table is not None:
+            cache_table(path, signature, predictor.table_arrays())
+        return predictor
+
+    def predict(self, x_hat):
+        """Predicts the target for every row of the given feature matrix.
+
+        Args:
+            x_hat (array-like): an (n, num_features) feature matrix.
+
+        Raises:
+            ValueError: If the number of columns does not match the model.
+
+        Returns:
+            numpy.ndarray: the n predictions.
+        """
+        x_hat = np.asarray(x_hat, dtype=np.float64)
+        if x_hat.ndim != 2 or x_hat.shape[1] != self.num_features:
+            raise ValueError(f'expected an (n, {self.num_features}) feature matrix')
+        if self.table is not None:
+            x_hat = np.where(np.isnan(x_hat), 0.0, x_hat)
+            cells = tuple(
+                np.searchsorted(self.thresholds[feature], x_hat[:, feature], side='left')
+                for feature in range(self.num_features)
+            )
+            return self.table[cells]
+        predictions = np.empty(len(x_hat), dtype=np.float64)
+        for start in range(0, len(x_hat), self.chunk_size):
+            chunk = x_hat[start:start + self.chunk_size]
+            predictions[start:start + len(chunk)] = self._traverse(chunk, self.roots).sum(axis=1)
+        return predictions
+
+    def _compile(self, is_split):
+        """Sums the leaf values of every tree over the cells of the threshold grid."""
+        table = np.zeros([len(values) + 1 for values in self.thresholds])
+        tree_ends = np.append(self.roots[1:], len(self.feature))
+        for root, end in zip(self.roots, tree_ends):
+            tree = np.zeros(len(self.feature), dtype=bool)
+            tree[root:end] = True
+            local_thresholds = [
+                np.unique(self.threshold[tree & is_split & (self.feature == feature)])
+                for feature in range(self.num_features)
+            ]
+            # one point per local cell: the point just above each threshold crosses exactly
+            # the thresholds below it, and the lowest threshold itself crosses none
+            points = [
+                np.append(values[:1] if len(values) else 0.0, np.nextafter(values, np.inf))
+                for values in local_thresholds
+            ]
+            grid = np.stack(np.meshgrid(*points, indexing='ij'), axis=-1).reshape(-1, self.num_features)
+            leaves = self._traverse(grid, self.roots[root == self.roots]).reshape([len(p) for p in points])
+            # map every global cell to the local cell of this tree containing it
+            cells = np.ix_(*[
+                np.append(0, np.searchsorted(local, values, side='right'))
+                for local, values in zip(local_thresholds, self.thresholds)
+            ])
+            table += leaves[cells]
+        return table
+
+    def _traverse(self, chunk, roots):
+        """Walks the given trees for every row of chunk and returns the (rows x trees) leaf values."""
+        rows = np.arange(len(chunk))[:, None]
+        nodes = np.broadcast_to(roots, (len(chunk), len(roots)))
+        for _ in range(self.max_depth):
+            values = chunk[rows, self.feature[nodes]]
+            missing_type = self.missing_type[nodes]
+            is_nan = np.isnan(values)
+            # NaN is read as zero unless the split routes NaN explicitly
+            values = np.where(is_nan & (missing_type != MISSING_NAN), 0.0, values)
+            use_default = (
+                ((missing_type == MISSING_ZERO) & (np.abs(values) <= ZERO_THRESHOLD))
+                | ((missing_type == MISSING_NAN) & is_nan)
+            )
+            go_left = np.where(use_default, self.default_left[nodes], values <= self.threshold[nodes])
+            nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+        return self.value[nodes]
+
+
+def table_path(path):
+    """Returns the path of the file caching the table compiled from the trees saved at path."""
+    return os.path.splitext(path)[0] + '.table.npz'
+
+def file_signature(path):
+    """Returns the inode, modification time and size of a file, which change whenever it is rewritten."""
+    stat = os.stat(path)
+    return np.array([stat.st_ino, stat.st_mtime_ns, stat.st_size], dtype=np.int64)
+
+def read_npz(path, mmap=False):
+    """Reads, or memory-maps, every array of an .npz file."""
+    if mmap:
+        return mmap_npz(path)
+    with np.load(path) as arrays:
+        return dict(arrays)
+
+def read_cached_table(path, signature, mmap=False):
+    """Returns the arrays of the table cached for the trees saved at path, empty when none matches their signature."""
+    try:
+        arrays = read_npz(table_path(path), mmap)
+    except (OSError, ValueError):
+        return {}
+    if not np.array_equal(arrays.pop('signature', None), signature):
+        return {}
+    return arrays
+
+def cache_table(path, signature, arrays):
+    """Writes the arrays of a table compiled from the trees saved at path to its cache, through a renamed temporary file."""
+    cache_path = table_path(path)
+    tmp_path = os.path.join(os.path.dirname(cache_path), f'.{os.path.basename(cache_path)}.{os.getpid()}.tmp')
+    try:
+        # savez keeps the arrays uncompressed so that they can be memory-mapped
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, signature=signature, **arrays)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        logger.warning(f"Failed to cache the compiled table to {cache_path}. Error - {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def mmap_npz(path):
+    """Memory-maps every array of an uncompressed .npz file, as written by numpy.savez.
+
+    numpy.load ignores mmap_mode for .npz archives, but savez stores each member
+    as a plain .npy file, so the arrays can be mapped in place at their offsets.
+
+    Args:
+        path (str): the path of the .npz file.
+
+    Raises:
+        ValueError: If a member of the archive is compressed.
+
+    Returns:
+        dict: the read-only memory-mapped arrays, keyed by name.
+    """
+    arrays = {}
+    with zipfile.ZipFile(path) as archive, open(path, 'rb') as f:
+        for info in archive.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError(f'{info.filename} is compressed and cannot be memory-mapped')
+            # skip the local file header to reach the .npy member
+            f.seek(info.header_offset)
+            name_length, extra_length = struct.unpack('<HH', f.read(30)[26:30])
+            f.seek(info.header_offset + 30 + name_length + extra_length)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            name = info.filename[:-len('.npy')] if info.filename.endswith('.npy') else info.filename
+            if np.prod(shape) == 0:
+                arrays[name] = np.empty(shape, dtype=dtype)
+                continue
+            arrays[name] = np.memmap(path, dtype=dtype, mode='r', offset=f.tell(), shape=shape,
+                                     order='F' if fortran_order else 'C')
+    return arrays